@@ -0,0 +1,7 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+性能测试模块包
+包含离线压测和基准测试所需的工具，无需调用真实的DeepSeek API
+"""
@@ -0,0 +1,162 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+APIClient压测工具
+以目标请求速率驱动APIClient，统计延迟分位数、吞吐量和重试次数
+
+用法（在项目根目录下运行）：
+    # 启动内置模拟服务并压测
+    python -m benchmarks.api_load_test --start-mock --rps 20 --duration 30 --latency-ms 800 --burst-429-rate 0.01
+    # 压测已运行的服务（地址取自环境变量DEEPSEEK_API_URL）
+    python -m benchmarks.api_load_test --rps 5 --duration 60
+    # 启动两个模拟端点，测试延迟路由和对冲请求
+    python -m benchmarks.api_load_test --start-mock --mock-endpoints 2 --latency exponential --hedge-percentile 90
+
+说明：请求按固定间隔（开环）发出，延迟从计划发送时刻开始计算，
+因此客户端排队时间也会计入，避免压测工具本身掩盖尾延迟。
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.mock_llm_server import MockLLMServer, add_settings_arguments, settings_from_args
+
+
+def percentile(sorted_values, p):
+    """计算已排序数据的分位数（线性插值），p取值0-100"""
+    if not sorted_values:
+        return 0.0
+    k = (len(sorted_values) - 1) * p / 100.0
+    lower = int(k)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (k - lower)
+
+
+def run_load(client, rps, duration, concurrency):
+    """按目标速率发送请求，返回每个请求的延迟（秒）列表和实际耗时"""
+    latencies = []
+    lock = threading.Lock()
+    total = int(rps * duration)
+    interval = 1.0 / rps
+
+    def one_request(index, scheduled_at):
+        client.generate_response(
+            "压测用户",
+            f"第{index}个压测问题",
+            [{"sender": "压测用户", "question": "上一个问题", "response": "上一个回答"}],
+            "@专业助手bot"
+        )
+        with lock:
+            latencies.append(time.perf_counter() - scheduled_at)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for i in range(total):
+            scheduled_at = start + i * interval
+            delay = scheduled_at - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            executor.submit(one_request, i, scheduled_at)
+    elapsed = time.perf_counter() - start
+    return latencies, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='APIClient压测工具')
+    parser.add_argument('--rps', type=float, default=10.0, help='目标请求速率（次/秒）')
+    parser.add_argument('--duration', type=float, default=30.0, help='压测时长（秒）')
+    parser.add_argument('--concurrency', type=int, default=32, help='最大并发请求数')
+    parser.add_argument('--pool-size', type=int, default=None, help='覆盖Config.API_POOL_SIZE')
+    parser.add_argument('--read-timeout', type=float, default=None, help='覆盖Config.API_READ_TIMEOUT')
+    parser.add_argument('--max-retries', type=int, default=None, help='覆盖Config.API_MAX_RETRIES')
+    parser.add_argument('--retry-backoff', type=float, default=None, help='覆盖Config.API_RETRY_BACKOFF')
+    parser.add_argument('--stream', action='store_true', help='使用流式响应')
+    parser.add_argument('--json', action='store_true', help='以JSON格式输出结果')
+    parser.add_argument('--reply-deadline', type=float, default=None, help='覆盖Config.API_REPLY_DEADLINE')
+    parser.add_argument('--hedge-percentile', type=float, default=None, help='覆盖Config.API_HEDGE_PERCENTILE')
+    parser.add_argument('--no-hedge', action='store_true', help='禁用对冲请求')
+    parser.add_argument('--start-mock', action='store_true', help='在进程内启动模拟LLM服务')
+    parser.add_argument('--mock-endpoints', type=int, default=1, help='启动的模拟端点数量（多于1个时测试多端点路由）')
+    add_settings_arguments(parser)
+    args = parser.parse_args()
+
+    mocks = []
+    if args.start_mock:
+        for i in range(max(1, args.mock_endpoints)):
+            settings = settings_from_args(args)
+            if settings.seed is not None:
+                settings.seed += i
+            mocks.append(MockLLMServer(settings).start())
+        # Config在导入时读取环境变量，因此必须在导入APIClient之前设置
+        os.environ["DEEPSEEK_API_URL"] = mocks[0].url
+        os.environ.setdefault("DEEPSEEK_API_KEY", "mock-key")
+
+    from config import Config
+    from utils.api_client import APIClient
+
+    if args.pool_size is not None:
+        Config.API_POOL_SIZE = args.pool_size
+    if args.read_timeout is not None:
+        Config.API_READ_TIMEOUT = args.read_timeout
+    if args.max_retries is not None:
+        Config.API_MAX_RETRIES = args.max_retries
+    if args.retry_backoff is not None:
+        Config.API_RETRY_BACKOFF = args.retry_backoff
+    if args.stream:
+        Config.API_STREAM = True
+    if args.reply_deadline is not None:
+        Config.API_REPLY_DEADLINE = args.reply_deadline
+    if args.hedge_percentile is not None:
+        Config.API_HEDGE_PERCENTILE = args.hedge_percentile
+    if args.no_hedge:
+        Config.API_HEDGE_ENABLED = False
+    if len(mocks) > 1:
+        Config.API_ENDPOINTS = [{"name": f"mock{i}", "url": mock.url, "model": "mock-model"} for i, mock in enumerate(mocks)]
+
+    client = APIClient()
+    print(f"压测目标: {client.api_url}，速率 {args.rps}/s，时长 {args.duration}s，连接池 {Config.API_POOL_SIZE}", file=sys.stderr)
+
+    try:
+        latencies, elapsed = run_load(client, args.rps, args.duration, args.concurrency)
+    finally:
+        for mock in mocks:
+            mock.stop()
+
+    latencies.sort()
+    completed = len(latencies)
+    result = {
+        "target_rps": args.rps,
+        "completed": completed,
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(completed / elapsed, 3) if elapsed > 0 else 0.0,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 1),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 1),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 1),
+        "max_ms": round(latencies[-1] * 1000, 1) if latencies else 0.0,
+        "http_requests": client.stats["requests"],
+        "retries": client.stats["retries"],
+        "failed_replies": client.stats["errors"],
+        "hedged": client.stats["hedged"],
+        "hedge_wins": client.stats["hedge_wins"],
+        "failovers": client.stats["failovers"],
+        "deadline_fallbacks": client.stats["deadline_fallbacks"],
+        "endpoint_ewma_ms": {e.name: round(e.ewma * 1000, 1) if e.ewma is not None else None for e in client.endpoints},
+    }
+    for i, mock in enumerate(mocks):
+        result[f"server{i}"] = dict(mock.stats)
+
+    if args.json:
+        print(json.dumps(result, ensure_ascii=False))
+    else:
+        print("\n=== 压测结果 ===")
+        for key, value in result.items():
+            print(f"{key:<16} {value}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,416 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+端到端回放基准测试
+用回放截图源、模拟LLM服务和不操作界面的发送后端驱动完整的WeChatBot流程
+（截图 -> 帧差异 -> OCR -> 检测 -> API回复 -> 发送），无需win32、微信窗口和桌面环境，可在Linux上运行。
+输出帧率、每帧OCR耗时、从@到回复发出的延迟、CPU时间和峰值内存，并可写入JSON结果文件，用于在不同提交之间对比。
+
+截图序列有两种来源：
+  - 合成（默认）：按固定种子生成群聊画面，每隔几条消息出现一条@机器人的提问，OCR结果与画面一一对应
+  - 追踪记录：TraceRecorder记录的追踪（--trace），使用记录中的OCR原始结果，画面取自快照或按帧哈希生成
+
+用法示例：
+    python -m benchmarks.e2e_replay --frames 500 --quiet
+    python -m benchmarks.e2e_replay --frames 500 --ocr-ms 300 --llm-latency-ms 800 --runtime async --quiet
+    python -m benchmarks.e2e_replay --trace traces --quiet --output results/e2e.json
+    python -m benchmarks.e2e_replay --quiet --compare results/e2e.json --max-regression 10
+
+说明：CPU时间包含进程内模拟LLM服务的线程，--ocr-ms模拟的OCR耗时为sleep，不计入CPU时间。
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import logging
+import argparse
+import platform
+import tempfile
+import subprocess
+from datetime import datetime
+
+import numpy as np
+
+from benchmarks.mock_llm_server import MockLLMServer, MockLLMSettings
+from benchmarks.trace_replay import summarize_ms
+
+RESULT_FORMAT_VERSION = 1
+
+# 对比时关注的指标：(结果中的路径, 说明, 数值越大越好)
+COMPARE_METRICS = [
+    (("fps",), "帧率（帧/秒）", True),
+    (("ocr_ms", "mean"), "OCR平均耗时（ms/帧）", False),
+    (("mention_to_reply_ms", "p50"), "@到回复 p50（ms）", False),
+    (("mention_to_reply_ms", "p95"), "@到回复 p95（ms）", False),
+    (("cpu_ms_per_frame",), "每帧CPU时间（ms）", False),
+    (("peak_rss_mb",), "峰值内存（MB）", False),
+]
+
+# 合成聊天内容使用的常用汉字，随机组合使问题之间的相似度足够低，不会被重复问题检查过滤
+QUESTION_CHARS = "天气今明后周末电影音乐推荐怎么样为什么可以吗学习工作旅行美食游戏手机电脑健康运动睡觉早餐午饭晚上朋友家人城市海边山上书籍历史科学数学英语考试假期计划"
+CHAT_CHARS = "哈好的收到谢谢没问题在吗来了走吧等我一下真的假的太棒了笑死我了明白了"
+
+
+def make_box(x, y, width, height=24):
+    """PaddleOCR格式的文字框四个顶点"""
+    return [[x, y], [x + width, y], [x + width, y + height], [x, y + height]]
+
+
+class SyntheticChat:
+    def __init__(self, frames, frames_per_message=3, mention_every=4, seed=0, width=960, height=720):
+        """合成的群聊截图序列
+
+        Args:
+            frames: 总帧数
+            frames_per_message: 每条新消息之间的帧数（其余帧画面不变，用于检验帧差异检测）
+            mention_every: 每隔几条消息出现一条@机器人的提问
+            seed: 随机数种子，保证每次生成相同的序列
+        """
+        self.frames = frames
+        self.frames_per_message = max(1, frames_per_message)
+        self.mention_every = max(1, mention_every)
+        self.seed = seed
+        self.width = width
+        self.height = height
+        self.mentions = 0
+
+    def __iter__(self):
+        from config import Config
+        rng = random.Random(self.seed)
+        roles = [role.name for role in Config.ROLE_REGISTRY.roles]
+        users = [user['name'] for user in Config.USER_NAMES] or [Config.DEFAULT_USER_NAME]
+        visible = []  # [(发送者, 内容)]，只保留画面中能显示的最近几条
+        max_visible = (self.height - 80) // 60
+        messages = 0
+        image, lines = self._render(visible)
+        for frame in range(self.frames):
+            if frame % self.frames_per_message == 0:
+                messages += 1
+                sender = rng.choice(users)
+                if messages % self.mention_every == 0:
+                    question = "".join(rng.choice(QUESTION_CHARS) for _ in range(rng.randint(8, 16)))
+                    text = f"{rng.choice(roles)} {question}"
+                    self.mentions += 1
+                else:
+                    text = "".join(rng.choice(CHAT_CHARS) for _ in range(rng.randint(2, 10)))
+                visible = (visible + [(sender, text)])[-max_visible:]
+                image, lines = self._render(visible)
+            yield image, lines
+
+    def _render(self, visible):
+        """按可见消息绘制画面，并生成对应的OCR原始结果"""
+        from config import Config
+        image = np.full((self.height, self.width, 3), 235, dtype=np.uint8)
+        lines = [[make_box(20, 10, 300), (Config.WECHAT_WINDOW_NAME, 0.99)]]
+        image[10:34, 20:320] = 60
+        y = 60
+        for sender, text in visible:
+            # 每条消息画成两个灰度由内容决定的色块，消息滚动时画面随之变化
+            shade = 40 + sum(map(ord, text)) % 150
+            text_width = min(self.width - 100, 40 + 18 * len(text))
+            image[y:y + 20, 80:80 + 12 * len(sender)] = 120
+            image[y + 26:y + 50, 80:80 + text_width] = shade
+            lines.append([make_box(80, y, 12 * len(sender), 20), (sender, 0.98)])
+            lines.append([make_box(80, y + 26, text_width), (text, 0.97)])
+            y += 60
+        return image, lines
+
+
+class TraceFrames:
+    def __init__(self, path):
+        """从TraceRecorder记录的追踪中读取截图序列"""
+        self.path = path
+        self.mentions = None
+
+    def __iter__(self):
+        from utils.trace_recorder import iter_trace, decode_snapshot
+        images = {}
+        self.mentions = 0
+        for record in iter_trace(self.path):
+            lines = [[box, (text, confidence)] for text, confidence, box in record.get("ocr", [])]
+            if record.get("decision"):
+                self.mentions += 1
+            yield self._image(record, images, decode_snapshot(record)), lines
+
+    @staticmethod
+    def _image(record, images, snapshot):
+        if snapshot is not None:
+            import cv2
+            image = cv2.imdecode(np.frombuffer(snapshot, dtype=np.uint8), cv2.IMREAD_COLOR)
+            if image is not None:
+                return image
+        # 没有快照时按帧哈希生成画面：哈希相同的帧画面相同，帧差异检测的结果与记录时一致
+        key = record.get("frame_hash") or str(record.get("frame"))
+        if key not in images:
+            rng = np.random.default_rng(int(key, 16) if record.get("frame_hash") else abs(hash(key)))
+            images[key] = rng.integers(0, 256, size=(180, 320, 3), dtype=np.uint8)
+        return images[key]
+
+
+class ReplayWindowManager:
+    wechat_hwnd = 1
+
+    def __init__(self, frames):
+        """回放截图源，代替WindowManager，按顺序返回截图序列中的画面"""
+        self.frames = iter(frames)
+        self.lines_by_image = {}
+        self.captured = 0
+        self.exhausted = False
+
+    def find_wechat_window(self):
+        return self.wechat_hwnd
+
+    def is_window_minimized(self):
+        return False
+
+    def capture_wechat_screen(self):
+        try:
+            image, lines = next(self.frames)
+        except StopIteration:
+            self.exhausted = True
+            return None
+        self.captured += 1
+        # 主循环和异步运行时都在上一帧OCR完成后才截取下一帧，只需保留最新一帧的识别结果
+        self.lines_by_image = {id(image): lines}
+        return image
+
+
+class ReplayOCREngine:
+    def __init__(self, window_manager, latency_ms=0.0):
+        """代替PaddleOCR的引擎：返回截图源中与画面对应的OCR结果，可模拟识别耗时"""
+        self.window_manager = window_manager
+        self.latency = latency_ms / 1000.0
+
+    def ocr(self, image, cls=True):
+        if self.latency > 0:
+            time.sleep(self.latency)
+        return [self.window_manager.lines_by_image.get(id(image)) or None]
+
+
+def peak_rss_mb():
+    """进程的峰值常驻内存（MB），无法获取时返回None"""
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux以KB为单位，macOS以字节为单位
+        return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+    except ImportError:
+        pass
+    try:
+        import psutil
+        return psutil.Process().memory_info().peak_wset / (1024 * 1024)
+    except (ImportError, AttributeError):
+        return None
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              timeout=5, check=True).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def run_sync(bot, window_manager):
+    frame_no = 0
+    while not window_manager.exhausted:
+        frame_no = bot.process_frame(frame_no)
+    # 回放结束后回复调度队列中剩余的消息
+    while bot.reply_scheduler and bot.reply_next():
+        pass
+    bot.shutdown()
+
+
+def run_async(bot, window_manager):
+    from core.async_runtime import AsyncBotRuntime
+    runtime = AsyncBotRuntime(bot)
+
+    async def drive():
+        task = asyncio.create_task(runtime.main())
+        while not window_manager.exhausted and not task.done():
+            await asyncio.sleep(0.01)
+        # 等待回复调度队列中剩余的消息回复完成
+        while not task.done() and (runtime.reply_tasks or (bot.reply_scheduler and bot.reply_scheduler.depth())):
+            await asyncio.sleep(0.01)
+        runtime.stop()
+        await task
+
+    asyncio.run(drive())
+
+
+def run_benchmark(frames, runtime='sync', ocr_ms=0.0):
+    """驱动WeChatBot回放截图序列，返回测量结果"""
+    from core.bot import WeChatBot
+    from core.fake_sender import FakeMessageSender
+    from utils.ocr_handler import OCRHandler
+    from utils.metrics import metrics
+
+    window_manager = ReplayWindowManager(frames)
+    sender = FakeMessageSender()
+    bot = WeChatBot(window_manager=window_manager,
+                    ocr_handler=OCRHandler(engine=ReplayOCREngine(window_manager, ocr_ms)),
+                    message_sender=sender)
+
+    cpu_start = time.process_time()
+    start = time.perf_counter()
+    if runtime == 'async':
+        run_async(bot, window_manager)
+    else:
+        run_sync(bot, window_manager)
+    elapsed = time.perf_counter() - start
+    cpu = time.process_time() - cpu_start
+
+    stages = {dict(labels).get("stage"): [s * 1000 for s in samples]
+              for labels, (_, _, samples) in metrics.stage_latency.snapshot().items()}
+    counters = {name: counter.total() for name, counter in metrics.counters.items()}
+    captured = window_manager.captured
+    return {
+        "frames_captured": captured,
+        "frames_processed": len(stages.get("ocr", [])),
+        "frames_unchanged": counters.get("frames_unchanged", 0),
+        "mentions_detected": counters.get("mentions", 0),
+        "mentions_expected": frames.mentions,
+        "replies_sent": len(sender.sent),
+        "errors": counters.get("errors", 0),
+        "elapsed_s": round(elapsed, 3),
+        "fps": round(captured / elapsed, 2) if elapsed > 0 else 0.0,
+        "cpu_s": round(cpu, 3),
+        "cpu_ms_per_frame": round(cpu / captured * 1000, 3) if captured else None,
+        "peak_rss_mb": round(peak_rss_mb(), 1) if peak_rss_mb() is not None else None,
+        "ocr_ms": summarize_ms(stages.get("ocr", [])),
+        "mention_to_reply_ms": summarize_ms(stages.get("mention_to_reply", [])),
+        "stages_ms": {stage: summarize_ms(values) for stage, values in sorted(stages.items())},
+    }
+
+
+def metric_value(results, path):
+    value = results
+    for key in path:
+        if not isinstance(value, dict) or value.get(key) is None:
+            return None
+        value = value[key]
+    return value
+
+
+def compare(results, baseline, max_regression=None):
+    """与基线结果对比，返回(对比行, 是否有指标退化超过max_regression百分比)"""
+    lines = []
+    regressed = False
+    for path, label, higher_is_better in COMPARE_METRICS:
+        current, previous = metric_value(results, path), metric_value(baseline["results"], path)
+        if current is None or previous is None:
+            continue
+        change = (current - previous) / previous * 100 if previous else 0.0
+        worse = change < 0 if higher_is_better else change > 0
+        flag = ""
+        if max_regression is not None and worse and abs(change) > max_regression:
+            regressed = True
+            flag = "  <-- 退化"
+        lines.append(f"{label:<20} {previous:>10.2f} -> {current:>10.2f}  ({change:+.1f}%){flag}")
+    return lines, regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='端到端回放基准测试（无需微信窗口和win32）')
+    parser.add_argument('--trace', default=None, help='回放TraceRecorder记录的追踪（目录或分段文件），默认使用合成截图序列')
+    parser.add_argument('--frames', type=int, default=300, help='合成序列的帧数')
+    parser.add_argument('--frames-per-message', type=int, default=3, help='合成序列中每条新消息之间的帧数')
+    parser.add_argument('--mention-every', type=int, default=4, help='合成序列中每隔几条消息出现一次@机器人')
+    parser.add_argument('--seed', type=int, default=0, help='合成序列和模拟服务的随机数种子')
+    parser.add_argument('--runtime', choices=['sync', 'async'], default='sync', help='使用同步主循环或异步运行时')
+    parser.add_argument('--ocr-ms', type=float, default=0.0, help='模拟每帧OCR耗时（毫秒）')
+    parser.add_argument('--llm-latency-ms', type=float, default=200.0, help='模拟LLM服务的平均延迟（毫秒）')
+    parser.add_argument('--no-send-queue', action='store_true', help='不使用后台发送队列')
+    parser.add_argument('--no-frame-diff', action='store_true', help='关闭帧差异检测，每帧都进行OCR')
+    parser.add_argument('--rate-limit', action='store_true', help='保留回复限流（回放时间远短于真实时间，默认关闭）')
+    parser.add_argument('--output', default=None, help='将结果写入JSON文件')
+    parser.add_argument('--compare', default=None, help='与之前写入的JSON结果对比')
+    parser.add_argument('--max-regression', type=float, default=None, help='对比时任一指标退化超过该百分比则以非零状态退出')
+    parser.add_argument('--quiet', action='store_true', help='只输出WARNING及以上级别的日志')
+    parser.add_argument('--json', action='store_true', help='以JSON格式输出结果')
+    args = parser.parse_args()
+
+    mock = MockLLMServer(MockLLMSettings(latency='fixed', latency_ms=args.llm_latency_ms, seed=args.seed)).start()
+    # Config在导入时读取环境变量，因此必须在导入config之前设置
+    os.environ["DEEPSEEK_API_URL"] = mock.url
+    os.environ.setdefault("DEEPSEEK_API_KEY", "mock-key")
+
+    from config import Config, logger
+
+    if args.quiet:
+        logger.setLevel(logging.WARNING)
+
+    try:
+        with tempfile.TemporaryDirectory() as temp_dir:
+            # 不写入真实的对话历史，不启动指标服务、角色热加载和追踪记录
+            Config.CHAT_HISTORY_DIR = temp_dir
+            Config.METRICS_ENABLED = False
+            Config.METRICS_SUMMARY_INTERVAL = 0
+            Config.ROLE_HOT_RELOAD = False
+            Config.TRACE_ENABLED = False
+            Config.SCREENSHOT_INTERVAL = 0
+            Config.ASYNC_METRICS_INTERVAL = 0
+            Config.API_ENDPOINTS = []
+            Config.SEND_QUEUE_ENABLED = not args.no_send_queue
+            Config.FRAME_DIFF_ENABLED = not args.no_frame_diff
+            Config.RATE_LIMIT_ENABLED = args.rate_limit
+
+            if args.trace:
+                frames = TraceFrames(args.trace)
+            else:
+                frames = SyntheticChat(args.frames, args.frames_per_message, args.mention_every, args.seed)
+            results = run_benchmark(frames, args.runtime, args.ocr_ms)
+    finally:
+        mock.stop()
+
+    report = {
+        "benchmark": "e2e_replay",
+        "version": RESULT_FORMAT_VERSION,
+        "commit": git_commit(),
+        "timestamp": datetime.now().isoformat(timespec='seconds'),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "params": {key: value for key, value in vars(args).items()
+                   if key not in ('output', 'compare', 'max_regression', 'quiet', 'json')},
+        "results": results,
+    }
+
+    if args.output:
+        directory = os.path.dirname(args.output)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    else:
+        r = results
+        print(f"\n=== 端到端回放结果（{args.runtime}，提交 {report['commit'] or '未知'}）===")
+        print(f"截图 {r['frames_captured']} 帧，OCR {r['frames_processed']} 帧，画面未变化跳过 {r['frames_unchanged']} 帧，"
+              f"用时 {r['elapsed_s']:.2f}s，{r['fps']:.1f} 帧/秒")
+        expected = r['mentions_expected'] if r['mentions_expected'] is not None else '?'
+        print(f"@消息: 预期 {expected}，检测到 {r['mentions_detected']}，已发送回复 {r['replies_sent']}，错误 {r['errors']}")
+        print(f"CPU时间 {r['cpu_s']:.2f}s（每帧 {r['cpu_ms_per_frame']}ms），峰值内存 {r['peak_rss_mb']}MB")
+        for stage, d in r["stages_ms"].items():
+            if d:
+                print(f"  {stage:<18} n={d['count']:<6} 平均 {d['mean']:.2f}ms  p50 {d['p50']:.2f}ms  "
+                      f"p95 {d['p95']:.2f}ms  最大 {d['max']:.2f}ms")
+
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        lines, regressed = compare(results, baseline, args.max_regression)
+        print(f"\n=== 与基线对比（提交 {baseline.get('commit') or '未知'}）===", file=sys.stderr if args.json else sys.stdout)
+        for line in lines:
+            print(line, file=sys.stderr if args.json else sys.stdout)
+        if regressed:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
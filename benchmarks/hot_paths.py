@@ -0,0 +1,471 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+热点函数微基准测试
+用合成的OCR结果、角色、用户和对话历史测量每帧/每条@消息都会执行的纯Python函数：
+  MessageDetector.detect_trigger、OCRHandler.infer_sender_name、OCRHandler.is_next_line、
+  ChatHistoryManager.is_similar_question、is_question_already_answered、get_context_history、
+  Config.get_role_system_prompt、TextDiffer.new_lines
+每个函数在一个维度（OCR行数、角色数、别名数、用户数、历史长度、问题长度）上按规模扫描，
+输出每次调用耗时和拟合的增长指数（耗时 ∝ 规模^k），复杂度退化会表现为曲线斜率的变化。
+另外在子进程中测量 config 和 core.bot 的导入耗时。
+
+用法示例：
+    python -m benchmarks.hot_paths
+    python -m benchmarks.hot_paths --quick --only detect_trigger
+    python -m benchmarks.hot_paths --output results/hot_paths.json
+    python -m benchmarks.hot_paths --compare results/hot_paths.json --max-regression 20
+
+说明：默认只输出WARNING及以上级别的日志，测量的是函数本身的逻辑；--with-logging 会把这些函数的INFO日志开销计入。
+"""
+
+import os
+import sys
+import json
+import math
+import time
+import random
+import logging
+import argparse
+import platform
+import tempfile
+import statistics
+import subprocess
+from datetime import datetime
+
+from benchmarks.e2e_replay import git_commit
+
+RESULT_FORMAT_VERSION = 1
+
+# 合成文本使用的字符：历史问题和待检查的问题取自不相交的字符集，保证重复检查会扫描全部历史
+CHAT_CHARS = "哈好的收到谢谢没问题在吗来了走吧等我一下真的假的太棒了笑死我明白"
+HISTORY_CHARS = "天气今明后周末电影音乐推荐怎么样为什么可以学习工作旅行美食游戏"
+QUERY_CHARS = "手机电脑健康运动睡觉早餐午饭晚上朋友家人城市海边山上书籍历史科"
+
+# 各维度的默认规模
+SCALES = {
+    "lines": [10, 50, 200, 1000],
+    "roles": [5, 20, 100, 500],
+    "aliases": [1, 4, 16, 64],
+    "users": [1, 10, 100, 1000],
+    "history": [5, 20, 100, 500],
+    "length": [10, 40, 160, 640],
+}
+
+
+def random_text(rng, chars, low, high):
+    return "".join(rng.choice(chars) for _ in range(rng.randint(low, high)))
+
+
+def make_roles(count, aliases):
+    """合成角色索引：count个角色，每个角色aliases个别名"""
+    from roles.registry import Role, RoleIndex
+    roles = []
+    for i in range(count):
+        config = {
+            "name": f"@角色{i}bot",
+            "aliases": [f"@角色{i}x{j}bot" for j in range(aliases)],
+            "system_prompt": f"你是角色{i}。" * 20,
+        }
+        roles.append(Role(config))
+    return RoleIndex(roles)
+
+
+def make_users(count):
+    return [{"name": f"用户{i}", "aliases": [f"用户{i}a", f"用户{i}b"]} for i in range(count)]
+
+
+def make_texts(rng, lines, mention=None, mention_sender=None):
+    """合成一帧OCR结果[(文本, 置信度, 位置)]，@消息（如有）位于最后，检测时需要扫描全部行"""
+    texts = [("你的微信群名称", 0.99, [[20, 10], [320, 10], [320, 34], [20, 34]])]
+    for i in range(lines - 1 - (2 if mention else 0)):
+        y = 60 + 30 * i
+        texts.append((random_text(rng, CHAT_CHARS, 2, 20), 0.95, [[80, y], [400, y], [400, y + 24], [80, y + 24]]))
+    if mention:
+        y = 60 + 30 * lines
+        texts.append((mention_sender, 0.98, [[80, y], [200, y], [200, y + 20], [80, y + 20]]))
+        texts.append((mention, 0.97, [[80, y + 26], [600, y + 26], [600, y + 50], [80, y + 50]]))
+    return texts
+
+
+class Fixture:
+    # 基准测试会修改的配置项，结束后恢复
+    SETTINGS = ("USER_NAMES", "MAX_API_HISTORY_LENGTH", "DUPLICATE_CHECK_HISTORY_LENGTH", "CHAT_HISTORY_DIR",
+                "DUPLICATE_CHECK_WINDOW_MINUTES", "DUPLICATE_CHECK_WINDOW_MAX_RECORDS", "HISTORY_WRITE_BEHIND",
+                "HISTORY_RETRIEVAL_ENABLED")
+
+    def __init__(self, history_dir):
+        """基准测试的公共环境：临时历史目录、可替换的角色索引和用户列表"""
+        from config import Config
+        self.Config = Config
+        self.history_dir = history_dir
+        self.original_index = Config.ROLE_REGISTRY.index
+        self.original_settings = {name: getattr(Config, name) for name in self.SETTINGS}
+        self.managers = []
+
+    def use_roles(self, index):
+        self.Config.ROLE_REGISTRY.index = index
+
+    def use_users(self, users):
+        self.Config.USER_NAMES = users
+
+    def history_manager(self, history_length=5, role=None):
+        from utils.chat_history import ChatHistoryManager
+        Config = self.Config
+        Config.MAX_API_HISTORY_LENGTH = max(1, history_length)
+        Config.DUPLICATE_CHECK_HISTORY_LENGTH = history_length
+        Config.CHAT_HISTORY_DIR = tempfile.mkdtemp(dir=self.history_dir)
+        manager = ChatHistoryManager()
+        if role:
+            manager.switch_role(role)
+        self.managers.append(manager)
+        return manager
+
+    def restore(self):
+        for manager in self.managers:
+            manager.close()
+        self.Config.ROLE_REGISTRY.index = self.original_index
+        for name, value in self.original_settings.items():
+            setattr(self.Config, name, value)
+
+
+def bench_detect_trigger(fixture, dimension, size, next_line=False):
+    """检测一帧中的@消息，默认规模：50行、20个角色、每个角色4个别名、10个用户"""
+    from utils.ocr_handler import OCRHandler
+    from core.message_detector import MessageDetector
+    rng = random.Random(size)
+    lines = size if dimension == "lines" else 50
+    roles = size if dimension == "roles" else 20
+    aliases = size if dimension == "aliases" else 4
+    users = size if dimension == "users" else 10
+    index = make_roles(roles, aliases)
+    fixture.use_roles(index)
+    fixture.use_users(make_users(users))
+    role = index.roles[-1]
+    # 使用最后一个角色的最后一个别名，正则需要尝试最多的分支
+    trigger = role.aliases[-1] if role.aliases else role.name
+    # next_line为True时问题位于下一行，检测需要查找位置相邻的文本
+    mention = trigger if next_line else f"{trigger} {random_text(rng, QUERY_CHARS, 8, 16)}"
+    texts = make_texts(rng, lines, mention, f"用户{users - 1}")
+    if next_line:
+        y = texts[-1][2][2][1] + 6
+        texts.append((random_text(rng, QUERY_CHARS, 8, 16), 0.96, [[80, y], [500, y], [500, y + 24], [80, y + 24]]))
+    ocr_handler = OCRHandler(engine=object())
+    ocr_handler.last_recognized_texts = texts
+    detector = MessageDetector(ocr_handler, fixture.history_manager(5, role.name))
+    return lambda: detector.detect_trigger(texts)
+
+
+def bench_infer_sender(fixture, dimension, size):
+    """从上一帧OCR结果推断发送者，默认规模：50行、20个角色、10个用户（发送者为列表中最后一个用户）"""
+    from utils.ocr_handler import OCRHandler
+    rng = random.Random(size)
+    lines = size if dimension == "lines" else 50
+    users = size if dimension == "users" else 10
+    index = make_roles(20, 4)
+    fixture.use_roles(index)
+    fixture.use_users(make_users(users))
+    texts = make_texts(rng, lines, f"{index.roles[-1].name} 你好", f"用户{users - 1}")
+    ocr_handler = OCRHandler(engine=object())
+    ocr_handler.last_recognized_texts = texts
+    return lambda: ocr_handler.infer_sender_name(index)
+
+
+def bench_is_next_line(fixture, dimension, size):
+    """对一帧中所有相邻行调用is_next_line（检测问题位于下一行时的每帧开销）"""
+    from utils.ocr_handler import OCRHandler
+    texts = make_texts(random.Random(size), size)
+    ocr_handler = OCRHandler(engine=object())
+    positions = [position for _, _, position in texts]
+    pairs = list(zip(positions, positions[1:]))
+
+    def run():
+        for current, following in pairs:
+            ocr_handler.is_next_line(current, following)
+    return run
+
+
+def bench_text_diff(fixture, dimension, size):
+    """与上一帧比对size行OCR结果，模拟新消息把聊天记录向上推了两行（发送者和消息）"""
+    from utils.text_diff import TextDiffer
+    rng = random.Random(size)
+    lines = make_texts(rng, size + 2)
+    # 两帧中相同的文本行位于不同的纵坐标
+    previous = [(text, confidence, position) for text, confidence, position in lines[:size]]
+    current = [(text, confidence, [[x, y - 60] for x, y in position]) for text, confidence, position in lines[2:]]
+    differ = TextDiffer(2, 1)
+
+    def run():
+        differ.reset()
+        differ.new_lines(previous)
+        differ.new_lines(current)
+    return run
+
+
+def bench_similar_question(fixture, dimension, size):
+    """比较两个长度为size的问题"""
+    rng = random.Random(size)
+    manager = fixture.history_manager(5)
+    first = random_text(rng, HISTORY_CHARS, size, size)
+    second = random_text(rng, QUERY_CHARS, size, size)
+    return lambda: manager.is_similar_question(first, second)
+
+
+def bench_already_answered(fixture, dimension, size, window=False):
+    """在size轮历史中检查重复问题（问题与历史都不相似，需要扫描全部历史）
+
+    window为True时使用时间窗口模式（DUPLICATE_CHECK_WINDOW_MINUTES），从存储中读取最近size条记录
+    """
+    rng = random.Random(size)
+    Config = fixture.Config
+    Config.DUPLICATE_CHECK_WINDOW_MINUTES = 60 if window else 0
+    Config.DUPLICATE_CHECK_WINDOW_MAX_RECORDS = size
+    manager = fixture.history_manager(size)
+    for i in range(size):
+        manager.add_chat(f"用户{i % 10}", random_text(rng, HISTORY_CHARS, 12, 20), "好的")
+    question = random_text(rng, QUERY_CHARS, 12, 20)
+    return lambda: manager.is_question_already_answered(question, "用户0")
+
+
+def bench_context_history(fixture, dimension, size):
+    """在size轮历史中检索与问题相关的早期对话并取最近几轮（HISTORY_RETRIEVAL_ENABLED）"""
+    rng = random.Random(size)
+    fixture.Config.HISTORY_RETRIEVAL_ENABLED = True
+    manager = fixture.history_manager(size)
+    for i in range(size):
+        manager.add_chat(f"用户{i % 10}", random_text(rng, HISTORY_CHARS, 12, 20), random_text(rng, HISTORY_CHARS, 30, 60))
+    question = random_text(rng, HISTORY_CHARS, 12, 20)
+    return lambda: manager.get_context_history(question)
+
+
+def bench_system_prompt(fixture, dimension, size, unknown=False):
+    """按名称（或未知角色的任意文本）获取系统提示词"""
+    index = make_roles(size, 4)
+    fixture.use_roles(index)
+    name = f"未知角色{size}" if unknown else index.roles[-1].name
+    return lambda: fixture.Config.get_role_system_prompt(name)
+
+
+# (基准名称, 扫描维度, 构造函数)
+BENCHMARKS = [
+    ("detect_trigger", "lines", bench_detect_trigger),
+    ("detect_trigger", "roles", bench_detect_trigger),
+    ("detect_trigger", "aliases", bench_detect_trigger),
+    ("detect_trigger", "users", bench_detect_trigger),
+    ("detect_trigger_next_line", "lines", lambda f, d, s: bench_detect_trigger(f, d, s, next_line=True)),
+    ("infer_sender_name", "lines", bench_infer_sender),
+    ("infer_sender_name", "users", bench_infer_sender),
+    ("is_next_line", "lines", bench_is_next_line),
+    ("text_diff", "lines", bench_text_diff),
+    ("is_similar_question", "length", bench_similar_question),
+    ("is_question_already_answered", "history", bench_already_answered),
+    ("is_question_already_answered_window", "history", lambda f, d, s: bench_already_answered(f, d, s, window=True)),
+    ("get_context_history", "history", bench_context_history),
+    ("get_role_system_prompt", "roles", bench_system_prompt),
+    ("get_role_system_prompt_unknown", "roles", lambda f, d, s: bench_system_prompt(f, d, s, unknown=True)),
+]
+
+
+def measure(func, min_time=0.05, repeat=5):
+    """测量func每次调用的耗时（微秒）：先确定循环次数使单轮耗时不少于min_time，取repeat轮中的最小值"""
+    loops = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(loops):
+            func()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time or loops >= 1 << 20:
+            break
+        loops *= 2 if elapsed == 0 else max(2, min(10, int(min_time / elapsed) + 1))
+    best = elapsed
+    for _ in range(repeat - 1):
+        start = time.perf_counter()
+        for _ in range(loops):
+            func()
+        best = min(best, time.perf_counter() - start)
+    return best / loops * 1e6
+
+
+def growth_exponent(points):
+    """对(规模, 耗时)做对数线性拟合，返回斜率k（耗时 ∝ 规模^k）"""
+    points = [(size, us) for size, us in points if size > 0 and us > 0]
+    if len(points) < 2:
+        return None
+    xs = [math.log(size) for size, _ in points]
+    ys = [math.log(us) for _, us in points]
+    mean_x, mean_y = sum(xs) / len(xs), sum(ys) / len(ys)
+    denominator = sum((x - mean_x) ** 2 for x in xs)
+    if denominator == 0:
+        return None
+    return sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys)) / denominator
+
+
+def run_micro(only=None, quick=False, min_time=0.05, repeat=5, out=sys.stdout):
+    results = []
+    with tempfile.TemporaryDirectory() as history_dir:
+        fixture = Fixture(history_dir)
+        # 历史写入在主线程中同步完成，测量时不受后台线程影响
+        fixture.Config.HISTORY_WRITE_BEHIND = False
+        try:
+            for name, dimension, build in BENCHMARKS:
+                if only and not any(pattern in name for pattern in only):
+                    continue
+                sizes = SCALES[dimension][:3] if quick else SCALES[dimension]
+                points = []
+                for size in sizes:
+                    func = build(fixture, dimension, size)
+                    points.append((size, measure(func, min_time, repeat)))
+                exponent = growth_exponent(points)
+                results.append({
+                    "name": name, "dimension": dimension,
+                    "points": [{"size": size, "us": round(us, 3)} for size, us in points],
+                    "exponent": round(exponent, 3) if exponent is not None else None,
+                })
+                print(format_result(results[-1]), file=out, flush=True)
+        finally:
+            fixture.restore()
+    return results
+
+
+def format_result(result):
+    points = "  ".join(f"{p['size']}: {p['us']:.2f}µs" for p in result["points"])
+    exponent = f"~O(n^{result['exponent']:.2f})" if result["exponent"] is not None else ""
+    return f"{result['name']:<38} [{result['dimension']:<7}] {points}  {exponent}"
+
+
+def measure_imports(modules, repeat=5):
+    """在新的子进程中测量模块导入耗时（不含解释器启动），并用-X importtime找出最慢的依赖"""
+    env = dict(os.environ)
+    env.setdefault("DEEPSEEK_API_KEY", "mock-key")
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    results = {}
+    for module in modules:
+        code = f"import time; start = time.perf_counter(); import {module}; print(time.perf_counter() - start)"
+        samples = []
+        slowest = []
+        for i in range(repeat):
+            command = [sys.executable] + (["-X", "importtime"] if i == 0 else []) + ["-c", code]
+            completed = subprocess.run(command, capture_output=True, text=True, cwd=root, env=env, timeout=300)
+            if completed.returncode != 0:
+                results[module] = {"error": completed.stderr.strip().splitlines()[-1:]}
+                break
+            samples.append(float(completed.stdout.strip().splitlines()[-1]) * 1000)
+            if i == 0:
+                slowest = parse_importtime(completed.stderr)
+        else:
+            # 第一次运行开启了-X importtime（有额外开销），只用于找出最慢的依赖
+            timed = samples[1:] or samples
+            results[module] = {"min_ms": round(min(timed), 1), "median_ms": round(statistics.median(timed), 1),
+                               "slowest_self_ms": slowest}
+    return results
+
+
+def parse_importtime(stderr, top=8):
+    """解析-X importtime的输出，返回自身耗时最长的若干模块"""
+    entries = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        parts = line[len("import time:"):].split("|")
+        try:
+            self_us = int(parts[0])
+        except ValueError:
+            continue
+        entries.append((self_us, parts[2].strip()))
+    entries.sort(reverse=True)
+    return [[name, round(us / 1000, 1)] for us, name in entries[:top]]
+
+
+def compare(report, baseline, max_regression=None):
+    """按(名称, 维度, 规模)与基线对比，返回(对比行, 是否有退化超过max_regression百分比)"""
+    lines, regressed = [], False
+    previous = {(r["name"], r["dimension"], p["size"]): p["us"]
+                for r in baseline.get("micro", []) for p in r["points"]}
+    for r in report["micro"]:
+        for p in r["points"]:
+            before = previous.get((r["name"], r["dimension"], p["size"]))
+            if not before:
+                continue
+            change = (p["us"] - before) / before * 100
+            flag = ""
+            if max_regression is not None and change > max_regression:
+                regressed, flag = True, "  <-- 退化"
+            lines.append(f"{r['name']:<38} [{r['dimension']:<7}] {p['size']:>5}: {before:>10.2f} -> {p['us']:>10.2f}µs ({change:+.1f}%){flag}")
+    for module, current in report.get("imports", {}).items():
+        before = baseline.get("imports", {}).get(module, {}).get("min_ms")
+        if before and "min_ms" in current:
+            change = (current["min_ms"] - before) / before * 100
+            flag = ""
+            if max_regression is not None and change > max_regression:
+                regressed, flag = True, "  <-- 退化"
+            lines.append(f"import {module:<31} {before:>10.1f} -> {current['min_ms']:>10.1f}ms ({change:+.1f}%){flag}")
+    return lines, regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='热点函数微基准测试和导入耗时测试')
+    parser.add_argument('--only', nargs='*', default=None, help='只运行名称包含这些字符串的基准')
+    parser.add_argument('--quick', action='store_true', help='每个维度只测前3个规模，用于快速检查')
+    parser.add_argument('--min-time', type=float, default=0.05, help='每轮测量的最短时间（秒）')
+    parser.add_argument('--repeat', type=int, default=5, help='每个规模测量的轮数，取最小值')
+    parser.add_argument('--no-imports', action='store_true', help='跳过导入耗时测试')
+    parser.add_argument('--import-repeat', type=int, default=5, help='导入耗时测试的子进程次数')
+    parser.add_argument('--with-logging', action='store_true', help='保留INFO日志，把日志开销计入测量')
+    parser.add_argument('--output', default=None, help='将结果写入JSON文件')
+    parser.add_argument('--compare', default=None, help='与之前写入的JSON结果对比')
+    parser.add_argument('--max-regression', type=float, default=None, help='对比时任一测量值变慢超过该百分比则以非零状态退出')
+    parser.add_argument('--json', action='store_true', help='以JSON格式输出结果')
+    args = parser.parse_args()
+
+    os.environ.setdefault("DEEPSEEK_API_KEY", "mock-key")
+    from config import logger
+    if not args.with_logging:
+        logger.setLevel(logging.WARNING)
+
+    out = sys.stderr if args.json else sys.stdout
+    commit = git_commit()
+    print(f"=== 热点函数微基准（提交 {commit or '未知'}）===", file=out)
+    report = {
+        "benchmark": "hot_paths",
+        "version": RESULT_FORMAT_VERSION,
+        "commit": commit,
+        "timestamp": datetime.now().isoformat(timespec='seconds'),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "params": {"quick": args.quick, "min_time": args.min_time, "repeat": args.repeat, "with_logging": args.with_logging},
+        "micro": run_micro(args.only, args.quick, args.min_time, args.repeat, out),
+    }
+    if not args.no_imports:
+        report["imports"] = measure_imports(["config", "core.bot"], args.import_repeat)
+
+    if args.output:
+        directory = os.path.dirname(args.output)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    else:
+        for module, result in report.get("imports", {}).items():
+            if "error" in result:
+                print(f"import {module}: 失败 {result['error']}")
+                continue
+            slowest = ", ".join(f"{name} {ms}ms" for name, ms in result["slowest_self_ms"][:5])
+            print(f"import {module:<10} 最小 {result['min_ms']}ms  中位数 {result['median_ms']}ms  最慢的依赖: {slowest}")
+
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        lines, regressed = compare(report, baseline, args.max_regression)
+        print(f"\n=== 与基线对比（提交 {baseline.get('commit') or '未知'}）===", file=out)
+        for line in lines:
+            print(line, file=out)
+        if regressed:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,184 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+每帧日志开销基准测试
+模拟主循环每帧的OCR日志（每行一条INFO）和成功回复后的OCR详情转储，比较：
+  sync  - 原来的同步方式：每行OCR日志在调用线程中格式化并写入控制台和文件
+  queue - 队列方式：调用线程只入队，OCR逐行日志降为DEBUG，详情转储合并为一条日志
+
+用法示例：
+    python -m benchmarks.logging_overhead --frames 2000 --lines 40
+    python -m benchmarks.logging_overhead --console   # 输出到真实的标准错误（更接近Windows控制台的开销）
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import logging
+import argparse
+import tempfile
+
+from benchmarks.api_load_test import percentile
+from config.logger import (DirectDailyRotatingFileHandler, FileLogFilter, create_queue_logger,
+                                   formatter)
+
+
+def make_handlers(log_dir, console):
+    """创建与正式配置相同的控制台和文件处理器"""
+    stream = sys.stderr if console else open(os.devnull, 'w', encoding='utf-8')
+    console_handler = logging.StreamHandler(stream)
+    console_handler.setLevel(logging.DEBUG)
+    console_handler.setFormatter(formatter)
+
+    file_handler = DirectDailyRotatingFileHandler(os.path.join(log_dir, "bench.log"), encoding='utf-8')
+    file_handler.setLevel(logging.INFO)
+    file_handler.setFormatter(formatter)
+    file_handler.addFilter(FileLogFilter())
+    return [console_handler, file_handler]
+
+
+def make_frames(count, lines, seed):
+    """生成模拟的OCR结果：(文本, 置信度, 位置)"""
+    rng = random.Random(seed)
+    frames = []
+    for _ in range(count):
+        frame = []
+        for i in range(lines):
+            text = "".join(rng.choice("微信群聊消息测试机器人你好请问今天天气怎么样") for _ in range(rng.randint(4, 30)))
+            box = [[10, 20 * i], [300, 20 * i], [300, 20 * i + 18], [10, 20 * i + 18]]
+            frame.append((text, rng.uniform(0.5, 1.0), box))
+        frames.append(frame)
+    return frames
+
+
+def log_frame_sync(logger, frame, replied):
+    """原来的写法：逐行INFO，回复后逐行写入文件"""
+    for text, confidence, _ in frame:
+        logger.info(f"OCR识别: '{text}', 置信度: {confidence:.4f}")
+    if replied:
+        logger.info("---------- 本次成功回复对应的OCR识别详情 ----------", extra={'save_to_file': True})
+        for text, confidence, position in frame:
+            logger.info(f"文本: '{text}', 置信度: {confidence:.4f}, 位置: {position}", extra={'save_to_file': True})
+        logger.info("-----------------------------------------------------------------", extra={'save_to_file': True})
+
+
+def log_frame_queue(logger, ocr_logger, frame, replied, frame_no, sample_frames):
+    """新的写法：逐行DEBUG（默认关闭），按帧采样摘要，回复后的详情合并为一条"""
+    debug_enabled = ocr_logger.isEnabledFor(logging.DEBUG)
+    for text, confidence, _ in frame:
+        if debug_enabled:
+            ocr_logger.debug(f"OCR识别: '{text}', 置信度: {confidence:.4f}")
+    if sample_frames > 0 and frame_no % sample_frames == 0:
+        ocr_logger.info(f"OCR第{frame_no}帧: 识别{len(frame)}行，末行: '{frame[-1][0] if frame else ''}'")
+    if replied:
+        log_lines = ["---------- 本次成功回复对应的OCR识别详情 ----------"]
+        for text, confidence, position in frame:
+            log_lines.append(f"文本: '{text}', 置信度: {confidence:.4f}, 位置: {position}")
+        log_lines.append("-----------------------------------------------------------------")
+        logger.info("\n".join(log_lines), extra={'save_to_file': True})
+
+
+def summarize(name, durations, extra=None):
+    durations = sorted(durations)
+    result = {
+        "mode": name,
+        "frames": len(durations),
+        "mean_us": sum(durations) / len(durations) * 1e6,
+        "p50_us": percentile(durations, 50) * 1e6,
+        "p95_us": percentile(durations, 95) * 1e6,
+        "p99_us": percentile(durations, 99) * 1e6,
+        "max_us": durations[-1] * 1e6,
+    }
+    result.update(extra or {})
+    return result
+
+
+def run_sync(frames, replies, log_dir, console):
+    logger = logging.getLogger("LoggingBench.sync")
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    handlers = make_handlers(log_dir, console)
+    for handler in handlers:
+        logger.addHandler(handler)
+
+    durations = []
+    try:
+        for frame, replied in zip(frames, replies):
+            start = time.perf_counter()
+            log_frame_sync(logger, frame, replied)
+            durations.append(time.perf_counter() - start)
+    finally:
+        for handler in handlers:
+            logger.removeHandler(handler)
+            handler.close()
+    return summarize("sync", durations)
+
+
+def run_queue(frames, replies, log_dir, console, queue_size, policy, ocr_debug, sample_frames):
+    handlers = make_handlers(log_dir, console)
+    logger, queue_handler, listener = create_queue_logger("LoggingBench.queue", handlers, queue_size, policy)
+    ocr_logger = logger.getChild("ocr")
+    ocr_logger.setLevel(logging.DEBUG if ocr_debug else logging.INFO)
+
+    durations = []
+    max_depth = 0
+    try:
+        for frame_no, (frame, replied) in enumerate(zip(frames, replies), 1):
+            start = time.perf_counter()
+            log_frame_queue(logger, ocr_logger, frame, replied, frame_no, sample_frames)
+            durations.append(time.perf_counter() - start)
+            max_depth = max(max_depth, queue_handler.queue.qsize())
+    finally:
+        drain_start = time.perf_counter()
+        listener.stop()
+        drain = time.perf_counter() - drain_start
+        for handler in handlers:
+            handler.close()
+    return summarize("queue", durations, {
+        "max_queue_depth": max_depth, "dropped": queue_handler.dropped, "drain_ms": drain * 1000})
+
+
+def main():
+    parser = argparse.ArgumentParser(description='每帧日志开销基准测试（同步日志 vs 队列日志）')
+    parser.add_argument('--frames', type=int, default=2000, help='模拟的帧数')
+    parser.add_argument('--lines', type=int, default=40, help='每帧OCR识别的行数')
+    parser.add_argument('--reply-ratio', type=float, default=0.02, help='触发回复（转储OCR详情）的帧比例')
+    parser.add_argument('--queue-size', type=int, default=10000, help='日志队列容量')
+    parser.add_argument('--policy', choices=['drop', 'block'], default='drop', help='队列满时的处理策略')
+    parser.add_argument('--ocr-debug', action='store_true', help='队列模式下也输出逐行OCR日志（DEBUG）')
+    parser.add_argument('--sample-frames', type=int, default=50, help='队列模式下每隔多少帧输出一次OCR摘要')
+    parser.add_argument('--console', action='store_true', help='控制台日志输出到标准错误，而不是丢弃')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', action='store_true', help='以JSON格式输出结果')
+    args = parser.parse_args()
+
+    frames = make_frames(args.frames, args.lines, args.seed)
+    rng = random.Random(args.seed)
+    replies = [rng.random() < args.reply_ratio for _ in frames]
+
+    with tempfile.TemporaryDirectory() as log_dir:
+        results = [
+            run_sync(frames, replies, log_dir, args.console),
+            run_queue(frames, replies, log_dir, args.console, args.queue_size, args.policy,
+                      args.ocr_debug, args.sample_frames),
+        ]
+
+    if args.json:
+        print(json.dumps(results, ensure_ascii=False, indent=2))
+        return
+
+    print(f"帧数 {args.frames}，每帧 {args.lines} 行，回复比例 {args.reply_ratio:.0%}（调用线程中每帧的日志耗时）")
+    for result in results:
+        line = (f"{result['mode']:<6} 平均 {result['mean_us']:8.1f}us  p50 {result['p50_us']:8.1f}us  "
+                f"p95 {result['p95_us']:8.1f}us  p99 {result['p99_us']:8.1f}us  最大 {result['max_us']:8.1f}us")
+        if result['mode'] == 'queue':
+            line += (f"  队列峰值 {result['max_queue_depth']}  丢弃 {result['dropped']}  "
+                     f"退出时排空 {result['drain_ms']:.1f}ms")
+        print(line)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,281 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+本地模拟LLM服务
+模拟OpenAI兼容的 /v1/chat/completions 接口，用于离线压测，不消耗DeepSeek额度
+
+支持：
+- 可配置的延迟分布（固定、均匀、指数、对数正态）
+- 按比例返回500错误
+- 429限流突发（连续N个请求返回429）
+- 流式响应（SSE，stream=True）
+
+用法：
+    python -m benchmarks.mock_llm_server --port 8765 --latency lognormal --latency-ms 800 --error-rate 0.02
+    然后设置环境变量 DEEPSEEK_API_URL=http://127.0.0.1:8765/v1/chat/completions
+"""
+
+import json
+import math
+import time
+import random
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+LATENCY_DISTRIBUTIONS = ['fixed', 'uniform', 'exponential', 'lognormal']
+
+
+class MockLLMSettings:
+    def __init__(self, latency='fixed', latency_ms=200.0, latency_spread=0.5, error_rate=0.0,
+                 burst_429_rate=0.0, burst_429_length=5, retry_after=None,
+                 stream_chunk_chars=8, stream_chunk_ms=20.0, reply_chars=80, seed=None):
+        """模拟服务的行为参数
+
+        Args:
+            latency: 延迟分布类型，见LATENCY_DISTRIBUTIONS
+            latency_ms: 延迟的均值（毫秒）
+            latency_spread: 分布的离散程度；uniform为相对半宽，lognormal为sigma
+            error_rate: 返回500错误的概率
+            burst_429_rate: 每个请求触发一次429突发的概率
+            burst_429_length: 每次突发连续返回429的请求数
+            retry_after: 429响应中Retry-After头的秒数，None表示不返回
+            stream_chunk_chars: 流式响应每个分片的字符数
+            stream_chunk_ms: 流式响应分片之间的间隔（毫秒）
+            reply_chars: 回复内容的字符数
+            seed: 随机数种子，便于复现
+        """
+        if latency not in LATENCY_DISTRIBUTIONS:
+            raise ValueError(f"不支持的延迟分布: {latency}")
+        self.latency = latency
+        self.latency_ms = latency_ms
+        self.latency_spread = latency_spread
+        self.error_rate = error_rate
+        self.burst_429_rate = burst_429_rate
+        self.burst_429_length = burst_429_length
+        self.retry_after = retry_after
+        self.stream_chunk_chars = stream_chunk_chars
+        self.stream_chunk_ms = stream_chunk_ms
+        self.reply_chars = reply_chars
+        self.seed = seed
+
+
+class MockLLMServer:
+    def __init__(self, settings=None, host='127.0.0.1', port=0):
+        """初始化模拟服务，port为0时自动分配空闲端口"""
+        self.settings = settings or MockLLMSettings()
+        self.random = random.Random(self.settings.seed)
+        self.lock = threading.Lock()
+        self.burst_remaining = 0
+        self.stats = {"requests": 0, "ok": 0, "errors_500": 0, "throttled_429": 0, "streamed": 0}
+
+        handler = type('BoundMockLLMHandler', (MockLLMHandler,), {'server_state': self})
+        self.httpd = ThreadingHTTPServer((host, port), handler)
+        self.httpd.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self):
+        """聊天补全接口的完整地址"""
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/v1/chat/completions"
+
+    def start(self):
+        """在后台线程中启动服务"""
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name="MockLLMServer", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        """停止服务并释放端口"""
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        if self.thread:
+            self.thread.join(timeout=5)
+
+    def sample_latency(self):
+        """按配置的分布采样一次延迟（秒）"""
+        s = self.settings
+        mean = s.latency_ms / 1000.0
+        with self.lock:
+            if s.latency == 'fixed':
+                value = mean
+            elif s.latency == 'uniform':
+                value = self.random.uniform(mean * (1 - s.latency_spread), mean * (1 + s.latency_spread))
+            elif s.latency == 'exponential':
+                value = self.random.expovariate(1.0 / mean) if mean > 0 else 0.0
+            else:
+                # 对数正态：使均值等于latency_ms
+                sigma = s.latency_spread
+                mu = math.log(mean) - sigma * sigma / 2 if mean > 0 else 0.0
+                value = self.random.lognormvariate(mu, sigma) if mean > 0 else 0.0
+        return max(0.0, value)
+
+    def next_outcome(self):
+        """决定本次请求的结果：'429'、'500' 或 'ok'"""
+        s = self.settings
+        with self.lock:
+            self.stats["requests"] += 1
+            if self.burst_remaining <= 0 and self.random.random() < s.burst_429_rate:
+                self.burst_remaining = s.burst_429_length
+            if self.burst_remaining > 0:
+                self.burst_remaining -= 1
+                self.stats["throttled_429"] += 1
+                return '429'
+            if self.random.random() < s.error_rate:
+                self.stats["errors_500"] += 1
+                return '500'
+            self.stats["ok"] += 1
+            return 'ok'
+
+
+class MockLLMHandler(BaseHTTPRequestHandler):
+    # 使用HTTP/1.1以支持keep-alive，使客户端连接池生效
+    protocol_version = "HTTP/1.1"
+    server_state = None
+
+    def log_message(self, format, *args):
+        """关闭默认的逐请求访问日志，避免干扰压测"""
+        pass
+
+    def _send_json(self, status, payload, extra_headers=None):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (extra_headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _write_chunk(self, data):
+        """按chunked编码写出一个分片"""
+        self.wfile.write(f"{len(data):X}\r\n".encode('ascii') + data + b"\r\n")
+        self.wfile.flush()
+
+    def _build_reply(self, request):
+        """根据最后一条用户消息构造确定长度的模拟回复"""
+        last_user = ""
+        for message in request.get("messages", []):
+            if message.get("role") == "user":
+                last_user = message.get("content", "")
+        reply = f"模拟回复: {last_user}"
+        target = self.server_state.settings.reply_chars
+        if len(reply) < target:
+            reply += "。" * (target - len(reply))
+        return reply[:target]
+
+    def do_POST(self):
+        state = self.server_state
+        if self.path.rstrip('/') != "/v1/chat/completions":
+            self._send_json(404, {"error": {"message": "not found"}})
+            return
+
+        length = int(self.headers.get("Content-Length", 0))
+        try:
+            request = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            self._send_json(400, {"error": {"message": "invalid json"}})
+            return
+
+        outcome = state.next_outcome()
+        if outcome == '429':
+            headers = {}
+            if state.settings.retry_after is not None:
+                headers["Retry-After"] = str(state.settings.retry_after)
+            self._send_json(429, {"error": {"message": "rate limited (mock)"}}, headers)
+            return
+
+        time.sleep(state.sample_latency())
+
+        if outcome == '500':
+            self._send_json(500, {"error": {"message": "internal error (mock)"}})
+            return
+
+        reply = self._build_reply(request)
+        model = request.get("model", "mock-model")
+        created = int(time.time())
+
+        if not request.get("stream"):
+            self._send_json(200, {
+                "id": f"mock-{created}",
+                "object": "chat.completion",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": reply}, "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": 0, "completion_tokens": len(reply), "total_tokens": len(reply)}
+            })
+            return
+
+        with state.lock:
+            state.stats["streamed"] += 1
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream; charset=utf-8")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        step = max(1, state.settings.stream_chunk_chars)
+        for i in range(0, len(reply), step):
+            chunk = {
+                "id": f"mock-{created}",
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "delta": {"content": reply[i:i + step]}, "finish_reason": None}]
+            }
+            self._write_chunk(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode('utf-8'))
+            time.sleep(state.settings.stream_chunk_ms / 1000.0)
+        self._write_chunk(b"data: [DONE]\n\n")
+        self._write_chunk(b"")
+
+
+def add_settings_arguments(parser):
+    """向命令行解析器添加模拟服务参数（压测工具复用）"""
+    parser.add_argument('--latency', choices=LATENCY_DISTRIBUTIONS, default='lognormal', help='延迟分布类型')
+    parser.add_argument('--latency-ms', type=float, default=500.0, help='平均延迟（毫秒）')
+    parser.add_argument('--latency-spread', type=float, default=0.5, help='延迟离散程度（uniform为相对半宽，lognormal为sigma）')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='返回500错误的概率')
+    parser.add_argument('--burst-429-rate', type=float, default=0.0, help='每个请求触发429突发的概率')
+    parser.add_argument('--burst-429-length', type=int, default=5, help='每次429突发连续返回的请求数')
+    parser.add_argument('--retry-after', type=float, default=None, help='429响应的Retry-After秒数')
+    parser.add_argument('--stream-chunk-ms', type=float, default=20.0, help='流式分片间隔（毫秒）')
+    parser.add_argument('--reply-chars', type=int, default=80, help='回复内容的字符数')
+    parser.add_argument('--seed', type=int, default=None, help='随机数种子')
+
+
+def settings_from_args(args):
+    """根据命令行参数构造MockLLMSettings"""
+    return MockLLMSettings(
+        latency=args.latency,
+        latency_ms=args.latency_ms,
+        latency_spread=args.latency_spread,
+        error_rate=args.error_rate,
+        burst_429_rate=args.burst_429_rate,
+        burst_429_length=args.burst_429_length,
+        retry_after=args.retry_after,
+        stream_chunk_ms=args.stream_chunk_ms,
+        reply_chars=args.reply_chars,
+        seed=args.seed
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description='本地模拟LLM服务（OpenAI兼容接口）')
+    parser.add_argument('--host', default='127.0.0.1', help='监听地址')
+    parser.add_argument('--port', type=int, default=8765, help='监听端口')
+    add_settings_arguments(parser)
+    args = parser.parse_args()
+
+    server = MockLLMServer(settings_from_args(args), host=args.host, port=args.port)
+    print(f"模拟LLM服务已启动: {server.url}")
+    print(f"设置环境变量 DEEPSEEK_API_URL={server.url} 即可让机器人使用该服务")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.httpd.server_close()
+        print(f"模拟LLM服务已停止，统计: {server.stats}")
+
+if __name__ == "__main__":
+    main()
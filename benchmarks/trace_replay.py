@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+帧追踪回放工具
+将TraceRecorder记录的追踪逐帧送入MessageDetector，无需微信窗口和PaddleOCR即可：
+  - 对比回放结果与记录时的检测结果，用于检测逻辑修改后的回归测试
+  - 统计检测耗时，以及记录中各阶段（截图、OCR、检测）的耗时分布和重复帧比例
+
+用法示例：
+    python -m benchmarks.trace_replay traces
+    python -m benchmarks.trace_replay traces/trace-20250101-120000-0000.jsonl.gz --strict --quiet
+    python -m benchmarks.trace_replay traces --history-dir chat_histories_copy   # 使用已有历史（会被写入，请使用副本）
+"""
+
+import sys
+import json
+import time
+import logging
+import argparse
+import tempfile
+
+from benchmarks.api_load_test import percentile
+
+
+class ReplayOCREngine:
+    """替代PaddleOCR的引擎：把追踪记录中的OCR原始结果按PaddleOCR的格式返回"""
+
+    def ocr(self, record, cls=True):
+        lines = [[box, (text, confidence)] for text, confidence, box in record.get("ocr", [])]
+        return [lines or None]
+
+
+def decision_key(decision):
+    if not decision:
+        return None
+    return decision.get("sender"), decision.get("question"), decision.get("role")
+
+
+def summarize_ms(values):
+    values = sorted(values)
+    if not values:
+        return None
+    return {
+        "count": len(values),
+        "mean": sum(values) / len(values),
+        "p50": percentile(values, 50),
+        "p95": percentile(values, 95),
+        "max": values[-1],
+    }
+
+
+def replay(records, detector, ocr_handler, chat_history_manager, max_mismatches=20):
+    """逐帧回放追踪记录
+
+    Returns:
+        dict: 回放统计
+    """
+    result = {
+        "frames": 0, "window_detected": 0, "recorded_decisions": 0, "replayed_decisions": 0,
+        "mismatches": 0, "duplicate_frames": 0, "mismatch_samples": [],
+    }
+    detect_ms = []
+    recorded_timings = {}
+    last_hash = None
+
+    for record in records:
+        result["frames"] += 1
+        frame_hash = record.get("frame_hash")
+        if frame_hash is not None and frame_hash == last_hash:
+            result["duplicate_frames"] += 1
+        last_hash = frame_hash
+        for stage, ms in (record.get("timings") or {}).items():
+            recorded_timings.setdefault(stage, []).append(ms)
+
+        texts = ocr_handler.recognize_text(record)
+        decision = None
+        if ocr_handler.detect_wechat_window_name(texts):
+            result["window_detected"] += 1
+            start = time.perf_counter()
+            sender, question = detector.detect_trigger(texts)
+            detect_ms.append((time.perf_counter() - start) * 1000)
+            if sender and question:
+                decision = {"sender": sender, "question": question, "role": chat_history_manager.current_role}
+                # 与真实运行一致：回复后写入历史，后续帧的重复问题检查才能得到相同结果
+                chat_history_manager.add_chat(sender, question, "[回放]")
+
+        recorded = record.get("decision")
+        result["recorded_decisions"] += 1 if recorded else 0
+        result["replayed_decisions"] += 1 if decision else 0
+        if decision_key(recorded) != decision_key(decision):
+            result["mismatches"] += 1
+            if len(result["mismatch_samples"]) < max_mismatches:
+                result["mismatch_samples"].append({"frame": record.get("frame"), "ts": record.get("ts"),
+                                                   "recorded": recorded, "replayed": decision})
+
+    result["detect_ms"] = summarize_ms(detect_ms)
+    result["recorded_timings_ms"] = {stage: summarize_ms(values) for stage, values in recorded_timings.items()}
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='将帧追踪回放给MessageDetector，对比检测结果并统计耗时')
+    parser.add_argument('trace', help='追踪目录或单个分段文件')
+    parser.add_argument('--history-dir', default=None, help='对话历史目录，默认使用临时目录（回放会写入该目录）')
+    parser.add_argument('--initial-role', default=None, help='回放开始时的角色，默认为Config.DEFAULT_ROLE')
+    parser.add_argument('--strict', action='store_true', help='回放结果与记录不一致时以非零状态退出')
+    parser.add_argument('--quiet', action='store_true', help='只输出WARNING及以上级别的日志')
+    parser.add_argument('--json', action='store_true', help='以JSON格式输出结果')
+    args = parser.parse_args()
+
+    from config import Config, logger
+    from utils.trace_recorder import iter_trace
+
+    if args.quiet:
+        logger.setLevel(logging.WARNING)
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        # 回放不应写入真实的对话历史，也不需要后台写入和角色热加载
+        Config.CHAT_HISTORY_DIR = args.history_dir or temp_dir
+        Config.HISTORY_WRITE_BEHIND = False
+        if args.initial_role:
+            Config.DEFAULT_ROLE = args.initial_role
+
+        from utils.ocr_handler import OCRHandler
+        from utils.chat_history import ChatHistoryManager
+        from core.message_detector import MessageDetector
+
+        ocr_handler = OCRHandler(engine=ReplayOCREngine())
+        chat_history_manager = ChatHistoryManager()
+        detector = MessageDetector(ocr_handler, chat_history_manager)
+
+        start = time.perf_counter()
+        try:
+            result = replay(iter_trace(args.trace), detector, ocr_handler, chat_history_manager)
+        finally:
+            chat_history_manager.close()
+        result["elapsed_s"] = time.perf_counter() - start
+
+    if args.json:
+        print(json.dumps(result, ensure_ascii=False, indent=2))
+    else:
+        print(f"\n回放 {result['frames']} 帧，用时 {result['elapsed_s']:.2f}s，识别到窗口 {result['window_detected']} 帧，"
+              f"重复帧 {result['duplicate_frames']} 帧")
+        print(f"检测结果: 记录 {result['recorded_decisions']} 次，回放 {result['replayed_decisions']} 次，"
+              f"不一致 {result['mismatches']} 帧")
+        for sample in result["mismatch_samples"]:
+            print(f"  第{sample['frame']}帧: 记录 {sample['recorded']} -> 回放 {sample['replayed']}")
+        if result["detect_ms"]:
+            d = result["detect_ms"]
+            print(f"回放检测耗时: 平均 {d['mean']:.3f}ms  p50 {d['p50']:.3f}ms  p95 {d['p95']:.3f}ms  最大 {d['max']:.3f}ms")
+        for stage, d in result["recorded_timings_ms"].items():
+            if d:
+                print(f"记录的{stage}耗时: 平均 {d['mean']:.1f}ms  p50 {d['p50']:.1f}ms  p95 {d['p95']:.1f}ms  最大 {d['max']:.1f}ms")
+
+    if args.strict and result["mismatches"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
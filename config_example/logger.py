@@ -1,13 +1,48 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
-"""日志配置模块：配置日志记录器和自定义过滤器"""
+"""日志配置模块：配置日志记录器和自定义过滤器
+
+日志记录只在调用线程中放入有界队列，格式化和写入控制台/文件由后台监听线程完成，
+截图/OCR主循环不会因磁盘或控制台输出而阻塞。
+"""
 
 import logging
 import os
 import time
 import glob
-from logging.handlers import BaseRotatingHandler
+import gzip
+import queue
+import atexit
+import shutil
+import threading
+from logging.handlers import BaseRotatingHandler, QueueHandler, QueueListener
+
+# 日志配置放在本模块而不是Config中，因为settings.py需要导入logger（避免循环导入）
+# 日志队列容量（条），队列满时按LOG_OVERFLOW_POLICY处理
+# 【可选修改】
+LOG_QUEUE_SIZE = 10000
+# 队列满时的处理策略：
+#   "drop"  - 丢弃INFO及以下级别的新日志并计数，WARNING及以上级别最多等待LOG_BLOCK_TIMEOUT秒
+#   "block" - 所有日志都等待队列空位（不丢日志，但可能拖慢主循环）
+# 【可选修改】
+LOG_OVERFLOW_POLICY = "drop"
+LOG_BLOCK_TIMEOUT = 1.0
+# 是否在控制台输出每一帧OCR识别的逐行结果（DEBUG级别，仅用于调试）
+# 【可选修改】
+LOG_OCR_DEBUG = False
+# 每隔多少帧在控制台输出一次OCR识别摘要，0表示不输出
+# 【可选修改】
+LOG_OCR_SAMPLE_FRAMES = 50
+
+# 轮转后的日志压缩方式："gzip"、"zstd"（需安装zstandard，未安装时使用gzip）或"none"
+# 【可选修改】
+LOG_COMPRESSION = "gzip"
+# 最多保留的历史日志文件数（不含当天正在写入的日志）
+LOG_BACKUP_COUNT = 30
+# 历史日志的总大小上限（字节），超出时从最早的日志开始删除，0表示不限制
+# 【可选修改】
+LOG_RETENTION_MAX_BYTES = 500 * 1024 * 1024
 
 # 确保日志目录存在
 os.makedirs("log", exist_ok=True)
@@ -15,7 +50,8 @@ os.makedirs("log", exist_ok=True)
 class DirectDailyRotatingFileHandler(BaseRotatingHandler):
     """日志处理器，直接写入以当前日期命名的文件 (YYYY-MM-DD-basename.log)，并在午夜自动切换"""
     
-    def __init__(self, filename_base, when='midnight', backupCount=0, encoding=None, delay=False, utc=False):
+    def __init__(self, filename_base, when='midnight', backupCount=0, encoding=None, delay=False, utc=False,
+                 compression="none", max_total_bytes=0):
         self.log_dir = os.path.dirname(filename_base)
         self.base_name_part = os.path.basename(filename_base)
         self.suffix_format = "%Y-%m-%d"
@@ -35,6 +71,11 @@ class DirectDailyRotatingFileHandler(BaseRotatingHandler):
         
         # 计算第一次轮转时间
         self.rolloverAt = self.computeRollover(int(time.time()))
+        
+        # 压缩和清理旧日志由后台线程完成，写日志的线程不会因文件整理而阻塞
+        self.archiver = LogArchiver(self.log_dir, self.base_name_part, backupCount, max_total_bytes, compression)
+        # 启动时整理一次（压缩上次运行遗留的未压缩日志）
+        self.archiver.submit(self.baseFilename)
 
     def computeRollover(self, currentTime):
         """计算下一次轮转的时间戳"""
@@ -69,27 +110,8 @@ class DirectDailyRotatingFileHandler(BaseRotatingHandler):
         if not self.delay:
             self.stream = self._open()
         
-        # 清理旧日志
-        if self.backupCount > 0:
-            try:
-                # 获取所有匹配的日志文件
-                log_pattern = os.path.join(self.log_dir, f"????-??-??-{self.base_name_part}")
-                existing_logs = glob.glob(log_pattern)
-                
-                # 排除当前文件
-                current_real_path = os.path.abspath(self.baseFilename)
-                logs_to_consider = [log for log in existing_logs if os.path.abspath(log) != current_real_path]
-                logs_to_consider.sort()
-                
-                # 删除超出保留数量的旧日志
-                if len(logs_to_consider) >= self.backupCount:
-                    for log_path in logs_to_consider[:len(logs_to_consider) - self.backupCount]:
-                        try:
-                            os.remove(log_path)
-                        except OSError as e:
-                            print(f"无法删除旧日志文件 {log_path}: {e}")
-            except Exception as e:
-                print(f"日志清理过程中出错: {e}")
+        # 压缩刚结束的日志并清理旧日志（在后台线程中执行）
+        self.archiver.submit(self.baseFilename)
         
         # 计算下一次轮转时间
         current_timestamp = int(time.time())
@@ -99,6 +121,109 @@ class DirectDailyRotatingFileHandler(BaseRotatingHandler):
             newRolloverAt += 86400  # 增加一天
         self.rolloverAt = newRolloverAt
 
+    def close(self):
+        """关闭文件流；后台整理线程为守护线程，未完成的压缩会在下次启动时重新进行"""
+        self.archiver.stop()
+        BaseRotatingHandler.close(self)
+
+
+class LogArchiver:
+    """日志归档线程：压缩轮转后的日志文件，并按文件数和总大小清理旧日志"""
+    
+    def __init__(self, log_dir, base_name, backup_count, max_total_bytes, compression):
+        if compression not in ("gzip", "zstd", "none"):
+            raise ValueError(f"不支持的日志压缩方式: {compression}")
+        if compression == "zstd":
+            try:
+                import zstandard  # noqa: F401
+            except ImportError:
+                print("未安装zstandard，日志改用gzip压缩")
+                compression = "gzip"
+        self.log_dir = log_dir
+        self.base_name = base_name
+        self.backup_count = backup_count
+        self.max_total_bytes = max_total_bytes
+        self.compression = compression
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self._run, name="LogArchiver", daemon=True)
+        self.thread.start()
+    
+    def submit(self, current_path):
+        """请求整理日志目录，current_path为正在写入的日志文件（不会被压缩或删除）"""
+        self.queue.put(current_path)
+    
+    def stop(self):
+        self.queue.put(None)
+    
+    def _run(self):
+        while True:
+            current_path = self.queue.get()
+            if current_path is None:
+                return
+            try:
+                self.compress_finished(current_path)
+                self.enforce_retention(current_path)
+            except Exception as e:
+                print(f"日志整理过程中出错: {e}")
+    
+    def list_logs(self, current_path):
+        """列出除当前日志外的全部历史日志（含已压缩的），按日期从旧到新排列"""
+        pattern = os.path.join(self.log_dir, f"????-??-??-{self.base_name}")
+        paths = glob.glob(pattern) + glob.glob(pattern + ".gz") + glob.glob(pattern + ".zst")
+        current_real_path = os.path.abspath(current_path)
+        return sorted((path for path in paths if os.path.abspath(path) != current_real_path), key=os.path.basename)
+    
+    def compress_finished(self, current_path):
+        """压缩已结束的日志文件：先写入临时文件，完成后替换，中途退出不会损坏原日志"""
+        if self.compression == "none":
+            return
+        suffix = ".zst" if self.compression == "zstd" else ".gz"
+        for path in self.list_logs(current_path):
+            if path.endswith((".gz", ".zst")):
+                continue
+            tmp_path = path + suffix + ".tmp"
+            try:
+                with open(path, 'rb') as src:
+                    if self.compression == "zstd":
+                        import zstandard
+                        with open(tmp_path, 'wb') as raw, zstandard.ZstdCompressor(level=10).stream_writer(raw) as dst:
+                            shutil.copyfileobj(src, dst, 1024 * 1024)
+                    else:
+                        with gzip.open(tmp_path, 'wb', compresslevel=6) as dst:
+                            shutil.copyfileobj(src, dst, 1024 * 1024)
+                os.replace(tmp_path, path + suffix)
+                os.remove(path)
+            except OSError as e:
+                print(f"无法压缩日志文件 {path}: {e}")
+                try:
+                    os.remove(tmp_path)
+                except OSError:
+                    pass
+    
+    def enforce_retention(self, current_path):
+        """删除超出保留数量或总大小上限的最早日志"""
+        logs = self.list_logs(current_path)
+        sizes = {}
+        for path in logs:
+            try:
+                sizes[path] = os.path.getsize(path)
+            except OSError:
+                sizes[path] = 0
+        total = sum(sizes.values())
+        
+        while logs:
+            over_count = self.backup_count > 0 and len(logs) > self.backup_count
+            over_size = self.max_total_bytes > 0 and total > self.max_total_bytes
+            if not over_count and not over_size:
+                break
+            oldest = logs.pop(0)
+            try:
+                os.remove(oldest)
+                total -= sizes[oldest]
+            except OSError as e:
+                print(f"无法删除旧日志文件 {oldest}: {e}")
+                total -= sizes[oldest]
+
 
 class FileLogFilter(logging.Filter):
     """自定义日志过滤器，只允许带有 'save_to_file' 标记的记录通过"""
@@ -106,28 +231,117 @@ class FileLogFilter(logging.Filter):
         return getattr(record, 'save_to_file', False)
 
 
-# 配置Logger
-logger = logging.getLogger("WeChatBotLogger")
-logger.setLevel(logging.INFO)
+class BoundedQueueHandler(QueueHandler):
+    """写入有界队列的日志处理器，队列满时按溢出策略丢弃或等待"""
+
+    def __init__(self, log_queue, overflow_policy="drop", block_timeout=1.0):
+        if overflow_policy not in ("drop", "block"):
+            raise ValueError(f"不支持的日志溢出策略: {overflow_policy}")
+        super().__init__(log_queue)
+        self.overflow_policy = overflow_policy
+        self.block_timeout = block_timeout
+        self.dropped = 0
+        self.dropped_lock = threading.Lock()
+
+    def prepare(self, record):
+        """只合并消息参数，时间和级别等的格式化交给监听线程完成"""
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            if self.overflow_policy == "block":
+                self.queue.put(record)
+            elif record.levelno >= logging.WARNING:
+                try:
+                    self.queue.put(record, timeout=self.block_timeout)
+                except queue.Full:
+                    self._count_dropped()
+            else:
+                self._count_dropped()
+            return
+
+        # 队列恢复后补记一条丢弃统计
+        if self.dropped:
+            with self.dropped_lock:
+                dropped, self.dropped = self.dropped, 0
+            if dropped:
+                notice = logging.LogRecord(record.name, logging.WARNING, __file__, 0,
+                                           f"日志队列已满，丢弃了{dropped}条日志", None, None)
+                notice.save_to_file = True
+                try:
+                    self.queue.put_nowait(notice)
+                except queue.Full:
+                    self._count_dropped(dropped)
+
+    def _count_dropped(self, count=1):
+        with self.dropped_lock:
+            self.dropped += count
+
+
+class BoundedQueueListener(QueueListener):
+    """停止时阻塞等待队列空位放入结束标记，保证退出前剩余日志都已写出"""
+
+    def enqueue_sentinel(self):
+        self.queue.put(self._sentinel)
+
+
+def create_queue_logger(name, handlers, queue_size=LOG_QUEUE_SIZE, overflow_policy=LOG_OVERFLOW_POLICY,
+                        block_timeout=LOG_BLOCK_TIMEOUT, level=logging.INFO):
+    """创建通过后台线程写日志的Logger
+
+    Args:
+        name: Logger名称
+        handlers: 实际输出日志的处理器列表（在监听线程中执行）
+        queue_size: 队列容量
+        overflow_policy: 队列满时的处理策略（"drop"或"block"）
+
+    Returns:
+        tuple: (logger, queue_handler, listener)，listener已启动
+    """
+    log_queue = queue.Queue(maxsize=queue_size)
+    queue_handler = BoundedQueueHandler(log_queue, overflow_policy, block_timeout)
+    listener = BoundedQueueListener(log_queue, *handlers, respect_handler_level=True)
+
+    new_logger = logging.getLogger(name)
+    new_logger.setLevel(level)
+    for handler in list(new_logger.handlers):
+        new_logger.removeHandler(handler)
+    new_logger.addHandler(queue_handler)
+    # 防止日志向上传播
+    new_logger.propagate = False
+
+    listener.start()
+    return new_logger, queue_handler, listener
+
+
 formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 
-# 控制台处理器
+# 控制台处理器（级别由Logger控制，OCR调试日志开启时也能输出到控制台）
 console_handler = logging.StreamHandler()
-console_handler.setLevel(logging.INFO)
+console_handler.setLevel(logging.DEBUG)
 console_handler.setFormatter(formatter)
-logger.addHandler(console_handler)
 
 # 文件处理器
 file_handler = DirectDailyRotatingFileHandler(
     filename_base=os.path.join("log", "wechat_bot.log"),
     when="midnight",
-    backupCount=30,
-    encoding='utf-8'
+    backupCount=LOG_BACKUP_COUNT,
+    encoding='utf-8',
+    compression=LOG_COMPRESSION,
+    max_total_bytes=LOG_RETENTION_MAX_BYTES
 )
 file_handler.setLevel(logging.INFO)
 file_handler.setFormatter(formatter)
 file_handler.addFilter(FileLogFilter())
-logger.addHandler(file_handler)
 
-# 防止日志向上传播
-logger.propagate = False
+# 配置Logger：调用线程只负责入队，控制台和文件输出在后台监听线程中完成
+logger, queue_handler, log_listener = create_queue_logger("WeChatBotLogger", [console_handler, file_handler])
+atexit.register(log_listener.stop)
+
+# 每帧OCR识别结果使用单独的子Logger，默认不输出逐行结果
+ocr_logger = logger.getChild("ocr")
+ocr_logger.setLevel(logging.DEBUG if LOG_OCR_DEBUG else logging.INFO)
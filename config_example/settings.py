@@ -12,7 +12,7 @@
 """
 
 import os
-from roles import load_all_roles
+from roles.registry import RoleRegistry
 from config_example.logger import logger
 
 class Config:
@@ -22,7 +22,16 @@ class Config:
     # 从roles目录加载所有角色配置，通常不需要在此处修改
     # 如需添加新角色，请在roles目录中创建对应的json文件
     
-    ROLES = load_all_roles()
+    # 角色注册表：按名称和别名索引角色，支持热加载
+    ROLE_REGISTRY = RoleRegistry()
+    # 角色配置列表（热加载后自动更新）
+    ROLES = ROLE_REGISTRY.role_configs
+    
+    # 是否在运行时监视roles目录，角色文件新增、修改或删除后自动重新加载，无需重启机器人
+    # 【可选修改】
+    ROLE_HOT_RELOAD = True
+    # 检查roles目录修改时间的间隔（秒）
+    ROLE_RELOAD_INTERVAL = 5
     
     # 默认角色（机器人启动时使用的角色）
     # 【可选修改】如需更改默认角色，请修改此处
@@ -60,6 +69,97 @@ class Config:
     # 【可选修改】值越小检测消息越及时，但CPU占用越高
     SCREENSHOT_INTERVAL = 5
     
+    # 是否使用异步运行时（asyncio）：截图、OCR、API回复、发送和定期维护作为事件循环中的任务并行进行，
+    # 等待API回复时继续截图识别，每一步都有超时，退出时有序写入所有状态
+    # 【可选修改】默认使用原来的同步主循环，设为True启用异步运行时
+    ASYNC_RUNTIME = False
+    # 单帧OCR的超时时间（秒），超时的帧被跳过，OCR完成前不再提交新的帧
+    ASYNC_OCR_TIMEOUT = 30
+    # 生成一条回复的超时时间（秒），应大于API_REPLY_DEADLINE
+    ASYNC_REPLY_TIMEOUT = 120
+    # 执行截图、API请求和磁盘I/O的线程数
+    ASYNC_IO_WORKERS = 4
+    # 定期把后台写入队列中的对话历史写入磁盘的间隔（秒）
+    ASYNC_HISTORY_FLUSH_INTERVAL = 30
+    # 输出运行统计日志的间隔（秒），0表示只在退出时输出
+    ASYNC_METRICS_INTERVAL = 600
+    # 退出时等待进行中的回复完成的最长时间（秒）
+    ASYNC_SHUTDOWN_TIMEOUT = 60
+    
+    # 帧差异检测：截图与上一次检测时的画面相比没有明显变化时跳过OCR和触发词检测
+    # 【可选修改】设为False则每帧都进行OCR
+    FRAME_DIFF_ENABLED = True
+    # 灰度缩略图平均像素差超过该值才视为画面有变化（输入框光标闪烁等细微变化远低于该值）
+    FRAME_DIFF_THRESHOLD = 0.5
+    
+    # 是否只检测新出现的OCR文本行：与上一次检测的帧逐行比对，只检测新行及其上下文（发送者名称、下一行问题）
+    # 【可选修改】设为False则每帧检测全部文本行
+    TEXT_DIFF_ENABLED = True
+    # 每个新行之前、之后一并检测的行数
+    TEXT_DIFF_CONTEXT_BEFORE = 2
+    TEXT_DIFF_CONTEXT_AFTER = 1
+    
+    # OCR置信度阈值，低于该值的识别结果将被忽略
+    # 【可选修改】识别结果中误识别较多时可适当调高
+    OCR_CONFIDENCE_THRESHOLD = 0.8
+    
+    # 是否使用本机OCR服务（python -m utils.ocr_server）识别截图，多个机器人进程共用一组PaddleOCR引擎
+    # 【可选修改】服务未启动或不可用时自动改为在本进程中识别
+    OCR_SERVER_ENABLED = False
+    # OCR服务地址，"主机:端口" 或 "unix:/路径"（Unix套接字，仅Linux/macOS）
+    OCR_SERVER_ADDRESS = "127.0.0.1:9465"
+    # 截图传输方式："shm" 共享内存（不需要编码，推荐），"png" 无损压缩，"jpeg" 有损压缩，"raw" 原始数据
+    OCR_SERVER_TRANSPORT = "shm"
+    # 等待识别结果的超时时间（秒），超时后改为在本进程中识别
+    OCR_SERVER_TIMEOUT = 30
+    # 服务不可用后，经过多少秒重新尝试连接
+    OCR_SERVER_RETRY_INTERVAL = 30
+    # 以下为服务端配置：引擎数量（每个引擎占用一份模型内存）、每批最多识别的帧数、收集一批时最多额外等待的毫秒数
+    OCR_SERVER_WORKERS = 1
+    OCR_SERVER_BATCH_SIZE = 4
+    OCR_SERVER_BATCH_WAIT_MS = 5
+    # 服务端输出统计日志（排队和识别耗时）的间隔（秒），0表示只在退出时输出
+    OCR_SERVER_STATS_INTERVAL = 300
+
+    # 是否对OCR引擎做健康检查：连续识别失败、识别耗时或进程内存增长过多时，自动重新创建引擎（不需要重启机器人）
+    # 【可选修改】本进程的引擎和OCR服务端的每个引擎都会检查，每次重新创建及其原因都会写入日志
+    OCR_WATCHDOG_ENABLED = True
+    # 连续识别失败多少帧后重新创建引擎，0表示不检查
+    OCR_WATCHDOG_MAX_ERROR_STREAK = 3
+    # 统计识别耗时的最近帧数；引擎创建后的第一个完整窗口作为耗时和内存的基准
+    OCR_WATCHDOG_WINDOW = 50
+    # 最近一个窗口的识别耗时p95超过多少毫秒时重新创建引擎，0表示不检查
+    OCR_WATCHDOG_LATENCY_P95_MS = 0
+    # 最近一个窗口的每行识别耗时（按识别出的文本行数归一化）中位数达到基准的多少倍时重新创建引擎，0表示不检查
+    # 【可选修改】归一化只是近似（检测阶段的耗时与行数无关），默认不检查，依靠连续失败和内存阈值回收
+    OCR_WATCHDOG_LATENCY_GROWTH = 0
+    # 进程常驻内存超过多少MB时重新创建引擎，0表示不检查
+    OCR_WATCHDOG_MAX_RSS_MB = 0
+    # 进程常驻内存比基准增长多少MB时重新创建引擎，0表示不检查
+    OCR_WATCHDOG_RSS_GROWTH_MB = 1024
+    # 检查进程内存的间隔（秒）
+    OCR_WATCHDOG_MEMORY_CHECK_INTERVAL = 60
+    # 引擎创建后至少经过多少秒，才会因耗时或内存重新创建（连续识别失败不受限制），避免频繁重建
+    OCR_WATCHDOG_MIN_RECYCLE_INTERVAL = 600
+
+    # 是否记录帧追踪（每帧的截图哈希、OCR原始结果、检测结果和各阶段耗时），用于离线回放和分析
+    # 【可选修改】回放方法: python -m benchmarks.trace_replay traces
+    TRACE_ENABLED = False
+    # 追踪文件目录
+    TRACE_DIR = "traces"
+    # 分段格式："jsonl"或"msgpack"（需安装msgpack），均使用gzip压缩
+    TRACE_FORMAT = "jsonl"
+    # 每个分段最多记录的帧数，超过后开始新分段
+    TRACE_SEGMENT_MAX_RECORDS = 1000
+    # 最多保留的分段数，超过时删除最早的分段，0表示不限制
+    TRACE_MAX_SEGMENTS = 50
+    # 每隔多少帧附带一张缩小的截图快照，0表示不保存快照
+    TRACE_SNAPSHOT_EVERY = 0
+    # 快照的缩放比例
+    TRACE_SNAPSHOT_SCALE = 0.25
+    # 追踪记录队列容量，写入跟不上时丢弃新帧
+    TRACE_QUEUE_SIZE = 500
+    
     # ===========================
     # 【DeepSeek API配置】
     # ===========================
@@ -77,7 +177,59 @@ class Config:
         raise ValueError(error_message) 
     
     # DeepSeek API接口地址（通常不需要修改）
-    DEEPSEEK_API_URL = "https://api.deepseek.com/v1/chat/completions"
+    # 可通过环境变量DEEPSEEK_API_URL覆盖，例如指向本地模拟服务进行离线压测：
+    #   python -m benchmarks.mock_llm_server --port 8765
+    #   set DEEPSEEK_API_URL=http://127.0.0.1:8765/v1/chat/completions
+    DEEPSEEK_API_URL = os.getenv("DEEPSEEK_API_URL", "https://api.deepseek.com/v1/chat/completions")
+    
+    # API请求超时时间（秒）：连接超时、读取超时
+    # 【可选修改】读取超时过短可能导致长回复被中断
+    API_CONNECT_TIMEOUT = 5
+    API_READ_TIMEOUT = 60
+    
+    # API请求失败时的最大重试次数（仅对429、5xx和网络错误重试）
+    API_MAX_RETRIES = 2
+    
+    # 重试退避基准时间（秒），每次重试翻倍；服务端返回Retry-After时优先使用
+    API_RETRY_BACKOFF = 1.0
+    
+    # HTTP连接池大小（复用TCP/TLS连接，减少每次请求的握手开销）
+    API_POOL_SIZE = 4
+    
+    # 是否使用流式响应（stream=True）
+    API_STREAM = False
+    
+    # 同时进行中的API请求上限（含对冲请求）
+    API_MAX_CONCURRENCY = 8
+    
+    # 多端点配置（任意OpenAI兼容接口），按延迟自动选择最快的健康端点
+    # 留空时只使用上面的DEEPSEEK_API_URL和deepseek-chat模型
+    # 【可选修改】示例：
+    # API_ENDPOINTS = [
+    #     {"name": "deepseek", "url": DEEPSEEK_API_URL, "model": "deepseek-chat"},
+    #     {"name": "backup", "url": "https://example.com/v1/chat/completions", "model": "some-model",
+    #      "api_key": os.getenv("BACKUP_API_KEY")},
+    # ]
+    # 未设置api_key的端点使用DEEPSEEK_API_KEY
+    API_ENDPOINTS = []
+    
+    # 端点延迟EWMA的平滑系数（0-1，越大越偏向最近的请求）
+    API_LATENCY_EWMA_ALPHA = 0.3
+    
+    # 端点连续失败达到该次数后暂时视为不健康，冷却时间（秒）后恢复尝试
+    API_ENDPOINT_FAILURE_THRESHOLD = 3
+    API_ENDPOINT_COOLDOWN = 30
+    
+    # 对冲请求：首个请求超过该端点历史延迟的指定分位数仍未返回时，
+    # 向第二个端点发送相同请求，先返回者胜出，另一个被取消
+    API_HEDGE_ENABLED = True
+    API_HEDGE_PERCENTILE = 95
+    # 延迟样本不足时使用的对冲等待时间（秒）
+    API_HEDGE_DEFAULT_DELAY = 8.0
+    
+    # 每次回复的硬性截止时间（秒），超时后放弃请求并使用兜底回复
+    API_REPLY_DEADLINE = 25
+    API_FALLBACK_REPLY = "让我想想……稍后再问我一次吧"
     
     # ===========================
     # 【微信窗口配置】
@@ -107,6 +259,131 @@ class Config:
     SEND_BUTTON_RELATIVE_X = 0.95  # 发送按钮的X坐标（窗口宽度的百分比）
     SEND_BUTTON_RELATIVE_Y = 0.85  # 发送按钮的Y坐标（窗口高度的百分比）
     
+    # 自动校准：在窗口截图中用模板匹配定位输入框和发送按钮，结果按窗口尺寸和DPI缓存，
+    # 只有窗口尺寸或DPI变化时才重新匹配；未找到模板或匹配失败时使用上面的相对位置
+    # 【可选修改】模板为从微信窗口截取的小图（PNG），offset为点击位置相对匹配中心的偏移（以模板宽高为单位）
+    CALIBRATION_ENABLED = True
+    CALIBRATION_TARGETS = {
+        "input_box": {"template": "calibration/input_toolbar.png", "offset": (0, 2.5)},  # 输入框上方的工具栏
+        "send_button": {"template": "calibration/send_button.png", "offset": (0, 0)},
+    }
+    CALIBRATION_CACHE_FILE = "calibration/cache.json"
+    # 截取模板时的屏幕DPI（100%缩放为96），DPI不同时按比例缩放模板
+    CALIBRATION_TEMPLATE_DPI = 96
+    # 在基准缩放比例附近尝试的比例
+    CALIBRATION_SCALE_FACTORS = (0.8, 0.9, 1.0, 1.1, 1.25)
+    # 匹配得分阈值（0-1），低于该值视为未找到
+    CALIBRATION_MATCH_THRESHOLD = 0.8
+    
+    # ===========================
+    # 【消息发送配置】
+    # ===========================
+    # 发送时不再固定等待，而是轮询确认每一步是否完成，每一步都有较短的超时
+    # 【可选修改】电脑较慢时可适当调大超时
+    SEND_POLL_INTERVAL = 0.05  # 轮询间隔（秒）
+    SEND_FOREGROUND_TIMEOUT = 1.5  # 等待微信窗口成为前台窗口的超时（秒）
+    SEND_CLIPBOARD_TIMEOUT = 0.5  # 等待剪贴板内容确认的超时（秒）
+    SEND_PASTE_TIMEOUT = 1.5  # 粘贴后等待输入框区域变化的超时（秒）
+    SEND_CONFIRM_TIMEOUT = 2.0  # 按下Enter后等待消息区域变化的超时（秒）
+    SEND_CLICK_SETTLE = 0.1  # 点击输入框后等待获得焦点的时间（秒）
+    
+    # 用于确认粘贴和发送的窗口区域：(左, 上, 右, 下)，均为窗口宽高的比例
+    # 【可选修改】应分别覆盖输入框和消息列表，与聊天框位置配置一致
+    SEND_INPUT_REGION = (0.3, 0.8, 0.98, 0.95)
+    SEND_MESSAGE_PANE_REGION = (0.3, 0.1, 0.98, 0.75)
+    # 区域截图平均灰度差超过该值视为发生变化
+    SEND_REGION_CHANGE_THRESHOLD = 2.0
+    
+    # 是否点击发送按钮发送（位置来自自动校准），默认按Enter发送
+    SEND_WITH_BUTTON = False
+    
+    # 模拟人工操作的随机停顿（可选，默认关闭，不再是每次发送的固定开销）
+    # 【可选修改】开启后每一步之后随机停顿SEND_HUMANIZE_STEP_DELAY秒，按Enter前额外停顿SEND_HUMANIZE_THINK_DELAY秒
+    SEND_HUMANIZE = False
+    SEND_HUMANIZE_STEP_DELAY = (0.1, 0.4)
+    SEND_HUMANIZE_THINK_DELAY = (0.2, 0.8)
+    
+    # 是否使用后台发送队列：检测到消息后立即继续截图识别，回复由单独的线程按顺序发送
+    # 【可选修改】设为False则在主循环中直接发送
+    SEND_QUEUE_ENABLED = True
+    # 发送队列容量，队列满时主循环等待
+    SEND_QUEUE_SIZE = 50
+    # 同时就绪的回复最多合并多少条为一条消息（合并时每条回复前加上@发送者），1表示不合并
+    # 【可选修改】
+    SEND_COALESCE_MAX_REPLIES = 5
+    # 取出一条回复后，再等待多少秒收集其他就绪的回复一起发送，0表示只合并已在队列中的回复
+    SEND_COALESCE_WINDOW = 0.0
+    # 单条消息的最大长度（字符），超长的回复会拆分为多条发送
+    SEND_MAX_MESSAGE_LENGTH = 1500
+    
+    # ===========================
+    # 【回复调度配置】
+    # ===========================
+    # 同时检测到多条@消息时，按角色优先级和等待时间排队回复；超过截止时间的消息不再调用API，
+    # 按策略丢弃或发送一条简短回复。角色JSON中可以用priority、reply_deadline、expired_policy、expired_reply单独设置
+    
+    # 是否启用回复调度
+    # 【可选修改】设为False则每帧只回复检测到的第一条消息，回复完成前不检测新消息
+    REPLY_SCHEDULER_ENABLED = True
+    # 从检测到消息起，超过多少秒仍未开始回复则视为过期，0表示不限
+    # 【可选修改】
+    REPLY_DEADLINE = 180
+    # 过期消息的处理方式："drop" 不回复，"short" 发送REPLY_EXPIRED_MESSAGE（不调用API）
+    REPLY_EXPIRED_POLICY = "short"
+    # 过期消息的简短回复，可使用{sender}和{question}（超过20字时截断）
+    REPLY_EXPIRED_MESSAGE = "@{sender} 抱歉，刚才消息太多，没来得及回复你的问题「{question}」"
+    # 每等待多少秒，消息的优先级提高1（避免低优先级角色的消息一直排不上），0表示只按角色优先级排序
+    REPLY_PRIORITY_AGING = 30
+    # 最多排队的消息数，超出时丢弃当前优先级最低的消息
+    REPLY_QUEUE_MAX_SIZE = 20
+    # 已丢弃或简短回复过的消息在屏幕上消失多少秒后才可以被重新检测（这些消息不会写入对话历史）
+    REPLY_SETTLED_MEMORY = 600
+    
+    # ===========================
+    # 【回复限流配置】
+    # ===========================
+    # 按发送者、角色和整个群分别限制回复频率（令牌桶），超出额度的消息在检测阶段丢弃，不调用API。
+    # BURST为短时间内最多连续回复的条数，PER_MINUTE为之后每分钟恢复的条数；BURST设为0表示不限制该维度
+    
+    # 是否启用回复限流
+    # 【可选修改】默认不限流；设为True启用，并按群的活跃程度调整下面的额度
+    RATE_LIMIT_ENABLED = False
+    # 同一发送者
+    RATE_LIMIT_SENDER_BURST = 3
+    RATE_LIMIT_SENDER_PER_MINUTE = 2
+    # 同一角色（所有发送者合计）
+    RATE_LIMIT_ROLE_BURST = 10
+    RATE_LIMIT_ROLE_PER_MINUTE = 6
+    # 整个群
+    RATE_LIMIT_GROUP_BURST = 20
+    RATE_LIMIT_GROUP_PER_MINUTE = 12
+    # 被限流时是否回复一条提示（同一发送者/角色/群在恢复之前只提示一次，提示不调用API）
+    # 【可选修改】默认静默丢弃被限流的消息，设为True时向被限流的发送者回复提示
+    RATE_LIMIT_NOTICE = False
+    # 各维度的提示内容，可使用{sender}和{role}，设为空字符串表示该维度不提示
+    RATE_LIMIT_NOTICE_MESSAGES = {
+        "sender": "@{sender} 你问得太频繁了，请稍后再问",
+        "role": "@{sender} {role}现在有点忙，请稍后再问",
+        "group": "@{sender} 现在提问的人太多了，请稍后再问",
+    }
+    # 被限流的消息在屏幕上消失多少秒后才会被重新判定（同一条消息在之后的帧中再次检测到时沿用之前的结果）
+    RATE_LIMIT_MEMORY = 600
+    
+    # ===========================
+    # 【运行指标配置】
+    # ===========================
+    # 记录各处理阶段耗时（截图、帧差异、OCR、窗口检查、触发词检测、发送者推断、重复检查、API请求、发送）
+    # 以及帧数、@消息数、回复数、错误数等计数，以Prometheus文本格式发布在 http://METRICS_HOST:METRICS_PORT/metrics
+    
+    # 是否启动指标HTTP服务
+    # 【可选修改】同一台电脑运行多个机器人时，为每个机器人设置不同的METRICS_PORT
+    METRICS_ENABLED = True
+    # 指标服务监听地址，默认只允许本机访问
+    METRICS_HOST = "127.0.0.1"
+    METRICS_PORT = 9464
+    # 输出指标汇总日志（各阶段平均值和p50/p95/p99）的间隔（秒），0表示只在退出时输出
+    METRICS_SUMMARY_INTERVAL = 300
+    
     # ===========================
     # 【聊天历史配置】
     # ===========================
@@ -115,14 +392,81 @@ class Config:
     # 聊天历史保存目录（通常不需要修改）
     CHAT_HISTORY_DIR = "chat_histories"
     
+    # 聊天历史存储后端
+    # 'jsonl'：每个角色一个追加式JSONL文件
+    # 'sqlite'：单个SQLite数据库（WAL模式），按角色、发送者和时间建立索引，适合长期保存和查询
+    # 【可选修改】切换为sqlite后，已有的JSON/JSONL历史文件会在首次加载对应角色时自动导入
+    CHAT_HISTORY_BACKEND = "jsonl"
+    
+    # SQLite数据库文件名（位于CHAT_HISTORY_DIR下，仅sqlite后端使用）
+    CHAT_HISTORY_DB_FILE = "chat_history.db"
+    
+    # 对话历史后台写入：记录先进入队列，由后台线程合并后批量写入，主循环不等待磁盘I/O
+    # 【可选修改】设为False则每轮对话在主循环中同步写入
+    HISTORY_WRITE_BEHIND = True
+    
+    # 写入队列容量，队列满时主循环会等待后台写入（不会丢弃历史）
+    HISTORY_WRITER_QUEUE_SIZE = 1000
+    
+    # 待写入记录达到该条数，或最早的待写入记录等待超过该秒数时，执行一次批量写入
+    HISTORY_WRITER_BATCH_SIZE = 20
+    HISTORY_WRITER_FLUSH_INTERVAL = 2.0
+    
+    # fsync策略：'always' 每批写入后立即同步到磁盘；'interval' 每隔HISTORY_WRITER_FSYNC_INTERVAL秒同步一次；
+    # 'never' 交给操作系统决定（断电时可能丢失最近的记录）
+    HISTORY_WRITER_FSYNC = "interval"
+    HISTORY_WRITER_FSYNC_INTERVAL = 10.0
+    
+    # 输出写入耗时和队列深度统计日志的间隔（秒），0表示只在退出时输出
+    HISTORY_WRITER_REPORT_INTERVAL = 600
+    
     # 内存中保存的最大对话轮数、发送给API的最大对话轮数
     # 【可选修改】值越大上下文理解越好，但API调用成本越高、内存占用越高
     MAX_API_HISTORY_LENGTH = 10
     
+    # 多角色历史缓存：内存中同时保留多个角色最近MAX_API_HISTORY_LENGTH轮对话，切换角色时无需读取文件
+    # 最多缓存的角色数，0表示按已加载的角色数量自动设置
+    HISTORY_CACHE_MAX_ROLES = 0
+    # 缓存的内存预算（字节，估算值），超出时按最近最少使用的顺序淘汰角色
+    HISTORY_CACHE_MAX_BYTES = 32 * 1024 * 1024
+
+    # 相关历史检索：为每个角色的全部对话历史建立本地索引（BM25），生成回复时只发送与问题最相关的
+    # HISTORY_RETRIEVAL_TOP_K轮早期对话和最近HISTORY_RETRIEVAL_RECENT_ROUNDS轮对话，而不是最近MAX_API_HISTORY_LENGTH轮
+    # 【可选修改】设为False则每次发送最近MAX_API_HISTORY_LENGTH轮对话
+    HISTORY_RETRIEVAL_ENABLED = True
+    HISTORY_RETRIEVAL_TOP_K = 3
+    # 最近几轮对话总是发送（不超过MAX_API_HISTORY_LENGTH）
+    HISTORY_RETRIEVAL_RECENT_ROUNDS = 4
+    # 相关度分数低于该值的早期对话不发送，值越大找回的对话越少、越相关
+    HISTORY_RETRIEVAL_MIN_SCORE = 8.0
+    # 分数低于最相关对话的该比例时不发送（只因"怎么"、"什么"等常用词相同而匹配的对话）
+    HISTORY_RETRIEVAL_RELATIVE_SCORE = 0.5
+    # 索引切分中文的n元组长度（修改后索引会在下次加载时重建）
+    HISTORY_INDEX_NGRAM_SIZES = (1, 2)
+    # 索引文件目录（位于CHAT_HISTORY_DIR下）
+    HISTORY_INDEX_DIRNAME = "index"
+    # 每新增多少轮对话保存一次索引（退出时总会保存）
+    HISTORY_INDEX_SAVE_INTERVAL = 20
+
     # 检查重复问题时往前查找的对话轮数
     # 【可选修改】设为0表示禁用重复检查，大于0表示检查最近N轮对话中是否有重复问题
     DUPLICATE_CHECK_HISTORY_LENGTH = 5
     
+    # 按时间窗口检查重复问题（分钟）
+    # 【可选修改】大于0时改为检查该时间窗口内的全部对话（最多DUPLICATE_CHECK_WINDOW_MAX_RECORDS条），
+    # 0表示只检查最近DUPLICATE_CHECK_HISTORY_LENGTH轮
+    DUPLICATE_CHECK_WINDOW_MINUTES = 0
+    DUPLICATE_CHECK_WINDOW_MAX_RECORDS = 200
+
+    # 是否记录被重复问题检查拦截的提问（CHAT_HISTORY_DIR下的SUPPRESSED_LOG_FILE），用于统计重复拦截率：
+    # python roles/history.py stats
+    # 已回答的消息仍显示在屏幕上时不会重复记录，只记录第一次看到时就已回答过的提问
+    # 【可选修改】
+    SUPPRESSED_LOG_ENABLED = True
+    SUPPRESSED_LOG_FILE = "suppressed.jsonl"
+    # 检测到的@消息在多少秒内没有再出现（已滚出窗口）后被遗忘，之后再出现视为新的提问
+    SUPPRESSED_LOG_MEMORY = 600
+
     @classmethod
     def get_role_system_prompt(cls, role):
         """根据角色获取对应的系统提示词"""
@@ -140,14 +484,20 @@ class Config:
         3. 如果不确定，坦诚表示不知道
         """
         
-        # 从ROLES列表中查找匹配的角色
-        for role_config in cls.ROLES:
-            if role_config["name"] in role or any(alias in role for alias in role_config["aliases"]):
-                return role_config["system_prompt"]
+        # 按名称或别名查找角色（哈希表查找，找不到时在字符串中匹配触发词）
+        resolved = cls.ROLE_REGISTRY.resolve(role)
+        if resolved is not None:
+            system_prompt = resolved.system_prompt
+            if system_prompt:
+                return system_prompt
+            logger.warning(f"角色{resolved.name}的系统提示词无法读取，使用默认提示词", extra={'save_to_file': True})
         
-        # 对于未知角色，使用默认提示词
+        # 对于未知角色（或提示词读取失败的角色），使用默认提示词
         return default_prompt
 
+# 角色热加载后同步更新Config.ROLES
+Config.ROLE_REGISTRY.add_listener(lambda index: setattr(Config, 'ROLES', index.role_configs))
+
 # 确保聊天历史目录存在
 os.makedirs(Config.CHAT_HISTORY_DIR, exist_ok=True)
 
@@ -0,0 +1,346 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+异步运行时模块
+用一个asyncio事件循环驱动机器人：截图调度、OCR识别、API回复、消息发送以及定期维护
+（对话历史刷新、角色热加载、运行统计）都是事件循环中的任务，可以设置超时、取消并相互重叠。
+现有的同步组件通过执行器适配，不需要改写：OCR在单独的线程中执行（PaddleOCR模型不是线程安全的），
+截图、API请求和磁盘I/O在I/O线程池中执行，读写对话历史的步骤在一个单线程执行器中串行执行。
+"""
+
+import time
+import signal
+import asyncio
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from config import logger, Config
+from utils.metrics import metrics
+
+
+class AsyncBotRuntime:
+    def __init__(self, bot):
+        """初始化异步运行时
+
+        Args:
+            bot: WeChatBot实例，复用其截图、识别、检测、回复和发送步骤
+        """
+        self.bot = bot
+        # OCR占用CPU且模型只加载一份，单线程执行，保证同一时间只有一帧在识别
+        self.ocr_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="OCR")
+        # 检测消息、切换角色和添加对话历史都会读写ChatHistoryManager，放在同一个线程中串行执行
+        self.state_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="BotState")
+        # 截图、API请求、历史刷新、角色目录扫描等阻塞操作
+        self.io_executor = ThreadPoolExecutor(max_workers=Config.ASYNC_IO_WORKERS, thread_name_prefix="BotIO")
+
+        self.stop_event = None
+        self.shut_down = False
+        self.tasks = []
+        # 正在生成或发送的回复任务
+        self.reply_tasks = set()
+        # 超时后仍在执行的OCR，完成前不再提交新的帧
+        self.pending_ocr = None
+        # 有新的@消息加入回复调度队列时设置，唤醒回复任务
+        self.reply_ready = None
+
+        self.frame_no = 0
+        self.stats = {"frames": 0, "skipped_frames": 0, "ocr_timeouts": 0, "replies": 0,
+                      "reply_timeouts": 0, "reply_errors": 0, "max_loop_lag_ms": 0.0}
+        self.stage_times = {stage: deque(maxlen=1000) for stage in ("capture", "ocr", "detect", "reply")}
+
+    def run(self):
+        """启动事件循环，直到收到停止信号（Ctrl+C或SIGTERM）"""
+        try:
+            asyncio.run(self.main())
+        except KeyboardInterrupt:
+            # 不支持信号回调的平台上，Ctrl+C会在main()清理完成后抛出到这里；
+            # 较旧的Python版本中Ctrl+C可能直接中断事件循环，此时在这里补做清理
+            if not self.shut_down:
+                logger.info("收到中断信号，微信机器人已停止", extra={'save_to_file': True})
+                self.bot.shutdown()
+
+    async def main(self):
+        """运行时主协程：启动各个任务，等待停止信号后有序退出"""
+        loop = asyncio.get_running_loop()
+        self.stop_event = asyncio.Event()
+        self.reply_ready = asyncio.Event()
+        self._install_signal_handlers(loop)
+
+        await loop.run_in_executor(self.io_executor, self.bot.announce_start)
+        logger.info("已启用异步运行时", extra={'save_to_file': True})
+
+        self.tasks = [asyncio.create_task(self._capture_loop(), name="capture")]
+        if self.bot.reply_scheduler:
+            self.tasks.append(asyncio.create_task(self._reply_worker(), name="reply_worker"))
+        if self.bot.chat_history_manager.history_writer:
+            self.tasks.append(asyncio.create_task(
+                self._periodic(Config.ASYNC_HISTORY_FLUSH_INTERVAL, self._flush_history), name="history_flush"))
+        if Config.ROLE_HOT_RELOAD:
+            self.tasks.append(asyncio.create_task(
+                self._periodic(Config.ROLE_RELOAD_INTERVAL, self._check_roles), name="role_reload"))
+        if Config.ASYNC_METRICS_INTERVAL > 0:
+            self.tasks.append(asyncio.create_task(
+                self._periodic(Config.ASYNC_METRICS_INTERVAL, self._report_metrics), name="metrics"))
+        if Config.METRICS_SUMMARY_INTERVAL > 0:
+            self.tasks.append(asyncio.create_task(
+                self._periodic(Config.METRICS_SUMMARY_INTERVAL, metrics.log_summary), name="metrics_summary"))
+        self.tasks.append(asyncio.create_task(self._monitor_loop_lag(), name="loop_lag"))
+
+        try:
+            stop_waiter = asyncio.create_task(self.stop_event.wait())
+            # 任一任务异常退出时也停止运行时
+            done, _ = await asyncio.wait(self.tasks + [stop_waiter], return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task is not stop_waiter and not task.cancelled() and task.exception():
+                    logger.error(f"任务{task.get_name()}异常退出: {task.exception()}", extra={'save_to_file': True})
+            stop_waiter.cancel()
+        except asyncio.CancelledError:
+            logger.info("收到中断信号，微信机器人正在停止...", extra={'save_to_file': True})
+        finally:
+            await self.shutdown()
+
+    def stop(self):
+        """请求停止运行时（可在事件循环线程中调用）"""
+        if self.stop_event is not None:
+            self.stop_event.set()
+
+    def _install_signal_handlers(self, loop):
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(signum, self._on_signal, signum)
+            except (NotImplementedError, RuntimeError, ValueError):
+                # Windows的事件循环不支持add_signal_handler，此时由asyncio.run把Ctrl+C转为取消main()
+                pass
+
+    def _on_signal(self, signum):
+        logger.info(f"收到信号{signal.Signals(signum).name}，微信机器人正在停止...", extra={'save_to_file': True})
+        self.stop()
+
+    async def shutdown(self):
+        """有序退出：停止截图和维护任务，等待进行中的回复，发送剩余消息并写入所有对话历史"""
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+
+        if self.reply_tasks:
+            logger.info(f"等待{len(self.reply_tasks)}条进行中的回复完成...", extra={'save_to_file': True})
+            _, pending = await asyncio.wait(self.reply_tasks, timeout=Config.ASYNC_SHUTDOWN_TIMEOUT)
+            for task in pending:
+                task.cancel()
+            if pending:
+                logger.warning(f"{len(pending)}条回复未能在{Config.ASYNC_SHUTDOWN_TIMEOUT}秒内完成，已放弃", extra={'save_to_file': True})
+
+        # 关闭发送队列、追踪记录和历史存储（阻塞操作，放到线程中执行）
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(self.io_executor, self.bot.shutdown)
+        except Exception as e:
+            logger.error(f"关闭机器人组件时出错: {e}", extra={'save_to_file': True})
+        # 回复调度和发送队列关闭时已输出自己的统计
+        logger.info(f"异步运行时统计: {self.format_stats()}", extra={'save_to_file': True})
+
+        for executor in (self.ocr_executor, self.state_executor, self.io_executor):
+            executor.shutdown(wait=False)
+        self.shut_down = True
+        logger.info("微信机器人已停止", extra={'save_to_file': True})
+
+    async def _capture_loop(self):
+        """按固定节奏截图：每SCREENSHOT_INTERVAL秒开始一帧，处理耗时计入间隔内，而不是处理完再等满一个间隔"""
+        loop = asyncio.get_running_loop()
+        next_tick = loop.time()
+        while True:
+            try:
+                await self._process_frame(loop)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"运行出错: {e}", extra={'save_to_file': True})
+
+            next_tick += Config.SCREENSHOT_INTERVAL
+            delay = next_tick - loop.time()
+            if delay < 0:
+                # 处理一帧超过了截图间隔，从当前时间重新计时，不补拍错过的帧
+                next_tick = loop.time()
+                delay = 0
+            await asyncio.sleep(delay)
+
+    async def _process_frame(self, loop):
+        """处理一帧：截图 -> OCR -> 检测，检测到消息时启动回复任务，不等待回复完成"""
+        if self.pending_ocr is not None and not self.pending_ocr.done():
+            # 上一帧的OCR超时后仍在执行，跳过本帧，避免帧在OCR线程中堆积
+            self.stats["skipped_frames"] += 1
+            return
+        self.pending_ocr = None
+
+        frame_start = time.perf_counter()
+        screenshot, timings = await loop.run_in_executor(self.io_executor, self.bot.capture_frame)
+        if screenshot is None:
+            return
+        # 画面与上一次检测时相同则跳过OCR和检测
+        if not await loop.run_in_executor(self.io_executor, self.bot.frame_changed, screenshot, timings):
+            return
+        self.frame_no += 1
+        self.stats["frames"] += 1
+        frame_no = self.frame_no
+
+        ocr_future = loop.run_in_executor(self.ocr_executor, self.bot.recognize_frame, screenshot, timings)
+        try:
+            texts = await asyncio.wait_for(asyncio.shield(ocr_future), Config.ASYNC_OCR_TIMEOUT)
+        except asyncio.TimeoutError:
+            self.pending_ocr = ocr_future
+            self.stats["ocr_timeouts"] += 1
+            logger.warning(f"第{frame_no}帧OCR超过{Config.ASYNC_OCR_TIMEOUT}秒未完成，跳过该帧", extra={'save_to_file': True})
+            return
+
+        if self.bot.reply_scheduler:
+            # 回复期间也检测触发词：调度器会忽略排队中和回复中的重复消息
+            mentions = await loop.run_in_executor(
+                self.state_executor, self.bot.detect_mentions, frame_no, screenshot, texts, timings)
+            self._record_stage_times(timings)
+            if mentions and self.bot.schedule_mentions(mentions, texts, frame_start):
+                self.reply_ready.set()
+            return
+
+        # 上一条回复尚未记录到对话历史时不检测触发词，否则同一个问题会被再次检测到
+        detect = len(self.reply_tasks) == 0
+        sender, question = await loop.run_in_executor(
+            self.state_executor, self.bot.detect_message, frame_no, screenshot, texts, timings, detect)
+        self._record_stage_times(timings)
+
+        if sender and question:
+            logger.info("检测到需要回复的消息，准备回复...", extra={'save_to_file': True})
+            # 在检测的同一线程中取好历史和角色快照，回复期间角色切换不会影响本次请求
+            history, role = await loop.run_in_executor(self.state_executor, self._history_snapshot, question)
+            task = asyncio.create_task(self._reply(sender, question, history, role, texts, frame_start),
+                                       name=f"reply-{frame_no}")
+            self.reply_tasks.add(task)
+            task.add_done_callback(self.reply_tasks.discard)
+
+    def _record_stage_times(self, timings):
+        for stage in ("capture", "ocr", "detect"):
+            if stage in timings:
+                self.stage_times[stage].append(timings[stage])
+
+    def _history_snapshot(self, question):
+        manager = self.bot.chat_history_manager
+        return manager.get_context_history(question), manager.current_role
+
+    async def _reply_worker(self):
+        """从回复调度队列中依次取出当前优先级最高的消息并回复，同一时间只回复一条"""
+        while True:
+            self.reply_ready.clear()
+            item = self.bot.reply_scheduler.pop()
+            if item is None:
+                await self.reply_ready.wait()
+                continue
+            task = asyncio.create_task(self._reply_scheduled(item), name=f"reply-{item.sender}")
+            self.reply_tasks.add(task)
+            task.add_done_callback(self.reply_tasks.discard)
+            # 不直接await任务：停止运行时取消本任务时，进行中的回复仍由shutdown()等待完成
+            await asyncio.wait({task})
+
+    async def _reply_scheduled(self, item):
+        """回复一条调度队列中的消息，超过截止时间的发送简短回复"""
+        loop = asyncio.get_running_loop()
+        settled = False
+        try:
+            if item.expired:
+                future = await loop.run_in_executor(
+                    self.state_executor, self.bot.dispatch_reply, item.sender, item.short_reply, item.texts, item.detected_at)
+                settled = True
+                if future is not None:
+                    await asyncio.wrap_future(future)
+                return
+            logger.info("检测到需要回复的消息，准备回复...", extra={'save_to_file': True})
+            history = await loop.run_in_executor(self.state_executor, self.bot.prepare_reply, item.role, item.question)
+            settled = await self._reply(item.sender, item.question, history, item.role, item.texts, item.detected_at)
+        finally:
+            self.bot.reply_scheduler.complete(item, settled)
+            if not settled and self.bot.text_differ:
+                # 没有生成回复：下一帧检测全部文本行，消息仍在屏幕上时会重新加入队列。
+                # 文本差异比较在状态线程中进行，重置也交给该线程，与detect_mentions串行执行
+                self.state_executor.submit(self.bot.text_differ.reset)
+
+    async def _reply(self, sender, question, history, role, texts, detected_at):
+        """生成回复、记录到对话历史并交给发送队列，等待发送完成
+
+        Returns:
+            bool: 是否已生成并记录回复（超时或出错时为False）
+        """
+        loop = asyncio.get_running_loop()
+        start = time.perf_counter()
+        try:
+            response = await asyncio.wait_for(
+                loop.run_in_executor(self.io_executor, self.bot.generate_reply, sender, question, history, role),
+                Config.ASYNC_REPLY_TIMEOUT)
+        except asyncio.TimeoutError:
+            # 执行器中的请求无法被强制中断，结果会被忽略；API客户端自身的截止时间通常会先生效
+            self.stats["reply_timeouts"] += 1
+            metrics.inc("errors", stage="api")
+            logger.error(f"生成回复超过{Config.ASYNC_REPLY_TIMEOUT}秒，已放弃: {question[:30]}", extra={'save_to_file': True})
+            return False
+        except Exception as e:
+            self.stats["reply_errors"] += 1
+            metrics.inc("errors", stage="api")
+            logger.error(f"生成回复时出错: {e}", extra={'save_to_file': True})
+            return False
+        self.stage_times["reply"].append((time.perf_counter() - start) * 1000)
+
+        # 生成回复期间可能已检测到其他角色的消息并切换了当前角色，按本条消息的角色记录
+        await loop.run_in_executor(self.state_executor, self.bot.record_reply, sender, question, response, role)
+        self.stats["replies"] += 1
+
+        # 使用发送队列时返回发送结果的Future（队列满时submit会等待，因此也放在线程中执行）；
+        # 没有发送队列时在线程中直接发送，发送期间不占用事件循环
+        future = await loop.run_in_executor(self.state_executor, self.bot.dispatch_reply, sender, response, texts, detected_at)
+        if future is not None:
+            await asyncio.wrap_future(future)
+        return True
+
+    async def _periodic(self, interval, callback):
+        """每interval秒在I/O线程中执行一次callback，单次失败不影响后续执行"""
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await loop.run_in_executor(self.io_executor, callback)
+            except Exception as e:
+                logger.error(f"定期任务{callback.__name__}执行失败: {e}", extra={'save_to_file': True})
+
+    def _flush_history(self):
+        """把后台写入队列中的对话历史写入磁盘"""
+        self.bot.chat_history_manager.history_writer.flush(timeout=Config.ASYNC_HISTORY_FLUSH_INTERVAL)
+
+    def _check_roles(self):
+        """检查roles目录，有变化时重新加载角色（代替RoleRegistry的后台监视线程）"""
+        Config.ROLE_REGISTRY.check_for_changes()
+
+    async def _monitor_loop_lag(self):
+        """测量事件循环的调度延迟，延迟持续偏高说明有阻塞操作直接运行在了事件循环中"""
+        loop = asyncio.get_running_loop()
+        interval = 0.5
+        while True:
+            start = loop.time()
+            await asyncio.sleep(interval)
+            lag_ms = (loop.time() - start - interval) * 1000
+            if lag_ms > self.stats["max_loop_lag_ms"]:
+                self.stats["max_loop_lag_ms"] = lag_ms
+
+    def _report_metrics(self):
+        logger.info(f"异步运行时统计: {self.format_stats()}", extra={'save_to_file': True})
+        if self.bot.reply_scheduler:
+            logger.info(f"回复调度统计: {self.bot.reply_scheduler.format_stats()}", extra={'save_to_file': True})
+        if self.bot.send_queue:
+            logger.info(f"发送队列统计: {self.bot.send_queue.format_stats()}", extra={'save_to_file': True})
+
+    def format_stats(self):
+        stats = self.stats
+        text = (f"已处理{stats['frames']}帧，跳过{stats['skipped_frames']}帧，OCR超时{stats['ocr_timeouts']}次，"
+                f"回复{stats['replies']}条，回复超时{stats['reply_timeouts']}次，回复出错{stats['reply_errors']}次，"
+                f"进行中{len(self.reply_tasks)}条，事件循环最大延迟{stats['max_loop_lag_ms']:.0f}ms")
+        for stage, samples in self.stage_times.items():
+            values = sorted(samples)
+            if values:
+                p95 = values[min(len(values) - 1, int(len(values) * 0.95))]
+                text += f"，{stage} 平均{sum(values) / len(values):.0f}ms / p95 {p95:.0f}ms"
+        return text
@@ -8,115 +8,424 @@
 
 import time
 from config import Config, logger
-from utils.window_manager import WindowManager
+from utils.image_diff import gray_thumbnail, regions_differ
 from utils.ocr_handler import OCRHandler
 from utils.chat_history import ChatHistoryManager
 from utils.api_client import APIClient
 from core.message_detector import MessageDetector
-from core.message_sender import MessageSender
+from core.send_queue import SendQueue
+from core.reply_scheduler import ReplyScheduler
+from utils.rate_limiter import RateLimiter
+from utils.text_diff import TextDiffer
+from utils.trace_recorder import TraceRecorder
+from utils.metrics import metrics, start_metrics_server
 
 class WeChatBot:
-    def __init__(self):
-        """初始化微信机器人"""
+    def __init__(self, window_manager=None, ocr_handler=None, api_client=None, message_sender=None):
+        """初始化微信机器人
+
+        Args:
+            window_manager: 截图来源，需提供capture_wechat_screen()等方法，默认为WindowManager
+            ocr_handler: OCR处理器，默认使用PaddleOCR引擎
+            api_client: 回复生成客户端，默认为APIClient
+            message_sender: 发送后端，需提供send()和send_message()，默认为MessageSender
+        传入替代组件（如benchmarks/e2e_replay.py中的回放截图和FakeMessageSender）时，
+        可以在没有win32和桌面的环境中运行完整流程。
+        """
         # 这些初始化信息需要保存到文件
         logger.info("正在初始化微信机器人...", extra={'save_to_file': True})
         
-        # 初始化各个模块
-        self.window_manager = WindowManager()
-        self.ocr_handler = OCRHandler()
+        # 初始化各个模块（界面相关模块依赖win32，只在未传入替代组件时导入）
+        if window_manager is None:
+            from utils.window_manager import WindowManager
+            window_manager = WindowManager()
+        self.window_manager = window_manager
+        self.ocr_handler = ocr_handler or OCRHandler()
         self.chat_history_manager = ChatHistoryManager()
-        self.api_client = APIClient()
+        self.api_client = api_client or APIClient()
         
         # 初始化消息检测和发送组件
-        self.message_detector = MessageDetector(self.ocr_handler, self.chat_history_manager)
-        self.message_sender = MessageSender(self.window_manager)
+        # 回复限流（可选）：按发送者、角色和群限制回复频率，被限流的消息不调用API
+        self.rate_limiter = RateLimiter(self.chat_history_manager.is_similar_question) if Config.RATE_LIMIT_ENABLED else None
+        self.message_detector = MessageDetector(self.ocr_handler, self.chat_history_manager, self.rate_limiter)
+        # OCR文本差异（可选）：只检测与上一次检测的帧相比新出现的文本行及其上下文
+        self.text_differ = TextDiffer() if Config.TEXT_DIFF_ENABLED else None
+        if message_sender is None:
+            from core.message_sender import MessageSender
+            message_sender = MessageSender(self.window_manager)
+        self.message_sender = message_sender
+        # 后台发送队列（可选），串行化界面操作并合并同时就绪的回复
+        self.send_queue = SendQueue(self.message_sender) if Config.SEND_QUEUE_ENABLED else None
+        # 回复调度（可选）：同时检测到的多条@消息按角色优先级和等待时间排队，超过截止时间的不再生成回复
+        self.reply_scheduler = ReplyScheduler(self.chat_history_manager.is_similar_question) if Config.REPLY_SCHEDULER_ENABLED else None
+        
+        # 帧追踪记录（可选），用于离线回放检测逻辑
+        self.trace_recorder = TraceRecorder() if Config.TRACE_ENABLED else None
+        
+        # 上一次完成检测的帧的缩略图，画面没有变化时跳过OCR
+        self.last_thumbnail = None
+        self.pending_thumbnail = None
+        
+        # 运行指标：各阶段耗时直方图和计数器，可通过本机HTTP端口抓取
+        metrics.add_collector(self._collect_metrics)
+        self.metrics_server = start_metrics_server() if Config.METRICS_ENABLED else None
         
         # 这些初始化信息需要保存到文件
         logger.info(f"当前角色: {self.chat_history_manager.current_role}", extra={'save_to_file': True})
         logger.info(f"当前已加载{len(self.chat_history_manager.chat_history)}轮历史对话", extra={'save_to_file': True})
     
     def run(self):
-        """运行机器人主循环"""
+        """运行机器人主循环（同步版本，Config.ASYNC_RUNTIME为False时使用）"""
+        # 监视roles目录，角色修改后自动重新加载（异步运行时改为在事件循环中定时检查）
+        if Config.ROLE_HOT_RELOAD:
+            Config.ROLE_REGISTRY.start_watching(Config.ROLE_RELOAD_INTERVAL)
+        metrics.start_reporter(Config.METRICS_SUMMARY_INTERVAL)
+        self.announce_start()
+        
+        frame_no = 0
+        try:
+            while True:
+                frame_no = self.process_frame(frame_no)
+
+                # 等待一段时间再次截图
+                time.sleep(Config.SCREENSHOT_INTERVAL)
+        
+        except KeyboardInterrupt:
+            # 停止信息保存到文件
+            logger.info("收到中断信号，微信机器人已停止", extra={'save_to_file': True})
+            self.shutdown()
+        except Exception as e:
+            # 错误信息保存到文件
+            logger.error(f"运行出错: {e}", extra={'save_to_file': True})
+            self.shutdown()
+    
+    def process_frame(self, frame_no):
+        """同步处理一帧：截图 -> 帧差异 -> OCR -> 检测，检测到消息时生成并发送回复
+
+        Returns:
+            int: 处理后的帧序号（截图失败或画面没有变化时不变）
+        """
+        # 截取微信窗口（如果窗口最小化则跳过截图）
+        frame_start = time.perf_counter()
+        screenshot, timings = self.capture_frame()
+        
+        # 画面与上一次检测时相同则跳过OCR和检测
+        if screenshot is None or not self.frame_changed(screenshot, timings):
+            if self.reply_scheduler:
+                self.reply_next()
+            return frame_no
+        
+        frame_no += 1
+        texts = self.recognize_frame(screenshot, timings)
+        if self.reply_scheduler:
+            # 本帧的所有@消息加入队列，然后回复其中当前优先级最高的一条，其余的在之后的帧中回复
+            mentions = self.detect_mentions(frame_no, screenshot, texts, timings)
+            self.schedule_mentions(mentions, texts, frame_start)
+            self.reply_next()
+            return frame_no
+        sender, question = self.detect_message(frame_no, screenshot, texts, timings)
+        
+        if sender and question:
+            # 检测到消息的提示信息保存到文件
+            logger.info("检测到需要回复的消息，准备回复...", extra={'save_to_file': True})
+            response = self.generate_reply(sender, question)
+            self.record_reply(sender, question, response)
+            self.dispatch_reply(sender, response, texts, frame_start)
+        return frame_no
+    
+    # 以下方法是主循环的各个步骤，同步主循环和异步运行时（core/async_runtime.py）共用
+    
+    def announce_start(self):
+        """输出启动信息，并记录微信窗口最初的状态"""
         # 这些启动信息需要保存到文件
         logger.info("微信机器人已启动，正在监控群聊...", extra={'save_to_file': True})
         logger.info(f"当前角色: {self.chat_history_manager.current_role}", extra={'save_to_file': True})
         
         # 打印所有可用角色 (也保存到文件)
         logger.info("可用角色列表:", extra={'save_to_file': True})
-        for role in Config.ROLES:
-            logger.info(f"- {role['name']} (别名: {', '.join(role['aliases'])})", extra={'save_to_file': True})
+        for role in Config.ROLE_REGISTRY.roles:
+            logger.info(f"- {role.name} (别名: {', '.join(role.aliases)})", extra={'save_to_file': True})
         
         # 记录窗口最初的状态
         initial_minimized = False
-        if self.window_manager.wechat_hwnd:
-            initial_minimized = self.window_manager.is_window_minimized()
-        else:
+        if not self.window_manager.wechat_hwnd:
             # 查找微信窗口
             self.window_manager.find_wechat_window()
-            if self.window_manager.wechat_hwnd:
-                initial_minimized = self.window_manager.is_window_minimized()
+        if self.window_manager.wechat_hwnd:
+            initial_minimized = self.window_manager.is_window_minimized()
         
         # 窗口状态信息保存到文件
         logger.info(f"微信窗口初始状态: {'最小化' if initial_minimized else '正常'}", extra={'save_to_file': True})
-        
+    
+    def capture_frame(self):
+        """截取微信窗口
+
+        Returns:
+            tuple: (截图, 耗时dict)，窗口不可用时截图为None
+        """
+        capture_start = time.perf_counter()
+        screenshot = self.window_manager.capture_wechat_screen()
+        timings = {"capture": (time.perf_counter() - capture_start) * 1000}
+        metrics.observe_stage("capture", timings["capture"])
+        if screenshot is not None:
+            metrics.inc("frames")
+        return screenshot, timings
+    
+    def frame_changed(self, screenshot, timings):
+        """与上一次完成检测的帧比较，画面没有明显变化时返回False（可跳过OCR和检测）
+
+        比较的是灰度缩略图的平均像素差，输入框光标闪烁等细微变化不会触发重新识别。
+        """
+        if not Config.FRAME_DIFF_ENABLED:
+            return True
+        diff_start = time.perf_counter()
+        thumbnail = gray_thumbnail(screenshot)
+        changed = self.last_thumbnail is None or regions_differ(self.last_thumbnail, thumbnail, Config.FRAME_DIFF_THRESHOLD)
+        # 检测完成后才作为比较基准，检测被跳过的帧（如上一条回复尚未完成）下次仍会重新识别
+        self.pending_thumbnail = thumbnail
+        timings["frame_diff"] = (time.perf_counter() - diff_start) * 1000
+        metrics.observe_stage("frame_diff", timings["frame_diff"])
+        if not changed:
+            metrics.inc("frames_unchanged")
+        return changed
+    
+    def recognize_frame(self, screenshot, timings):
+        """识别截图中的文字，耗时记入timings (置信度打印已在 ocr_handler.py 内部完成)"""
+        ocr_start = time.perf_counter()
         try:
-            while True:
-                # 截取微信窗口（如果窗口最小化则跳过截图）
-                screenshot = self.window_manager.capture_wechat_screen()
-                
-                if screenshot is not None:
-                    # 识别文字 (置信度打印已在 ocr_handler.py 内部完成)
-                    texts = self.ocr_handler.recognize_text(screenshot)
-
-                    # 检查是否识别到微信窗口名称
-                    if not self.ocr_handler.detect_wechat_window_name(texts):
-                        time.sleep(Config.SCREENSHOT_INTERVAL)
-                        continue
-                    
-                    # 检测触发词
-                    sender, question = self.message_detector.detect_trigger(texts)
-                    
-                    if sender and question:
-                        # 检测到消息的提示信息保存到文件
-                        logger.info("检测到需要回复的消息，准备回复...", extra={'save_to_file': True})
-                        
-                        # 生成回复
-                        response = self.api_client.generate_response(
-                            sender, 
-                            question, 
-                            self.chat_history_manager.get_recent_history(),
-                            self.chat_history_manager.current_role
-                        )
-                        
-                        # 添加到聊天历史
-                        self.chat_history_manager.add_chat(sender, question, response)
-                        
-                        # 发送回复
-                        send_success = self.message_sender.send_message(response)
-                        
-                        # 在发送成功时将OCR结果写入日志文件
-                        if send_success:
-                            # 仅在发送成功时，将本次OCR详细结果记录到日志文件
-                            if texts:
-                                logger.info("---------- 本次成功回复对应的OCR识别详情 ----------", extra={'save_to_file': True})
-                                for text, confidence, position in texts:
-                                    # 格式化包含文本、置信度和位置的日志条目
-                                    log_entry = f"文本: '{text}', 置信度: {confidence:.4f}, 位置: {position}"
-                                    logger.info(log_entry, extra={'save_to_file': True})
-                                logger.info("-----------------------------------------------------------------", extra={'save_to_file': True})
-                            else:
-                                logger.info("本次OCR未识别到有效文本", extra={'save_to_file': True})
+            texts = self.ocr_handler.recognize_text(screenshot)
+        except Exception:
+            metrics.inc("errors", stage="ocr")
+            raise
+        timings["ocr"] = (time.perf_counter() - ocr_start) * 1000
+        metrics.observe_stage("ocr", timings["ocr"])
+        return texts
+    
+    def detect_message(self, frame_no, screenshot, texts, timings, detect=True):
+        """检查窗口名称并检测触发词，同时记录本帧的追踪信息
 
-                # 等待一段时间再次截图
-                time.sleep(Config.SCREENSHOT_INTERVAL)
+        Args:
+            detect: 为False时只检查窗口名称、不检测触发词（如上一条回复尚未完成）
+
+        Returns:
+            tuple: (发送者, 问题内容)，没有需要回复的消息时返回(None, None)
+        """
+        mentions = self.detect_mentions(frame_no, screenshot, texts, timings, detect, limit=1)
+        if mentions:
+            return mentions[0][:2]
+        return None, None
+    
+    def detect_mentions(self, frame_no, screenshot, texts, timings, detect=True, limit=None):
+        """检查窗口名称并检测本帧中所有需要回复的@消息，同时记录本帧的追踪信息
+
+        Args:
+            detect: 为False时只检查窗口名称、不检测触发词
+            limit: 最多检测的消息数，None表示不限
+
+        Returns:
+            list: [(发送者, 问题内容, 角色名称)]
+        """
+        # 检查是否识别到微信窗口名称
+        check_start = time.perf_counter()
+        window_detected = self.ocr_handler.detect_wechat_window_name(texts)
+        timings["window_check"] = (time.perf_counter() - check_start) * 1000
+        metrics.observe_stage("window_check", timings["window_check"])
+        if not window_detected:
+            self._mark_frame_checked()
+            self._record_trace(frame_no, screenshot, False, None, timings)
+            return []
         
-        except KeyboardInterrupt:
-            # 停止信息保存到文件
-            logger.info("收到中断信号，微信机器人已停止", extra={'save_to_file': True})
-            # 保存当前对话历史
-            self.chat_history_manager.save_chat_history() # 这个函数内部的日志也应该考虑是否加标记
-        except Exception as e:
-            # 错误信息保存到文件
-            logger.error(f"运行出错: {e}", extra={'save_to_file': True})
-            # 保存当前对话历史
-            self.chat_history_manager.save_chat_history() # 这个函数内部的日志也应该考虑是否加标记
+        mentions = []
+        if detect:
+            # 检测触发词（只检测新行及其上下文；每条@消息的发送者从scan_texts中该触发词所在行的上一行推断，
+            # TEXT_DIFF_CONTEXT_BEFORE行上下文保证这一行与触发词行在屏幕上相邻）
+            detect_start = time.perf_counter()
+            scan_texts = self.text_differ.new_lines(texts) if self.text_differ else texts
+            mentions = self.message_detector.detect_triggers(scan_texts, limit)
+            if self.text_differ and limit is not None and len(mentions) >= limit:
+                # 达到数量限制时本帧可能还有未检测的新消息，下一次检测全部文本行
+                self.text_differ.reset()
+            timings["detect"] = (time.perf_counter() - detect_start) * 1000
+            metrics.observe_stage("detect", timings["detect"])
+            self._mark_frame_checked()
+            # 使用回复调度时同一条消息会在之后的帧中被再次检测到，只在首次加入队列时计数
+            if mentions and not self.reply_scheduler:
+                metrics.inc("mentions", len(mentions))
+        # 追踪记录只保存第一条消息的检测结果，与逐条检测时的记录格式一致
+        self._record_trace(frame_no, screenshot, True, mentions[0] if mentions else None, timings)
+        if self.rate_limiter:
+            # 被限流时的提示（每次限流只提示一次）不调用API，直接发送
+            for sender, notice in self.rate_limiter.take_notices():
+                self.dispatch_reply(sender, notice, texts)
+        return mentions
+    
+    def schedule_mentions(self, mentions, texts, detected_at=None):
+        """将检测到的@消息加入回复调度队列，重复的消息（排队中、回复中或刚处理过）会被忽略
+
+        Returns:
+            int: 新加入队列的消息数
+        """
+        added = 0
+        for sender, question, role in mentions:
+            if self.reply_scheduler.submit(sender, question, role, texts, detected_at):
+                added += 1
+        if added:
+            metrics.inc("mentions", added)
+        return added
+    
+    def reply_next(self):
+        """同步回复调度队列中当前优先级最高的一条消息
+
+        Returns:
+            bool: 是否处理了一条消息
+        """
+        item = self.reply_scheduler.pop()
+        if item is None:
+            return False
+        if item.expired:
+            self.dispatch_reply(item.sender, item.short_reply, item.texts, item.detected_at)
+            self.reply_scheduler.complete(item)
+            return True
+        logger.info("检测到需要回复的消息，准备回复...", extra={'save_to_file': True})
+        try:
+            response = self.generate_reply(item.sender, item.question, self.prepare_reply(item.role, item.question), item.role)
+        except Exception:
+            # 没有生成回复：丢弃文本差异的比较基准，下一帧检测全部文本行，消息仍在屏幕上时会重新加入队列
+            self.reply_scheduler.complete(item, settled=False)
+            if self.text_differ:
+                self.text_differ.reset()
+            raise
+        self.record_reply(item.sender, item.question, response, item.role)
+        self.dispatch_reply(item.sender, response, item.texts, item.detected_at)
+        self.reply_scheduler.complete(item)
+        return True
+    
+    def prepare_reply(self, role, question):
+        """切换到消息对应的角色，返回该角色用于回答question的对话历史（用于API请求）"""
+        self.chat_history_manager.switch_role(role)
+        return self.chat_history_manager.get_context_history(question)
+    
+    def _mark_frame_checked(self):
+        """本帧的检测结果已确定，作为之后帧差异比较的基准"""
+        if self.pending_thumbnail is not None:
+            self.last_thumbnail = self.pending_thumbnail
+    
+    def generate_reply(self, sender, question, history=None, role=None):
+        """调用API生成回复
+
+        Args:
+            history, role: 对话历史和角色，默认为当前角色与问题相关的早期对话和最近历史；异步运行时在检测时取好快照再传入
+        """
+        if history is None:
+            history = self.chat_history_manager.get_context_history(question)
+        with metrics.timer("api"):
+            return self.api_client.generate_response(
+                sender, 
+                question, 
+                history,
+                role or self.chat_history_manager.current_role
+            )
+    
+    def record_reply(self, sender, question, response, role=None):
+        """添加到聊天历史
+
+        Args:
+            role: 消息对应的角色，生成回复期间检测其他消息可能已切换了当前角色，记录前切换回来
+        """
+        if role:
+            self.chat_history_manager.switch_role(role)
+        self.chat_history_manager.add_chat(sender, question, response)
+    
+    def dispatch_reply(self, sender, response, texts, detected_at=None):
+        """发送回复
+
+        Args:
+            detected_at: 检测到该消息的帧开始截图的时间（time.perf_counter()），用于统计从@到回复发出的总耗时
+
+        Returns:
+            Future: 使用发送队列时返回发送结果的Future，否则直接发送并返回None
+        """
+        if self.send_queue:
+            # 交给发送队列，发送完成后再记录OCR详情，主循环继续截图识别
+            future = self.send_queue.submit(sender, response)
+            future.add_done_callback(
+                lambda f, texts=texts: self._on_reply_sent(bool(f.result() and f.result().success), texts, detected_at))
+            return future
+        with metrics.timer("send"):
+            send_success = self.message_sender.send_message(response)
+        self._on_reply_sent(send_success, texts, detected_at)
+        return None
+    
+    def _on_reply_sent(self, send_success, texts, detected_at):
+        if send_success:
+            metrics.inc("replies")
+            if detected_at is not None:
+                metrics.observe_stage("mention_to_reply", (time.perf_counter() - detected_at) * 1000)
+        else:
+            metrics.inc("errors", stage="send")
+        self._log_ocr_details(send_success, texts)
+    
+    def shutdown(self):
+        """退出前调用：发送剩余回复、写入所有待写入的对话历史并关闭存储"""
+        Config.ROLE_REGISTRY.stop_watching()
+        metrics.stop_reporter()
+        if self.reply_scheduler:
+            self.reply_scheduler.close()
+        if self.text_differ:
+            logger.info(f"OCR文本差异统计: {self.text_differ.format_stats()}", extra={'save_to_file': True})
+        if self.rate_limiter:
+            logger.info(f"回复限流统计: {self.rate_limiter.format_stats()}", extra={'save_to_file': True})
+        if self.send_queue:
+            self.send_queue.close()
+        if self.trace_recorder:
+            self.trace_recorder.close()
+        self.ocr_handler.close()
+        self.chat_history_manager.close()
+        metrics.log_summary()
+        if self.metrics_server:
+            self.metrics_server.close()
+    
+    def _collect_metrics(self):
+        """导出各组件自己维护的统计，供指标服务抓取"""
+        collected = [
+            ("history_cache_hits_total", "counter", "角色历史缓存命中次数", self.chat_history_manager.history_cache.stats["hits"]),
+            ("history_cache_misses_total", "counter", "角色历史缓存未命中次数", self.chat_history_manager.history_cache.stats["misses"]),
+        ]
+        calibrator = getattr(self.window_manager, "calibrator", None)
+        if calibrator is not None:
+            collected.append(("calibration_cache_hits_total", "counter", "界面位置校准缓存命中次数", calibrator.stats["hits"]))
+        for key, value in self.api_client.stats.items():
+            collected.append((f"api_{key}_total", "counter", f"API客户端统计: {key}", value))
+        if self.reply_scheduler:
+            collected.append(("reply_queue_depth", "gauge", "等待回复的@消息数", self.reply_scheduler.depth()))
+        if self.send_queue:
+            collected.append(("send_queue_depth", "gauge", "发送队列中等待发送的回复数", self.send_queue.queue.qsize()))
+        if self.trace_recorder:
+            collected.append(("trace_dropped_total", "counter", "追踪记录丢弃的帧数", self.trace_recorder.stats["dropped"]))
+        return collected
+    
+    def _log_ocr_details(self, send_success, texts):
+        """仅在发送成功时，将本次OCR详细结果记录到日志文件"""
+        if not send_success:
+            return
+        if texts:
+            # 整段详情合并为一条日志，只入队一次
+            log_lines = ["---------- 本次成功回复对应的OCR识别详情 ----------"]
+            for text, confidence, position in texts:
+                # 格式化包含文本、置信度和位置的日志条目
+                log_lines.append(f"文本: '{text}', 置信度: {confidence:.4f}, 位置: {position}")
+            log_lines.append("-----------------------------------------------------------------")
+            logger.info("\n".join(log_lines), extra={'save_to_file': True})
+        else:
+            logger.info("本次OCR未识别到有效文本", extra={'save_to_file': True})
+    
+    def _record_trace(self, frame_no, screenshot, window_detected, mention, timings):
+        """将本帧的OCR原始结果、检测结果和耗时交给追踪记录器"""
+        if not self.trace_recorder:
+            return
+        decision = None
+        if mention:
+            sender, question, role = mention
+            decision = {"sender": sender, "question": question, "role": role}
+        self.trace_recorder.record(frame_no, screenshot, self.ocr_handler.last_raw_lines,
+                                   window_detected, decision, timings)
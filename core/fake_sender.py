@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+模拟消息发送模块
+与MessageSender接口相同，但不操作微信界面，只记录发送的消息，用于在Linux等无桌面环境中测试发送队列和端到端流程
+"""
+
+import time
+import random
+import threading
+from core.send_result import SendResult
+
+
+class FakeMessageSender:
+    def __init__(self, latency=0.0, failure_rate=0.0, seed=None):
+        """初始化模拟发送器
+
+        Args:
+            latency: 每次发送的模拟耗时（秒），模拟粘贴和回车所需时间
+            failure_rate: 发送失败的概率（0-1）
+            seed: 随机数种子，便于复现
+        """
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.random = random.Random(seed)
+        # 已发送的消息：(发送时间, 消息内容)
+        self.sent = []
+        self.last_result = None
+        # 同时进入send的调用数，用于检查界面访问是否被串行化
+        self.active = 0
+        self.max_active = 0
+        self.lock = threading.Lock()
+
+    def send(self, message):
+        result = SendResult()
+        self.last_result = result
+        with self.lock:
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        start = time.perf_counter()
+        try:
+            if self.latency > 0:
+                time.sleep(self.latency)
+            if self.failure_rate > 0 and self.random.random() < self.failure_rate:
+                result.failed_step = 'confirm'
+            else:
+                result.success = True
+                self.sent.append((time.time(), message))
+        finally:
+            result.timings['confirm'] = (time.perf_counter() - start) * 1000
+            with self.lock:
+                self.active -= 1
+        return result
+
+    def send_message(self, message):
+        return self.send(message).success
+
+    @property
+    def messages(self):
+        """已发送的消息内容列表"""
+        return [message for _, message in self.sent]
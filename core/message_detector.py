@@ -6,15 +6,24 @@
 负责检测和识别微信消息中的触发词和问题内容
 """
 
+import time
 from config import Config, logger
+from utils.metrics import metrics
 
 class MessageDetector:
-    def __init__(self, ocr_handler, chat_history_manager):
-        """初始化消息检测器"""
+    def __init__(self, ocr_handler, chat_history_manager, rate_limiter=None):
+        """初始化消息检测器
+
+        Args:
+            rate_limiter: 回复限流器（utils/rate_limiter.py），为None时不限流
+        """
         self.ocr_handler = ocr_handler
         self.chat_history_manager = chat_history_manager
+        self.rate_limiter = rate_limiter
         # 上一次识别到的消息，用于避免重复回复
         self.last_message = ""
+        # 最近检测到的@消息：[发送者, 角色, 问题, 最后一次看到的时间]，只在第一次看到时记录被拦截的重复问题
+        self.seen_mentions = []
     
     def detect_trigger(self, texts):
         """检测是否有人@机器人，并识别对应的角色
@@ -25,58 +34,60 @@ class MessageDetector:
         Returns:
             tuple: (发送者, 问题内容) 如果没有检测到触发词或问题则返回(None, None)
         """
-        for text, confidence, position in texts:
-            # 检查是否包含任何角色的触发词或其别名
-            trigger_found = False
-            trigger_word = None
-            role_name = None
+        mentions = self.detect_triggers(texts, limit=1)
+        if mentions:
+            return mentions[0][:2]
+        return None, None
+    
+    def detect_triggers(self, texts, limit=None):
+        """检测一帧中所有@机器人且未回答过的消息
+        
+        Args:
+            texts: OCR识别到的文本列表，每项包含(文本内容, 置信度, 位置)
+            limit: 最多返回的消息数，None表示不限
             
-            # 遍历所有角色配置
-            for role in Config.ROLES:
-                # 检查主触发词
-                if role["name"] in text:
-                    trigger_found = True
-                    trigger_word = role["name"]
-                    role_name = role["name"]
-                    break
-                
-                # 检查别名
-                for alias in role["aliases"]:
-                    if alias in text:
-                        logger.info(f"检测到触发词别名: {alias}，将作为 {role['name']} 处理", extra={'save_to_file': True})
-                        trigger_found = True
-                        trigger_word = alias
-                        role_name = role["name"]
-                        break
-                
-                if trigger_found:
-                    break
+        Returns:
+            list: [(发送者, 问题内容, 角色名称)]，按在屏幕上出现的顺序排列；
+                检测结束后当前角色为最后一条消息的角色
+        """
+        # 整个检测过程使用同一份角色索引，避免中途热加载导致前后不一致
+        role_index = Config.ROLE_REGISTRY.index
+        mentions = []
+        
+        for line_index, (text, confidence, position) in enumerate(texts):
+            # 检查是否包含任何角色的触发词或其别名（所有触发词已编译为一个正则）
+            trigger_word, role = role_index.find_trigger(text)
             
-            if trigger_found:
+            if trigger_word:
+                role_name = role.name
+                if trigger_word != role_name:
+                    logger.info(f"检测到触发词别名: {trigger_word}，将作为 {role_name} 处理", extra={'save_to_file': True})
+                
                 # 如果检测到新角色，切换到该角色
                 if role_name != self.chat_history_manager.current_role:
                     self.chat_history_manager.switch_role(role_name)
                 
-                # 尝试从上一条OCR识别结果推断发送者名称
-                inferred_sender = self.ocr_handler.infer_sender_name()
-                
-                # 如果能够从上一条OCR结果中推断出发送者名称，则使用它
-                if inferred_sender:
-                    sender = inferred_sender
-                else:
-                    # 如果无法推断，尝试从当前文本中提取发送者名称
-                    sender = Config.DEFAULT_USER_NAME  # 默认发送者名称
-                    trigger_pos = text.find(trigger_word)
-                    if trigger_pos > 0:
-                        # 尝试从文本中提取发送者名称
-                        possible_sender = text[:trigger_pos].strip()
-                        if possible_sender:
-                            # 验证提取的名称是否在配置的用户名列表中
-                            for user in Config.USER_NAMES:
-                                if possible_sender == user['name'] or (
-                                    'aliases' in user and possible_sender in user['aliases']):
-                                    sender = user['name']
-                                    break
+                with metrics.timer("sender_inference"):
+                    # 尝试从触发词所在行的上一条OCR识别结果推断发送者名称（每条@消息使用各自的上一行）
+                    inferred_sender = self.ocr_handler.infer_sender_name(role_index, texts, line_index)
+                    
+                    # 如果能够从上一条OCR结果中推断出发送者名称，则使用它
+                    if inferred_sender:
+                        sender = inferred_sender
+                    else:
+                        # 如果无法推断，尝试从当前文本中提取发送者名称
+                        sender = Config.DEFAULT_USER_NAME  # 默认发送者名称
+                        trigger_pos = text.find(trigger_word)
+                        if trigger_pos > 0:
+                            # 尝试从文本中提取发送者名称
+                            possible_sender = text[:trigger_pos].strip()
+                            if possible_sender:
+                                # 验证提取的名称是否在配置的用户名列表中
+                                for user in Config.USER_NAMES:
+                                    if possible_sender == user['name'] or (
+                                        'aliases' in user and possible_sender in user['aliases']):
+                                        sender = user['name']
+                                        break
                 
                 # 提取@后面的内容
                 after_trigger = text[text.find(trigger_word) + len(trigger_word):].strip()
@@ -96,11 +107,35 @@ class MessageDetector:
                 if after_trigger:
                     logger.info(f"检测到触发词 {trigger_word}，发送者: {sender}，问题: {after_trigger}", extra={'save_to_file': True})
                     # 重复问题检查
-                    if self.chat_history_manager.is_question_already_answered(after_trigger, sender):
+                    with metrics.timer("duplicate_check"):
+                        answered = self.chat_history_manager.is_question_already_answered(after_trigger, sender)
+                    first_seen = Config.SUPPRESSED_LOG_ENABLED and self._first_sighting(sender, role_name, after_trigger)
+                    if answered:
+                        metrics.inc("duplicates_suppressed")
+                        if first_seen:
+                            # 第一次看到时就已回答过，说明有人重复提问（而不是已回答的消息仍显示在屏幕上），记录供统计重复拦截率
+                            self.chat_history_manager.record_suppressed(sender, after_trigger)
                         logger.info(f"当前问题'{after_trigger}'重复问题检查未通过，继续检查下一条问题", extra={'save_to_file': True})
                         continue
                     else:
                         logger.info(f"当前问题'{after_trigger}'重复问题检查通过，允许回答", extra={'save_to_file': True})
-                        return sender, after_trigger
+                        # 回复频率限制，在调用API之前丢弃超出额度的消息
+                        if self.rate_limiter and not self.rate_limiter.allow(sender, role_name, after_trigger):
+                            continue
+                        mentions.append((sender, after_trigger, role_name))
+                        if limit is not None and len(mentions) >= limit:
+                            break
         
-        return None, None
+        return mentions
+    
+    def _first_sighting(self, sender, role_name, question):
+        """是否第一次看到这条@消息；之前看到过时刷新时间，消息滚出窗口SUPPRESSED_LOG_MEMORY秒后才会被遗忘"""
+        now = time.perf_counter()
+        memory = Config.SUPPRESSED_LOG_MEMORY
+        self.seen_mentions = [entry for entry in self.seen_mentions if now - entry[3] <= memory]
+        for entry in self.seen_mentions:
+            if entry[0] == sender and entry[1] == role_name and self.chat_history_manager.is_similar_question(entry[2], question):
+                entry[3] = now
+                return False
+        self.seen_mentions.append([sender, role_name, question, now])
+        return True
@@ -10,52 +10,147 @@ import time
 import random
 import pyperclip
 import pyautogui
-from config import logger
+from config import logger, Config
+from utils.window_manager import wait_until
+from utils.image_diff import regions_differ
+from core.send_result import SendResult
+
 
 class MessageSender:
     def __init__(self, window_manager):
         """初始化消息发送器"""
         self.window_manager = window_manager
-    
+        # 最近一次发送的结果
+        self.last_result = None
+
     def send_message(self, message):
         """发送消息到微信聊天框
-        
+
         Args:
             message: 要发送的消息内容
-            
+
         Returns:
             bool: 发送成功返回True，失败返回False
         """
+        return self.send(message).success
+
+    def send(self, message):
+        """发送消息，每一步轮询确认完成，并记录各步骤耗时
+
+        Returns:
+            SendResult: 发送结果
+        """
+        result = SendResult()
+        self.last_result = result
+        step = None
+        step_start = time.perf_counter()
+
+        def finish_step():
+            nonlocal step_start
+            now = time.perf_counter()
+            result.timings[step] = (now - step_start) * 1000
+            step_start = now
+
         try:
-            # 首先复制消息到剪贴板
+            # 复制消息到剪贴板，并确认剪贴板内容
+            step = 'clipboard'
             logger.info(f"复制消息到剪贴板: {message[:30]}...")
             pyperclip.copy(message)
-            time.sleep(random.uniform(0.3, 0.8))  # 随机等待复制完成
-            
+            if not wait_until(lambda: pyperclip.paste() == message, Config.SEND_CLIPBOARD_TIMEOUT):
+                return self._fail(result, step, "剪贴板内容未能确认")
+            finish_step()
+            self._humanize_pause()
+
+            # 激活微信窗口，确认其成为前台窗口
+            step = 'activate'
+            if not self.window_manager.activate_window():
+                return self._fail(result, step, "微信窗口未能成为前台窗口")
+            finish_step()
+
             # 点击聊天输入框
-            if not self.window_manager.click_chat_input():
-                return False
-            time.sleep(random.uniform(0.2, 0.5))  # 随机等待点击完成
-            
-            # 粘贴消息
+            step = 'click'
+            if not self.window_manager.click_chat_input(activate=False):
+                return self._fail(result, step, "点击聊天输入框失败")
+            input_before = self.window_manager.capture_region(Config.SEND_INPUT_REGION)
+            pane_before = self.window_manager.capture_region(Config.SEND_MESSAGE_PANE_REGION)
+            finish_step()
+            self._humanize_pause()
+
+            # 粘贴消息，确认输入框区域发生变化
+            step = 'paste'
             logger.info("粘贴消息")
             pyautogui.hotkey('ctrl', 'v')
-            time.sleep(random.uniform(0.8, 1.5))  # 随机等待粘贴完成
-            
-            # 随机决定是否添加额外延迟
-            if random.random() < 0.3:  # 30%概率添加额外延迟
-                extra_delay = random.uniform(0.2, 0.5)
-                logger.info(f"添加额外思考延迟: {extra_delay:.2f}s")
-                time.sleep(extra_delay)
-            
-            # 按下Enter键发送消息
-            logger.info("按下Enter键发送消息")
-            pyautogui.press('enter')
-            time.sleep(random.uniform(0.3, 0.8))  # 随机等待发送完成
-            
-            logger.info("消息已发送", extra={'save_to_file': True})
-            return True
-        
+            if not self._wait_region_change(result, 'input', Config.SEND_INPUT_REGION, input_before, Config.SEND_PASTE_TIMEOUT):
+                # 可能点击位置不对，下次发送前重新校准输入框位置
+                self.window_manager.recalibrate()
+                return self._fail(result, step, "粘贴后输入框没有变化")
+            input_pasted = self.window_manager.capture_region(Config.SEND_INPUT_REGION)
+            finish_step()
+
+            # 可选的"思考"停顿
+            step = 'jitter'
+            if Config.SEND_HUMANIZE:
+                time.sleep(random.uniform(*Config.SEND_HUMANIZE_THINK_DELAY))
+            self._humanize_pause()
+            finish_step()
+
+            # 按下Enter键发送消息，确认消息区域（或输入框被清空）发生变化
+            step = 'confirm'
+            if Config.SEND_WITH_BUTTON:
+                logger.info("点击发送按钮")
+                self.window_manager.click_send_button()
+            else:
+                logger.info("按下Enter键发送消息")
+                pyautogui.press('enter')
+            confirmed = self._wait_sent(result, pane_before, input_pasted)
+            finish_step()
+            if not confirmed:
+                return self._fail(result, step, "按下Enter后消息区域没有变化，消息可能未发送")
+
+            result.success = True
+            logger.info(f"消息已发送（{result.format_timings()}）", extra={'save_to_file': True})
+            return result
+
         except Exception as e:
-            logger.error(f"消息发送失败: {e}", extra={'save_to_file': True})
+            return self._fail(result, step, f"消息发送失败: {e}")
+
+    def _fail(self, result, step, reason):
+        result.failed_step = step
+        logger.error(f"{reason}（{result.format_timings()}）", extra={'save_to_file': True})
+        return result
+
+    def _humanize_pause(self):
+        """开启SEND_HUMANIZE时在步骤之间随机停顿，耗时计入下一步骤"""
+        if Config.SEND_HUMANIZE:
+            time.sleep(random.uniform(*Config.SEND_HUMANIZE_STEP_DELAY))
+
+    def _wait_region_change(self, result, name, region, before, timeout):
+        """轮询等待区域截图相对before发生变化；无法截图时跳过该检查"""
+        if before is None:
+            result.skipped_checks.append(name)
+            return True
+
+        def changed():
+            after = self.window_manager.capture_region(region)
+            return after is not None and regions_differ(before, after)
+
+        return wait_until(changed, timeout)
+
+    def _wait_sent(self, result, pane_before, input_pasted):
+        """发送确认：消息区域出现新消息，或输入框中粘贴的内容被清空"""
+        if pane_before is None and input_pasted is None:
+            result.skipped_checks.append('sent')
+            return True
+
+        def sent():
+            if pane_before is not None:
+                pane = self.window_manager.capture_region(Config.SEND_MESSAGE_PANE_REGION)
+                if pane is not None and regions_differ(pane_before, pane):
+                    return True
+            if input_pasted is not None:
+                current = self.window_manager.capture_region(Config.SEND_INPUT_REGION)
+                if current is not None and regions_differ(input_pasted, current):
+                    return True
             return False
+
+        return wait_until(sent, Config.SEND_CONFIRM_TIMEOUT)
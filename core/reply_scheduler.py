@@ -0,0 +1,216 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+回复调度模块
+同一时间检测到多条@消息时，待回复的消息进入优先队列，按角色优先级和等待时间决定回复顺序，
+而不是严格按检测顺序逐条回复。每条消息有截止时间（角色JSON中的reply_deadline或全局REPLY_DEADLINE），
+轮到它时已超过截止时间则丢弃或改为发送一条简短的致歉回复，不再调用API，避免在讨论已经结束后才回复。
+"""
+
+import time
+import threading
+from collections import deque
+from config import logger, Config
+from utils.metrics import metrics
+
+EXPIRED_POLICIES = ("drop", "short")
+
+
+class PendingReply:
+    __slots__ = ('sender', 'question', 'role', 'texts', 'priority', 'detected_at',
+                 'deadline', 'policy', 'expired_message', 'expired')
+
+    def __init__(self, sender, question, role, texts, detected_at):
+        """一条等待回复的@消息
+
+        Args:
+            detected_at: 检测到该消息的帧开始截图的时间（time.perf_counter()），等待时间和截止时间都从这里算起
+        """
+        self.sender = sender
+        self.question = question
+        self.role = role
+        self.texts = texts
+        self.detected_at = detected_at
+        settings = role_reply_settings(role)
+        self.priority = settings["priority"]
+        self.deadline = detected_at + settings["deadline"] if settings["deadline"] > 0 else None
+        self.policy = settings["policy"]
+        self.expired_message = settings["expired_message"]
+        # 取出时已超过截止时间（且策略为short）时为True，调用方应发送short_reply而不是生成回复
+        self.expired = False
+
+    def score(self, now):
+        """当前优先级：角色优先级加上等待时间带来的提升，等待越久越靠前，低优先级角色不会一直排不上"""
+        if Config.REPLY_PRIORITY_AGING > 0:
+            return self.priority + (now - self.detected_at) / Config.REPLY_PRIORITY_AGING
+        return self.priority
+
+    def sort_key(self, now):
+        # 优先级高的在前，相同时截止时间早的在前，再按检测顺序
+        return (-self.score(now), self.deadline if self.deadline is not None else float('inf'), self.detected_at)
+
+    @property
+    def short_reply(self):
+        """超过截止时间后发送的简短回复"""
+        question = self.question if len(self.question) <= 20 else self.question[:20] + "…"
+        return self.expired_message.format(sender=self.sender, question=question)
+
+    def __repr__(self):
+        return f"PendingReply({self.role!r}, {self.sender!r}, {self.question[:20]!r})"
+
+
+def role_reply_settings(role_name):
+    """读取角色的调度设置，角色JSON中未设置的项使用全局配置
+
+    角色JSON中的可选字段：priority（数字，越大越优先）、reply_deadline（秒，0表示不限）、
+    expired_policy（"drop"或"short"）、expired_reply（简短回复模板，可使用{sender}和{question}）
+    """
+    role = Config.ROLE_REGISTRY.get(role_name)
+    config = role.config if role is not None else {}
+    policy = config.get('expired_policy', Config.REPLY_EXPIRED_POLICY)
+    return {
+        "priority": config.get('priority', 0),
+        "deadline": config.get('reply_deadline', Config.REPLY_DEADLINE),
+        "policy": policy if policy in EXPIRED_POLICIES else "drop",
+        "expired_message": config.get('expired_reply', Config.REPLY_EXPIRED_MESSAGE),
+    }
+
+
+class ReplyScheduler:
+    def __init__(self, is_similar):
+        """初始化回复调度器
+
+        Args:
+            is_similar: 判断两个问题是否相似的函数（ChatHistoryManager.is_similar_question），
+                用于识别下一帧中再次检测到的同一条消息
+        """
+        self.is_similar = is_similar
+        self.max_size = Config.REPLY_QUEUE_MAX_SIZE
+        self.lock = threading.Lock()
+        # 等待回复的消息，数量很少（一次突发通常只有几条），取出时线性查找当前优先级最高的一条
+        self.pending = []
+        # 已取出、正在生成或发送回复的消息
+        self.in_flight = []
+        # 已处理但没有写入对话历史的消息（被丢弃或发送了简短回复）-> 最后一次在屏幕上看到的时间，
+        # 仍显示在屏幕上时不会被重新加入队列
+        self.settled = []
+
+        self.stats = {"submitted": 0, "duplicates": 0, "dispatched": 0, "expired_dropped": 0,
+                      "expired_short": 0, "overflow_dropped": 0, "max_depth": 0}
+        self.wait_times = deque(maxlen=1000)
+
+    def submit(self, sender, question, role, texts=None, detected_at=None):
+        """加入一条检测到的@消息
+
+        Returns:
+            PendingReply: 加入的消息；与排队中、回复中或刚处理过的消息重复时返回None
+        """
+        now = time.perf_counter()
+        with self.lock:
+            if self._is_known(sender, question, role, now):
+                self.stats["duplicates"] += 1
+                return None
+            item = PendingReply(sender, question, role, texts, detected_at if detected_at is not None else now)
+            self.pending.append(item)
+            self.stats["submitted"] += 1
+            if len(self.pending) > self.max_size:
+                # 队列已满：丢弃当前优先级最低的一条（可能就是新加入的这条）
+                worst = max(self.pending, key=lambda pending: pending.sort_key(now))
+                self.pending.remove(worst)
+                self._settle(worst, now)
+                self.stats["overflow_dropped"] += 1
+                metrics.inc("replies_dropped", reason="overflow")
+                logger.warning(f"待回复队列已满（{self.max_size}条），丢弃{worst.sender}的问题: {worst.question[:30]}", extra={'save_to_file': True})
+                if worst is item:
+                    return None
+            self.stats["max_depth"] = max(self.stats["max_depth"], len(self.pending))
+        logger.info(f"@消息已加入待回复队列（{role}，优先级{item.priority}），当前{len(self.pending)}条等待回复", extra={'save_to_file': True})
+        return item
+
+    def pop(self):
+        """取出当前优先级最高的消息
+
+        已超过截止时间的消息按策略处理：drop直接丢弃并继续取下一条；short则标记expired后返回，由调用方发送简短回复。
+
+        Returns:
+            PendingReply: 没有等待回复的消息时返回None
+        """
+        now = time.perf_counter()
+        with self.lock:
+            while self.pending:
+                item = min(self.pending, key=lambda pending: pending.sort_key(now))
+                self.pending.remove(item)
+                wait_ms = (now - item.detected_at) * 1000
+                self.wait_times.append(wait_ms)
+                metrics.observe_stage("queue_wait", wait_ms)
+                if item.deadline is not None and now > item.deadline:
+                    if item.policy == "drop":
+                        self._settle(item, now)
+                        self.stats["expired_dropped"] += 1
+                        metrics.inc("replies_dropped", reason="expired")
+                        logger.info(f"{item.sender}的问题等待{wait_ms / 1000:.0f}秒已超过截止时间，不再回复: {item.question[:30]}", extra={'save_to_file': True})
+                        continue
+                    item.expired = True
+                    self.stats["expired_short"] += 1
+                    metrics.inc("replies_downgraded")
+                    logger.info(f"{item.sender}的问题等待{wait_ms / 1000:.0f}秒已超过截止时间，改为简短回复: {item.question[:30]}", extra={'save_to_file': True})
+                self.in_flight.append(item)
+                self.stats["dispatched"] += 1
+                return item
+        return None
+
+    def complete(self, item, settled=True):
+        """一条取出的消息处理完成
+
+        Args:
+            settled: 消息不应再被回复（已回复、已发送简短回复）时为True；生成回复失败时为False，不记入已处理的消息，
+                之后再次检测到时会重新加入队列（启用TEXT_DIFF_ENABLED时调用方需调用TextDiffer.reset()，否则未变化的行不会再被检测）
+        """
+        with self.lock:
+            if item in self.in_flight:
+                self.in_flight.remove(item)
+            if settled:
+                self._settle(item, time.perf_counter())
+
+    def _settle(self, item, now):
+        self.settled.append([item, now])
+
+    def _is_known(self, sender, question, role, now):
+        """是否与排队中、回复中或刚处理过的消息重复（同一角色、同一发送者的相似问题）"""
+        memory = Config.REPLY_SETTLED_MEMORY
+        self.settled = [entry for entry in self.settled if now - entry[1] <= memory]
+        for item in self.pending + self.in_flight:
+            if item.role == role and item.sender == sender and self.is_similar(item.question, question):
+                return True
+        for entry in self.settled:
+            item = entry[0]
+            if item.role == role and item.sender == sender and self.is_similar(item.question, question):
+                # 仍在屏幕上，刷新时间，直到消息滚出窗口后才会被遗忘
+                entry[1] = now
+                return True
+        return False
+
+    def depth(self):
+        with self.lock:
+            return len(self.pending)
+
+    def close(self):
+        """退出时输出统计，未处理的消息不再回复"""
+        with self.lock:
+            abandoned = len(self.pending)
+            self.pending = []
+        if abandoned:
+            logger.info(f"退出时放弃{abandoned}条等待回复的消息", extra={'save_to_file': True})
+        logger.info(f"回复调度统计: {self.format_stats()}", extra={'save_to_file': True})
+
+    def format_stats(self):
+        stats = self.stats
+        text = (f"加入{stats['submitted']}条，重复{stats['duplicates']}次，已取出{stats['dispatched']}条，"
+                f"超时丢弃{stats['expired_dropped']}条，超时简短回复{stats['expired_short']}条，"
+                f"队列满丢弃{stats['overflow_dropped']}条，最大排队{stats['max_depth']}条")
+        values = sorted(self.wait_times)
+        if values:
+            p95 = values[min(len(values) - 1, int(len(values) * 0.95))]
+            text += f"，排队等待平均{sum(values) / len(values) / 1000:.1f}秒 / p95 {p95 / 1000:.1f}秒"
+        return text
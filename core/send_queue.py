@@ -0,0 +1,226 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+消息发送队列模块
+所有回复都经由一个后台线程串行发送，保证同一时间只有一个界面自动化操作，并按提交顺序发送。
+同时已就绪的多条回复会合并为一条消息（每条回复前加上@发送者），减少粘贴/回车的次数；
+超长回复按微信单条消息的长度拆分为多条发送。
+"""
+
+import time
+import queue
+import threading
+from collections import deque
+from concurrent.futures import Future
+from config import logger, Config
+from utils.metrics import metrics
+
+# 优先在这些字符之后拆分超长消息
+SPLIT_BOUNDARIES = "\n。！？!?；;"
+
+
+def split_message(text, max_length):
+    """将超长消息拆分为不超过max_length的若干段，尽量在换行或句末拆分"""
+    chunks = []
+    text = text.strip()
+    while len(text) > max_length:
+        window = text[:max_length]
+        cut = max(window.rfind(char) for char in SPLIT_BOUNDARIES) + 1
+        # 边界太靠前时直接按长度拆分，避免产生过短的分段
+        if cut < max_length // 2:
+            cut = max_length
+        chunks.append(text[:cut].rstrip())
+        text = text[cut:].lstrip()
+    if text:
+        chunks.append(text)
+    return chunks
+
+
+class OutboundReply:
+    __slots__ = ('conversation', 'sender', 'text', 'enqueued_at', 'future')
+
+    def __init__(self, conversation, sender, text):
+        """一条待发送的回复"""
+        self.conversation = conversation
+        self.sender = sender
+        self.text = text
+        self.enqueued_at = time.perf_counter()
+        # 发送完成后设置为SendResult
+        self.future = Future()
+
+
+class SendQueue:
+    def __init__(self, message_sender):
+        """初始化发送队列并启动后台发送线程
+
+        Args:
+            message_sender: 发送后端，需提供send(message)并返回SendResult（MessageSender或FakeMessageSender）
+        """
+        self.message_sender = message_sender
+        self.queue = queue.Queue(maxsize=Config.SEND_QUEUE_SIZE)
+        self.max_length = Config.SEND_MAX_MESSAGE_LENGTH
+        self.coalesce_max = Config.SEND_COALESCE_MAX_REPLIES
+        self.coalesce_window = Config.SEND_COALESCE_WINDOW
+
+        # 统计信息
+        self.stats = {
+            "submitted": 0, "sent": 0, "failed": 0, "coalesced": 0,
+            "ui_sends": 0, "chunks": 0, "max_queue_depth": 0,
+        }
+        self.wait_times = deque(maxlen=1000)
+        self.send_times = deque(maxlen=1000)
+        self.busy_seconds = 0.0
+        self.started_at = time.perf_counter()
+
+        self.closed = False
+        self.thread = threading.Thread(target=self._run, name="SendQueue", daemon=True)
+        self.thread.start()
+
+    def submit(self, sender, text, conversation=None):
+        """提交一条回复，立即返回
+
+        Args:
+            sender: 提问者，合并多条回复时用于@前缀
+            text: 回复内容
+            conversation: 会话标识，同一会话内按提交顺序发送，默认为当前微信群
+
+        Returns:
+            Future: 发送完成后结果为SendResult
+        """
+        reply = OutboundReply(conversation or Config.WECHAT_WINDOW_NAME, sender, text)
+        self.stats["submitted"] += 1
+        self.queue.put(reply)
+        depth = self.queue.qsize()
+        if depth > self.stats["max_queue_depth"]:
+            self.stats["max_queue_depth"] = depth
+        return reply.future
+
+    def close(self, timeout=30):
+        """发送队列中剩余的回复并停止后台线程"""
+        if self.closed:
+            return
+        self.queue.put(None)
+        self.thread.join(timeout)
+        self.closed = True
+        logger.info(f"发送队列已停止，{self.format_stats()}", extra={'save_to_file': True})
+
+    def _collect_batch(self, first):
+        """取出与first同时就绪的回复（最多coalesce_max条），返回(回复列表, 是否收到停止信号)"""
+        batch = [first]
+        deadline = time.perf_counter() + self.coalesce_window
+        while len(batch) < self.coalesce_max:
+            try:
+                remaining = deadline - time.perf_counter()
+                item = self.queue.get(timeout=remaining) if remaining > 0 else self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    def _build_messages(self, batch):
+        """按会话分组（保持各会话内的提交顺序），合并为若干条消息
+
+        Returns:
+            list: [(会话, 消息文本, 包含的回复列表)]
+        """
+        groups = {}
+        for reply in batch:
+            groups.setdefault(reply.conversation, []).append(reply)
+
+        messages = []
+        for conversation, replies in groups.items():
+            if len(replies) == 1:
+                messages.append((conversation, replies[0].text, replies))
+                continue
+            # 多条回复合并时加上@发送者（本身已经以@发送者开头的回复不再重复添加），超过单条消息长度时另起一条
+            current_text, current_replies = "", []
+            for reply in replies:
+                text = reply.text.strip()
+                mention = f"@{reply.sender}"
+                part = text if text.startswith(mention) else f"{mention} {text}"
+                if current_replies and len(current_text) + 2 + len(part) > self.max_length:
+                    messages.append((conversation, current_text, current_replies))
+                    current_text, current_replies = "", []
+                current_text = f"{current_text}\n\n{part}" if current_text else part
+                current_replies.append(reply)
+            messages.append((conversation, current_text, current_replies))
+        return messages
+
+    def _send_message(self, text):
+        """发送一条（可能需要拆分的）消息，某一段失败时不再发送剩余分段
+
+        Returns:
+            SendResult: 最后发送的一段的结果
+        """
+        result = None
+        for chunk in split_message(text, self.max_length):
+            start = time.perf_counter()
+            result = self.message_sender.send(chunk)
+            elapsed = time.perf_counter() - start
+            self.send_times.append(elapsed)
+            metrics.observe_stage("send", elapsed * 1000)
+            self.stats["ui_sends"] += 1
+            self.stats["chunks"] += 1
+            if not result.success:
+                break
+        return result
+
+    def _run(self):
+        """后台线程：取出同时就绪的回复，合并、拆分后依次发送"""
+        while True:
+            first = self.queue.get()
+            if first is None:
+                return
+            batch, stopping = self._collect_batch(first)
+
+            busy_start = time.perf_counter()
+            for reply in batch:
+                self.wait_times.append(busy_start - reply.enqueued_at)
+            if len(batch) > 1:
+                self.stats["coalesced"] += len(batch)
+
+            for conversation, text, replies in self._build_messages(batch):
+                try:
+                    result = self._send_message(text)
+                except Exception as e:
+                    logger.error(f"发送队列发送消息失败: {e}", extra={'save_to_file': True})
+                    result = None
+                success = bool(result and result.success)
+                self.stats["sent" if success else "failed"] += len(replies)
+                if len(replies) > 1:
+                    logger.info(f"已将{len(replies)}条回复合并为一条消息发送到{conversation}", extra={'save_to_file': True})
+                for reply in replies:
+                    reply.future.set_result(result)
+            self.busy_seconds += time.perf_counter() - busy_start
+
+            if stopping:
+                return
+
+    def get_stats(self):
+        """返回发送统计：计数、队列等待和发送耗时（毫秒）、吞吐量"""
+        stats = dict(self.stats)
+        stats["queue_depth"] = self.queue.qsize()
+        elapsed = time.perf_counter() - self.started_at
+        stats["replies_per_minute"] = stats["sent"] / elapsed * 60 if elapsed > 0 else 0.0
+        stats["busy_ratio"] = self.busy_seconds / elapsed if elapsed > 0 else 0.0
+        for name, samples in (("wait", self.wait_times), ("send", self.send_times)):
+            values = sorted(samples)
+            if values:
+                stats[f"{name}_ms_avg"] = sum(values) / len(values) * 1000
+                stats[f"{name}_ms_p95"] = values[min(len(values) - 1, int(len(values) * 0.95))] * 1000
+                stats[f"{name}_ms_max"] = values[-1] * 1000
+        return stats
+
+    def format_stats(self):
+        stats = self.get_stats()
+        text = (f"已发送{stats['sent']}/{stats['submitted']}条回复，失败{stats['failed']}条，"
+                f"合并发送{stats['coalesced']}条，界面发送{stats['ui_sends']}次，"
+                f"吞吐量{stats['replies_per_minute']:.1f}条/分钟，队列峰值{stats['max_queue_depth']}")
+        if "wait_ms_avg" in stats:
+            text += f"，排队 平均{stats['wait_ms_avg']:.0f}ms / p95 {stats['wait_ms_p95']:.0f}ms"
+        if "send_ms_avg" in stats:
+            text += f"，发送 平均{stats['send_ms_avg']:.0f}ms / p95 {stats['send_ms_p95']:.0f}ms"
+        return text
@@ -0,0 +1,37 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+发送结果模块
+记录一次消息发送是否成功、失败的步骤和各步骤耗时；不依赖界面自动化库，可在无桌面环境中使用
+"""
+
+# 发送步骤，按执行顺序排列，用于耗时明细
+SEND_STEPS = ('clipboard', 'activate', 'click', 'paste', 'jitter', 'confirm')
+SEND_STEP_NAMES = {
+    'clipboard': '剪贴板', 'activate': '激活窗口', 'click': '点击输入框',
+    'paste': '粘贴', 'jitter': '随机停顿', 'confirm': '发送确认',
+}
+
+
+class SendResult:
+    def __init__(self):
+        """一次发送的结果：是否成功、失败的步骤和各步骤耗时"""
+        self.success = False
+        # 失败的步骤（SEND_STEPS之一），成功时为None
+        self.failed_step = None
+        # 各步骤耗时（毫秒）
+        self.timings = {}
+        # 因无法截图等原因跳过的确认检查
+        self.skipped_checks = []
+
+    @property
+    def total_ms(self):
+        return sum(self.timings.values())
+
+    def format_timings(self):
+        parts = [f"{SEND_STEP_NAMES[step]}{self.timings[step]:.0f}ms" for step in SEND_STEPS if step in self.timings]
+        return "，".join(parts) + f"，总计{self.total_ms:.0f}ms"
+
+    def __bool__(self):
+        return self.success
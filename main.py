@@ -7,9 +7,15 @@
 注意：仅在微信窗口未最小化时工作。
 """
 
+from config import Config
 from core.bot import WeChatBot
 
 if __name__ == "__main__":
     # 创建并运行微信机器人
     bot = WeChatBot()
-    bot.run()
+    # 旧版本复制的配置文件中没有ASYNC_RUNTIME，此时使用同步主循环
+    if getattr(Config, 'ASYNC_RUNTIME', False):
+        from core.async_runtime import AsyncBotRuntime
+        AsyncBotRuntime(bot).run()
+    else:
+        bot.run()
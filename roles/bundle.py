@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+角色包
+将roles目录下的全部角色文件预编译为单个文件（.roles_bundle.json），包含校验结果、触发词索引和内容哈希。
+只有修改时间或内容哈希发生变化的文件才会被重新解析；系统提示词不放入角色包，首次使用时再从源文件读取。
+"""
+
+import os
+import json
+import hashlib
+import logging
+
+logger = logging.getLogger(__name__)
+
+BUNDLE_FILENAME = ".roles_bundle.json"
+BUNDLE_FORMAT_VERSION = 1
+
+
+def validate_role_config(config):
+    """校验角色配置，返回错误描述列表（为空表示有效）"""
+    if not isinstance(config, dict):
+        return ["配置必须是JSON对象"]
+    errors = []
+    name = config.get('name')
+    if not isinstance(name, str) or not name.strip():
+        errors.append("name 必须是非空字符串")
+    aliases = config.get('aliases')
+    if not isinstance(aliases, list) or not all(isinstance(alias, str) and alias.strip() for alias in aliases):
+        errors.append("aliases 必须是非空字符串组成的列表")
+    system_prompt = config.get('system_prompt')
+    if not isinstance(system_prompt, str) or not system_prompt.strip():
+        errors.append("system_prompt 必须是非空字符串")
+    # 可选的回复调度设置（core/reply_scheduler.py）
+    priority = config.get('priority', 0)
+    if isinstance(priority, bool) or not isinstance(priority, (int, float)):
+        errors.append("priority 必须是数字")
+    deadline = config.get('reply_deadline', 0)
+    if isinstance(deadline, bool) or not isinstance(deadline, (int, float)) or deadline < 0:
+        errors.append("reply_deadline 必须是不小于0的数字（秒）")
+    if config.get('expired_policy', 'drop') not in ('drop', 'short'):
+        errors.append('expired_policy 必须是 "drop" 或 "short"')
+    if not isinstance(config.get('expired_reply', ''), str):
+        errors.append("expired_reply 必须是字符串")
+    return errors
+
+
+def scan_role_files(roles_dir):
+    """扫描角色文件的修改时间和大小，不读取文件内容
+
+    Returns:
+        dict: 文件名 -> (修改时间ns, 文件大小)
+    """
+    files = {}
+    with os.scandir(roles_dir) as it:
+        for entry in it:
+            if entry.name.endswith('.json') and not entry.name.startswith('.') and entry.is_file():
+                stat = entry.stat()
+                files[entry.name] = (stat.st_mtime_ns, stat.st_size)
+    return files
+
+
+class RoleBundle:
+    def __init__(self, roles_dir):
+        """角色包，使用RoleBundle.load加载"""
+        self.roles_dir = roles_dir
+        self.path = os.path.join(roles_dir, BUNDLE_FILENAME)
+        # 文件名 -> 条目：mtime_ns、size、sha256、config（不含system_prompt）、errors
+        self.entries = {}
+        # 本次加载中重新解析的文件
+        self.reparsed = []
+        self.changed = False
+
+    @classmethod
+    def load(cls, roles_dir, force=False):
+        """加载角色包，只重新解析修改时间和内容哈希都发生变化的文件，有变化时保存新的角色包
+
+        Args:
+            roles_dir: 角色配置目录
+            force: 为True时忽略已有角色包，重新解析全部文件
+        """
+        bundle = cls(roles_dir)
+        previous = {} if force else bundle._read_previous()
+        files = scan_role_files(roles_dir)
+
+        for filename in sorted(files):
+            mtime_ns, size = files[filename]
+            old = previous.get(filename)
+            if old and old['mtime_ns'] == mtime_ns and old['size'] == size:
+                bundle.entries[filename] = old
+                continue
+
+            file_path = os.path.join(roles_dir, filename)
+            try:
+                with open(file_path, 'rb') as f:
+                    raw = f.read()
+            except OSError as e:
+                bundle.entries[filename] = {'mtime_ns': mtime_ns, 'size': size, 'sha256': None,
+                                            'config': None, 'errors': [f"无法读取文件: {e}"]}
+                bundle.changed = True
+                continue
+
+            digest = hashlib.sha256(raw).hexdigest()
+            bundle.changed = True
+            if old and old['sha256'] == digest:
+                # 只是修改时间变化，内容未变，无需重新解析
+                bundle.entries[filename] = dict(old, mtime_ns=mtime_ns, size=size)
+                continue
+
+            bundle.reparsed.append(filename)
+            bundle.entries[filename] = bundle._compile_entry(raw, mtime_ns, size, digest)
+
+        if set(previous) - set(files):
+            bundle.changed = True
+        if bundle.changed or force:
+            bundle.save()
+        return bundle
+
+    def _read_previous(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get('version') != BUNDLE_FORMAT_VERSION:
+                return {}
+            return data.get('files', {})
+        except FileNotFoundError:
+            return {}
+        except Exception as e:
+            logger.warning(f"角色包 {self.path} 无法读取，将重新生成: {e}", extra={'save_to_file': True})
+            return {}
+
+    def _compile_entry(self, raw, mtime_ns, size, digest):
+        """解析并校验单个角色文件，系统提示词不保存在角色包中"""
+        try:
+            config = json.loads(raw.decode('utf-8'))
+        except ValueError as e:
+            return {'mtime_ns': mtime_ns, 'size': size, 'sha256': digest, 'config': None, 'errors': [f"JSON格式错误: {e}"]}
+
+        errors = validate_role_config(config)
+        if errors:
+            return {'mtime_ns': mtime_ns, 'size': size, 'sha256': digest, 'config': None, 'errors': errors}
+
+        compiled = {key: value for key, value in config.items() if key != 'system_prompt'}
+        return {'mtime_ns': mtime_ns, 'size': size, 'sha256': digest, 'config': compiled, 'errors': []}
+
+    def save(self):
+        """原子写入角色包文件；写入失败（如目录只读）不影响本次加载"""
+        data = {
+            'version': BUNDLE_FORMAT_VERSION,
+            'files': self.entries,
+            'trigger_index': self.trigger_index(),
+        }
+        tmp_path = self.path + ".tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logger.warning(f"保存角色包 {self.path} 失败: {e}", extra={'save_to_file': True})
+
+    def valid_files(self):
+        """有效的角色文件名（按文件名排序）"""
+        return [filename for filename in sorted(self.entries) if not self.entries[filename]['errors']]
+
+    def role_configs(self):
+        """有效角色的配置列表（不含system_prompt）"""
+        return [self.entries[filename]['config'] for filename in self.valid_files()]
+
+    def errors(self):
+        """无效的角色文件：文件名 -> 错误列表"""
+        return {filename: entry['errors'] for filename, entry in sorted(self.entries.items()) if entry['errors']}
+
+    def trigger_index(self):
+        """触发词（名称和别名） -> 文件名列表"""
+        index = {}
+        for filename in self.valid_files():
+            config = self.entries[filename]['config']
+            for trigger in [config['name']] + list(config['aliases']):
+                files = index.setdefault(trigger, [])
+                if filename not in files:
+                    files.append(filename)
+        return index
+
+    def collisions(self):
+        """被多个角色文件使用的触发词：触发词 -> 文件名列表"""
+        return {trigger: files for trigger, files in self.trigger_index().items() if len(files) > 1}
+
+    def load_system_prompt(self, filename):
+        """从源文件读取角色的系统提示词（首次使用时调用）"""
+        with open(os.path.join(self.roles_dir, filename), 'r', encoding='utf-8') as f:
+            return json.load(f)['system_prompt']
@@ -0,0 +1,416 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+对话历史统计与导出工具
+逐条流式读取各角色的对话历史（JSONL文件、旧版JSON数组文件或SQLite数据库），内存占用与历史大小无关，
+按角色和发送者统计对话轮数、回复长度分布、每日对话量和重复问题拦截率，并可按条件导出为CSV或JSONL。
+多个角色的历史可以用多个进程并行处理（--workers）。
+
+用法示例：
+    python roles/history.py stats
+    python roles/history.py stats --since 2024-05-01 --role @猫娘bot --workers 4
+    python roles/history.py export --format csv --output history.csv --since 2024-05-01 --until 2024-06-01
+    python roles/history.py export --format jsonl --sender 张三 --output -
+"""
+
+import os
+import re
+import csv
+import sys
+import json
+import glob
+import shutil
+import argparse
+import tempfile
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+if __package__ in (None, ''):
+    # 直接运行 python roles/history.py 时，将项目根目录加入搜索路径以便导入config和utils包
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import Config
+from utils.history_store import SqliteHistoryStore, iter_jsonl_file, iter_json_array_file, role_file_stem
+
+# 回复长度分布的分桶上限（字符数），最后一个桶为超过最大上限的回复
+REPLY_LENGTH_BUCKETS = (20, 50, 100, 200, 500, 1000, 2000)
+# 导出的字段（JSONL导出保留记录的全部字段）
+EXPORT_FIELDS = ('timestamp', 'role', 'sender', 'question', 'response')
+EXPORT_FORMATS = ('csv', 'jsonl')
+TIME_PATTERN = re.compile(r"^\d{4}-\d{2}-\d{2}( \d{2}(:\d{2}(:\d{2})?)?)?$")
+
+
+class RecordFilter:
+    def __init__(self, roles=None, senders=None, since=None, until=None):
+        """按角色、发送者和时间范围筛选记录
+
+        Args:
+            since, until: 时间字符串（%Y-%m-%d 或 %Y-%m-%d %H:%M:%S），范围为[since, until)
+        """
+        self.roles = set(roles or ())
+        # 角色名称和文件名都可以用来指定角色（文件名会去掉@等特殊字符）
+        self.role_stems = {role_file_stem(role) for role in self.roles}
+        self.senders = set(senders or ())
+        self.since = since
+        self.until = until
+
+    def accepts_source(self, source):
+        return not self.roles or source["key"] in self.role_stems
+
+    def matches(self, record):
+        if self.senders and record.get('sender') not in self.senders:
+            return False
+        timestamp = record.get('timestamp', '')
+        if self.since is not None and timestamp < self.since:
+            return False
+        if self.until is not None and timestamp >= self.until:
+            return False
+        return True
+
+
+class HistoryStats:
+    def __init__(self):
+        """一组对话记录的统计（可合并），只保存计数，不保存记录本身"""
+        self.records = 0
+        self.senders = Counter()
+        self.daily = Counter()
+        self.reply_buckets = [0] * (len(REPLY_LENGTH_BUCKETS) + 1)
+        self.reply_chars = 0
+        self.reply_max = 0
+        self.question_chars = 0
+        self.first = None
+        self.last = None
+        self.suppressed = 0
+        self.suppressed_senders = Counter()
+
+    def add(self, record):
+        self.records += 1
+        self.senders[record.get('sender', '')] += 1
+        timestamp = record.get('timestamp', '')
+        if timestamp:
+            self.daily[timestamp[:10]] += 1
+            if self.first is None or timestamp < self.first:
+                self.first = timestamp
+            if self.last is None or timestamp > self.last:
+                self.last = timestamp
+        length = len(record.get('response', ''))
+        self.reply_chars += length
+        self.reply_max = max(self.reply_max, length)
+        self.reply_buckets[bucket_index(length)] += 1
+        self.question_chars += len(record.get('question', ''))
+
+    def add_suppressed(self, event):
+        self.suppressed += 1
+        self.suppressed_senders[event.get('sender', '')] += 1
+
+    def merge(self, other):
+        self.records += other.records
+        self.senders.update(other.senders)
+        self.daily.update(other.daily)
+        self.reply_buckets = [a + b for a, b in zip(self.reply_buckets, other.reply_buckets)]
+        self.reply_chars += other.reply_chars
+        self.reply_max = max(self.reply_max, other.reply_max)
+        self.question_chars += other.question_chars
+        for timestamp in (other.first, other.last):
+            if timestamp:
+                self.first = timestamp if self.first is None or timestamp < self.first else self.first
+                self.last = timestamp if self.last is None or timestamp > self.last else self.last
+        self.suppressed += other.suppressed
+        self.suppressed_senders.update(other.suppressed_senders)
+        return self
+
+    @property
+    def suppression_rate(self):
+        """重复拦截率：被拦截的重复提问占全部提问（回复的和被拦截的）的比例"""
+        total = self.records + self.suppressed
+        return self.suppressed / total if total else 0.0
+
+    def reply_percentile(self, fraction):
+        """回复长度的近似分位数，返回所在分桶的上限（超过最大分桶或没有记录时返回None）"""
+        if not self.records:
+            return None
+        target = self.records * fraction
+        seen = 0
+        for i, count in enumerate(self.reply_buckets):
+            seen += count
+            if seen >= target:
+                return REPLY_LENGTH_BUCKETS[i] if i < len(REPLY_LENGTH_BUCKETS) else None
+        return None
+
+    def to_dict(self):
+        return {
+            "records": self.records,
+            "senders": dict(self.senders.most_common()),
+            "daily": dict(sorted(self.daily.items())),
+            "reply_length": {
+                "average": round(self.reply_chars / self.records, 1) if self.records else 0,
+                "max": self.reply_max,
+                "buckets": {bucket_label(i): count for i, count in enumerate(self.reply_buckets)},
+            },
+            "question_length_average": round(self.question_chars / self.records, 1) if self.records else 0,
+            "first": self.first,
+            "last": self.last,
+            "suppressed": self.suppressed,
+            "suppressed_senders": dict(self.suppressed_senders.most_common()),
+            "suppression_rate": round(self.suppression_rate, 4),
+        }
+
+
+def bucket_index(length):
+    for i, limit in enumerate(REPLY_LENGTH_BUCKETS):
+        if length <= limit:
+            return i
+    return len(REPLY_LENGTH_BUCKETS)
+
+
+def bucket_label(index):
+    if index < len(REPLY_LENGTH_BUCKETS):
+        return f"<={REPLY_LENGTH_BUCKETS[index]}"
+    return f">{REPLY_LENGTH_BUCKETS[-1]}"
+
+
+def discover_sources(history_dir, backend, db_filename):
+    """列出全部角色的历史来源：每个来源是一个角色的JSONL/JSON文件，或SQLite数据库中的一个角色
+
+    Returns:
+        list: [{"kind", "path", "role", "key"}]，key为角色文件名（不含扩展名），用于按角色合并和筛选
+    """
+    if backend == 'sqlite':
+        db_path = os.path.join(history_dir, db_filename)
+        if not os.path.exists(db_path):
+            return []
+        store = SqliteHistoryStore(history_dir, db_filename)
+        try:
+            roles = store.list_roles()
+        finally:
+            store.close()
+        return [{"kind": "sqlite", "path": db_path, "role": role, "key": role_file_stem(role)} for role in roles]
+
+    sources = []
+    for path in sorted(glob.glob(os.path.join(history_dir, "*_history.jsonl"))):
+        sources.append({"kind": "jsonl", "path": path, "role": None, "key": os.path.basename(path)[:-len(".jsonl")]})
+    keys = {source["key"] for source in sources}
+    # 尚未迁移为JSONL的旧版JSON文件
+    for path in sorted(glob.glob(os.path.join(history_dir, "*_history.json"))):
+        key = os.path.basename(path)[:-len(".json")]
+        if key not in keys:
+            sources.append({"kind": "json", "path": path, "role": None, "key": key})
+    return sources
+
+
+def iter_source(source):
+    """逐条遍历一个来源中的记录"""
+    if source["kind"] == "jsonl":
+        yield from iter_jsonl_file(source["path"])
+    elif source["kind"] == "json":
+        yield from iter_json_array_file(source["path"])
+    else:
+        store = SqliteHistoryStore(os.path.dirname(source["path"]), os.path.basename(source["path"]))
+        try:
+            yield from store.iter_records(source["role"])
+        finally:
+            store.close()
+
+
+def analyze_source(source, record_filter):
+    """统计一个来源（在工作进程中运行）
+
+    Returns:
+        tuple: (角色名称, 统计)；角色名称取自记录中的role字段，没有时使用文件名
+    """
+    stats = HistoryStats()
+    role = source["role"]
+    for record in iter_source(source):
+        if role is None:
+            role = record.get('role')
+        if record_filter.matches(record):
+            stats.add(record)
+    return role or source["key"], stats
+
+
+def export_source(source, record_filter, export_format, part_path):
+    """把一个来源中符合条件的记录写入分段文件（在工作进程中运行），返回写入的记录数"""
+    count = 0
+    with open(part_path, 'w', encoding='utf-8', newline='') as f:
+        writer = csv.writer(f) if export_format == 'csv' else None
+        for record in iter_source(source):
+            if not record_filter.matches(record):
+                continue
+            if writer is not None:
+                writer.writerow([record.get(field, '') for field in EXPORT_FIELDS])
+            else:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            count += 1
+    return count
+
+
+def run_tasks(func, tasks, workers):
+    """依次或用多个进程执行func(*task)，按tasks的顺序返回结果"""
+    if workers <= 1 or len(tasks) <= 1:
+        return [func(*task) for task in tasks]
+    with ProcessPoolExecutor(max_workers=min(workers, len(tasks))) as executor:
+        return list(executor.map(func, *zip(*tasks)))
+
+
+def count_suppressed(history_dir, record_filter, stats_by_key):
+    """读取重复拦截记录（SUPPRESSED_LOG_FILE），计入对应角色的统计"""
+    path = os.path.join(history_dir, Config.SUPPRESSED_LOG_FILE)
+    if not os.path.exists(path):
+        return 0
+    count = 0
+    for event in iter_jsonl_file(path):
+        key = role_file_stem(event.get('role', ''))
+        if (record_filter.roles and key not in record_filter.role_stems) or not record_filter.matches(event):
+            continue
+        if key not in stats_by_key:
+            stats_by_key[key] = (event.get('role') or key, HistoryStats())
+        stats_by_key[key][1].add_suppressed(event)
+        count += 1
+    return count
+
+
+def collect_stats(history_dir, backend, db_filename, record_filter, workers):
+    """统计全部角色
+
+    Returns:
+        tuple: ({角色文件名: (角色名称, 统计)}, 合计统计)
+    """
+    sources = [source for source in discover_sources(history_dir, backend, db_filename) if record_filter.accepts_source(source)]
+    results = run_tasks(analyze_source, [(source, record_filter) for source in sources], workers)
+    stats_by_key = {}
+    for source, (role, stats) in zip(sources, results):
+        stats_by_key[source["key"]] = (role, stats)
+    count_suppressed(history_dir, record_filter, stats_by_key)
+    total = HistoryStats()
+    for _, stats in stats_by_key.values():
+        total.merge(stats)
+    return stats_by_key, total
+
+
+def format_percent(value):
+    return f"{value * 100:.1f}%"
+
+
+def format_reply_percentile(stats, fraction):
+    if not stats.records:
+        return "-"
+    value = stats.reply_percentile(fraction)
+    return f"≤{value}" if value is not None else bucket_label(len(REPLY_LENGTH_BUCKETS))
+
+
+def print_stats(stats_by_key, total, top, days):
+    print("\n=== 对话历史统计 ===")
+    print(f"{'角色':<16} {'对话轮数':>8} {'发送者':>6} {'回复平均长度':>10} {'回复p50':>7} {'回复p90':>7} "
+          f"{'重复拦截':>8} {'拦截率':>7}  {'最早':<19}  {'最近':<19}")
+    print("-" * 120)
+    rows = sorted(stats_by_key.values(), key=lambda item: -item[1].records)
+    for role, stats in rows + [("合计", total)]:
+        if role == "合计":
+            print("-" * 120)
+        average = stats.reply_chars / stats.records if stats.records else 0
+        print(f"{role:<16} {stats.records:>8} {len(stats.senders):>6} {average:>10.1f} "
+              f"{format_reply_percentile(stats, 0.5):>7} {format_reply_percentile(stats, 0.9):>7} "
+              f"{stats.suppressed:>8} {format_percent(stats.suppression_rate):>7}  "
+              f"{stats.first or '-':<19}  {stats.last or '-':<19}")
+
+    if total.senders:
+        print(f"\n--- 发送者（前{top}名）---")
+        for sender, count in total.senders.most_common(top):
+            suppressed = total.suppressed_senders.get(sender, 0)
+            print(f"{sender:<16} {count:>8}轮  {format_percent(count / total.records):>7}  重复拦截{suppressed}次")
+
+    if total.records:
+        print("\n--- 回复长度分布（字符）---")
+        largest = max(total.reply_buckets) or 1
+        for i, count in enumerate(total.reply_buckets):
+            bar = "█" * round(40 * count / largest)
+            print(f"{bucket_label(i):>7} {count:>8}  {format_percent(count / total.records):>7}  {bar}")
+        print(f"最长 {total.reply_max} 字符")
+
+    if total.daily:
+        dates = sorted(total.daily)
+        shown = dates[-days:] if days > 0 else dates
+        print(f"\n--- 每日对话量（{'最近' + str(len(shown)) + '天' if len(shown) < len(dates) else '全部'}，共{len(dates)}天有对话）---")
+        largest = max(total.daily[date] for date in shown) or 1
+        for date in shown:
+            count = total.daily[date]
+            print(f"{date} {count:>8}  {'█' * round(40 * count / largest)}")
+    print()
+
+
+def export_history(history_dir, backend, db_filename, record_filter, export_format, output, workers):
+    """导出符合条件的记录：每个来源由工作进程写入一个分段文件，再按角色顺序拼接到输出
+
+    Returns:
+        int: 导出的记录数
+    """
+    sources = [source for source in discover_sources(history_dir, backend, db_filename) if record_filter.accepts_source(source)]
+    with tempfile.TemporaryDirectory(prefix="history_export_") as part_dir:
+        parts = [os.path.join(part_dir, f"part{i}.{export_format}") for i in range(len(sources))]
+        counts = run_tasks(export_source, [(source, record_filter, export_format, part)
+                                           for source, part in zip(sources, parts)], workers)
+        if output == '-':
+            out = sys.stdout
+        else:
+            # CSV带BOM，便于Excel识别UTF-8编码
+            out = open(output, 'w', encoding='utf-8-sig' if export_format == 'csv' else 'utf-8', newline='')
+        try:
+            if export_format == 'csv':
+                csv.writer(out).writerow(EXPORT_FIELDS)
+            for part in parts:
+                with open(part, 'r', encoding='utf-8', newline='') as f:
+                    shutil.copyfileobj(f, out)
+        finally:
+            if out is not sys.stdout:
+                out.close()
+    return sum(counts)
+
+
+def time_argument(value):
+    if not TIME_PATTERN.match(value):
+        raise argparse.ArgumentTypeError(f"时间格式应为 YYYY-MM-DD 或 'YYYY-MM-DD HH:MM:SS'：{value}")
+    return value
+
+
+def main():
+    parser = argparse.ArgumentParser(description='对话历史统计与导出工具')
+    parser.add_argument('action', choices=['stats', 'export'],
+                        help='要执行的操作: stats (统计对话轮数、回复长度、每日对话量和重复拦截率), export (导出为CSV或JSONL)')
+    parser.add_argument('--dir', default=Config.CHAT_HISTORY_DIR, help='对话历史目录（默认CHAT_HISTORY_DIR）')
+    parser.add_argument('--backend', choices=['jsonl', 'sqlite'], default=Config.CHAT_HISTORY_BACKEND,
+                        help='历史存储后端（默认CHAT_HISTORY_BACKEND）')
+    parser.add_argument('--role', action='append', help='只处理指定角色，可重复')
+    parser.add_argument('--sender', action='append', help='只处理指定发送者，可重复')
+    parser.add_argument('--since', type=time_argument, help='起始时间（含）')
+    parser.add_argument('--until', type=time_argument, help='结束时间（不含）')
+    parser.add_argument('--workers', type=int, default=1, help='并行处理的进程数，每个进程处理一个角色（默认1）')
+    parser.add_argument('--json', action='store_true', help='stats: 以JSON格式输出')
+    parser.add_argument('--top', type=int, default=10, help='stats: 显示的发送者数（默认10）')
+    parser.add_argument('--days', type=int, default=14, help='stats: 显示最近多少天的每日对话量，0表示全部（默认14）')
+    parser.add_argument('--format', choices=EXPORT_FORMATS, default='csv', help='export: 导出格式（默认csv）')
+    parser.add_argument('--output', default='-', help='export: 输出文件，- 表示标准输出（默认）')
+
+    if len(sys.argv) == 1:
+        parser.print_help()
+        return
+
+    args = parser.parse_args()
+    record_filter = RecordFilter(args.role, args.sender, args.since, args.until)
+
+    if args.action == 'stats':
+        stats_by_key, total = collect_stats(args.dir, args.backend, Config.CHAT_HISTORY_DB_FILE, record_filter, args.workers)
+        if args.json:
+            result = {"roles": {role: stats.to_dict() for role, stats in stats_by_key.values()}, "total": total.to_dict()}
+            print(json.dumps(result, ensure_ascii=False, indent=2))
+        else:
+            print_stats(stats_by_key, total, args.top, args.days)
+    elif args.action == 'export':
+        count = export_history(args.dir, args.backend, Config.CHAT_HISTORY_DB_FILE, record_filter,
+                               args.format, args.output, args.workers)
+        if args.output != '-':
+            print(f"已导出{count}轮对话到{args.output}")
+
+
+if __name__ == "__main__":
+    main()
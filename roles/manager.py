@@ -11,30 +11,69 @@ import json
 import argparse
 import sys
 
+if __package__ in (None, ''):
+    # 直接运行 python roles/manager.py 时，将项目根目录加入搜索路径以便导入roles包
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from roles.bundle import RoleBundle
+
 def list_roles():
-    """列出所有可用角色"""
+    """列出所有可用角色（从角色包读取，只解析有变化的文件）"""
     roles_dir = os.path.dirname(os.path.abspath(__file__))
-    roles = []
+    bundle = RoleBundle.load(roles_dir)
     
     print("\n=== 可用角色列表 ===")
     print(f"{'角色名称':<20} {'别名':<30} {'配置文件':<20}")
     print("-" * 70)
     
-    for filename in os.listdir(roles_dir):
-        if filename.endswith('.json'):
-            try:
-                file_path = os.path.join(roles_dir, filename)
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    role_config = json.load(f)
-                    
-                    if 'name' in role_config and 'aliases' in role_config:
-                        print(f"{role_config['name']:<20} {', '.join(role_config['aliases']):<30} {filename:<20}")
-                        roles.append(role_config)
-            except Exception as e:
-                print(f"加载角色配置文件 {filename} 失败: {e}")
+    for filename in bundle.valid_files():
+        role_config = bundle.entries[filename]['config']
+        print(f"{role_config['name']:<20} {', '.join(role_config['aliases']):<30} {filename:<20}")
+    
+    for filename, errors in bundle.errors().items():
+        print(f"加载角色配置文件 {filename} 失败: {'；'.join(errors)}")
     
     print("-" * 70)
-    print(f"共找到 {len(roles)} 个角色配置\n")
+    print(f"共找到 {len(bundle.valid_files())} 个角色配置\n")
+
+def print_bundle_report(bundle):
+    """批量输出校验错误和触发词冲突
+
+    Returns:
+        int: 问题数量
+    """
+    errors = bundle.errors()
+    collisions = bundle.collisions()
+    
+    if errors:
+        print(f"\n校验错误（{len(errors)}个文件）:")
+        for filename, file_errors in errors.items():
+            for error in file_errors:
+                print(f"  {filename}: {error}")
+    
+    if collisions:
+        print(f"\n触发词冲突（{len(collisions)}个）:")
+        for trigger, files in sorted(collisions.items()):
+            print(f"  {trigger}: {', '.join(files)}")
+    
+    if not errors and not collisions:
+        print("\n未发现校验错误或触发词冲突")
+    return len(errors) + len(collisions)
+
+def build_bundle():
+    """重新解析全部角色文件并生成角色包"""
+    roles_dir = os.path.dirname(os.path.abspath(__file__))
+    bundle = RoleBundle.load(roles_dir, force=True)
+    print(f"\n已生成角色包 {bundle.path}")
+    print(f"解析 {len(bundle.entries)} 个角色文件，其中有效 {len(bundle.valid_files())} 个")
+    return print_bundle_report(bundle)
+
+def validate_roles():
+    """校验所有角色文件，报告校验错误和触发词冲突"""
+    roles_dir = os.path.dirname(os.path.abspath(__file__))
+    bundle = RoleBundle.load(roles_dir)
+    print(f"\n已校验 {len(bundle.entries)} 个角色文件（重新解析 {len(bundle.reparsed)} 个）")
+    return print_bundle_report(bundle)
 
 def add_role():
     """添加新角色"""
@@ -100,7 +139,8 @@ def add_role():
 def edit_role():
     """编辑现有角色"""
     roles_dir = os.path.dirname(os.path.abspath(__file__))
-    role_files = [f for f in os.listdir(roles_dir) if f.endswith('.json')]
+    bundle = RoleBundle.load(roles_dir)
+    role_files = sorted(bundle.entries)
     
     if not role_files:
         print("没有找到可编辑的角色配置")
@@ -110,12 +150,11 @@ def edit_role():
     print("可编辑的角色配置:")
     
     for i, filename in enumerate(role_files, 1):
-        try:
-            with open(os.path.join(roles_dir, filename), 'r', encoding='utf-8') as f:
-                role_config = json.load(f)
-                print(f"{i}. {role_config.get('name', '未知角色')} ({filename})")
-        except:
-            print(f"{i}. {filename} (无法读取)")
+        role_config = bundle.entries[filename]['config']
+        if role_config:
+            print(f"{i}. {role_config['name']} ({filename})")
+        else:
+            print(f"{i}. {filename} (无效配置)")
     
     try:
         choice = int(input("\n请选择要编辑的角色编号: "))
@@ -176,7 +215,8 @@ def edit_role():
 def delete_role():
     """删除角色"""
     roles_dir = os.path.dirname(os.path.abspath(__file__))
-    role_files = [f for f in os.listdir(roles_dir) if f.endswith('.json')]
+    bundle = RoleBundle.load(roles_dir)
+    role_files = sorted(bundle.entries)
     
     if not role_files:
         print("没有找到可删除的角色配置")
@@ -186,12 +226,11 @@ def delete_role():
     print("可删除的角色配置:")
     
     for i, filename in enumerate(role_files, 1):
-        try:
-            with open(os.path.join(roles_dir, filename), 'r', encoding='utf-8') as f:
-                role_config = json.load(f)
-                print(f"{i}. {role_config.get('name', '未知角色')} ({filename})")
-        except:
-            print(f"{i}. {filename} (无法读取)")
+        role_config = bundle.entries[filename]['config']
+        if role_config:
+            print(f"{i}. {role_config['name']} ({filename})")
+        else:
+            print(f"{i}. {filename} (无效配置)")
     
     try:
         choice = int(input("\n请选择要删除的角色编号 (0取消): "))
@@ -228,8 +267,9 @@ def delete_role():
 
 def main():
     parser = argparse.ArgumentParser(description='角色管理工具')
-    parser.add_argument('action', choices=['list', 'add', 'edit', 'delete'], 
-                        help='要执行的操作: list (列出所有角色), add (添加新角色), edit (编辑角色), delete (删除角色)')
+    parser.add_argument('action', choices=['list', 'add', 'edit', 'delete', 'build', 'validate'], 
+                        help='要执行的操作: list (列出所有角色), add (添加新角色), edit (编辑角色), delete (删除角色), '
+                             'build (重新生成角色包), validate (校验角色并报告触发词冲突)')
     
     if len(sys.argv) == 1:
         parser.print_help()
@@ -245,6 +285,10 @@ def main():
         edit_role()
     elif args.action == 'delete':
         delete_role()
+    elif args.action == 'build':
+        sys.exit(1 if build_bundle() else 0)
+    elif args.action == 'validate':
+        sys.exit(1 if validate_roles() else 0)
 
 if __name__ == "__main__":
     main()
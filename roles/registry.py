@@ -0,0 +1,205 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+角色注册表
+将角色配置编译为按名称和别名索引的查找表，并支持在不重启机器人的情况下热加载roles目录的修改。
+角色从预编译的角色包（roles/bundle.py）加载，系统提示词在首次使用时才读取。
+"""
+
+import os
+import re
+import threading
+import logging
+from functools import partial
+
+from roles.bundle import RoleBundle, scan_role_files
+
+logger = logging.getLogger(__name__)
+
+
+class Role:
+    __slots__ = ('name', 'aliases', 'config', '_system_prompt', '_prompt_loader')
+
+    def __init__(self, config, prompt_loader=None):
+        """已解析的角色对象
+
+        Args:
+            config: 角色配置（dict），来自角色包时不含system_prompt
+            prompt_loader: 无参函数，首次访问system_prompt时调用以读取系统提示词
+        """
+        self.name = config['name']
+        self.aliases = tuple(config['aliases'])
+        self.config = config
+        self._system_prompt = config.get('system_prompt')
+        self._prompt_loader = prompt_loader
+
+    @property
+    def system_prompt(self):
+        """系统提示词，首次访问时从角色文件读取并缓存；读取失败（文件被删除或改为无效JSON）时返回None，下次访问重试"""
+        if self._system_prompt is None and self._prompt_loader is not None:
+            try:
+                self._system_prompt = self._prompt_loader()
+            except Exception as e:
+                logger.error(f"读取角色{self.name}的系统提示词失败: {e}", extra={'save_to_file': True})
+                return None
+        return self._system_prompt or None
+
+    @property
+    def triggers(self):
+        """主触发词和全部别名"""
+        return (self.name,) + self.aliases
+
+    def __repr__(self):
+        return f"Role({self.name!r})"
+
+
+class RoleIndex:
+    def __init__(self, roles, version=0):
+        """编译后的角色索引（只读），热加载时整体替换
+
+        Args:
+            roles: Role对象列表
+            version: 索引版本号，每次重新加载递增
+        """
+        self.version = version
+        self.roles = list(roles)
+        self.role_configs = [role.config for role in self.roles]
+
+        # 触发词（名称和别名） -> 角色
+        self.by_trigger = {}
+        for role in self.roles:
+            for trigger in role.triggers:
+                existing = self.by_trigger.get(trigger)
+                if existing is not None and existing is not role:
+                    logger.warning(f"触发词 {trigger} 同时属于 {existing.name} 和 {role.name}，将使用 {existing.name}", extra={'save_to_file': True})
+                    continue
+                self.by_trigger[trigger] = role
+
+        # 所有触发词编译为一个正则，较长的触发词优先，避免被其前缀抢先匹配
+        triggers = sorted(self.by_trigger, key=len, reverse=True)
+        self.trigger_pattern = re.compile("|".join(re.escape(t) for t in triggers)) if triggers else None
+
+    def get(self, name):
+        """按名称或别名精确查找角色，O(1)"""
+        return self.by_trigger.get(name)
+
+    def find_trigger(self, text):
+        """查找文本中最先出现的触发词
+
+        Returns:
+            tuple: (触发词, 角色)，未找到时返回(None, None)
+        """
+        if self.trigger_pattern is None:
+            return None, None
+        match = self.trigger_pattern.search(text)
+        if match is None:
+            return None, None
+        trigger = match.group(0)
+        return trigger, self.by_trigger[trigger]
+
+    def resolve(self, text):
+        """解析角色：先精确查找，找不到时在文本中查找触发词"""
+        role = self.by_trigger.get(text)
+        if role is not None:
+            return role
+        return self.find_trigger(text)[1]
+
+
+class RoleRegistry:
+    def __init__(self, roles_dir=None):
+        """初始化角色注册表并加载全部角色
+
+        Args:
+            roles_dir: 角色配置目录，默认为roles包所在目录
+        """
+        self.roles_dir = roles_dir or os.path.dirname(os.path.abspath(__file__))
+        self.listeners = []
+        self.reload_lock = threading.Lock()
+        self.watch_thread = None
+        self.stop_event = threading.Event()
+        self.signature = self._scan_signature()
+        self.index = RoleIndex(self._load_roles())
+
+    # 以下方法每次只读取一次self.index，保证在热加载期间看到的是同一个完整索引
+
+    @property
+    def roles(self):
+        return self.index.roles
+
+    @property
+    def role_configs(self):
+        return self.index.role_configs
+
+    def get(self, name):
+        return self.index.get(name)
+
+    def resolve(self, text):
+        return self.index.resolve(text)
+
+    def find_trigger(self, text):
+        return self.index.find_trigger(text)
+
+    def add_listener(self, callback):
+        """注册热加载回调，参数为新的RoleIndex"""
+        self.listeners.append(callback)
+
+    def _scan_signature(self):
+        """用文件名、修改时间和大小作为角色目录的指纹，不读取文件内容"""
+        return tuple(sorted((name,) + stat for name, stat in scan_role_files(self.roles_dir).items()))
+
+    def _load_roles(self):
+        """从角色包加载角色，只有变化的文件会被重新解析"""
+        bundle = RoleBundle.load(self.roles_dir)
+        for filename, errors in bundle.errors().items():
+            logger.warning(f"角色配置文件 {filename} 无效，已跳过: {'；'.join(errors)}", extra={'save_to_file': True})
+        logger.info(f"已从角色包加载{len(bundle.valid_files())}个角色（重新解析{len(bundle.reparsed)}个文件）", extra={'save_to_file': True})
+        return [Role(bundle.entries[filename]['config'], partial(bundle.load_system_prompt, filename))
+                for filename in bundle.valid_files()]
+
+    def reload(self):
+        """重新加载全部角色并原子替换索引"""
+        with self.reload_lock:
+            signature = self._scan_signature()
+            new_index = RoleIndex(self._load_roles(), self.index.version + 1)
+            self.index = new_index
+            self.signature = signature
+        logger.info(f"角色配置已重新加载，共{len(new_index.roles)}个角色（版本{new_index.version}）", extra={'save_to_file': True})
+        for callback in self.listeners:
+            try:
+                callback(new_index)
+            except Exception as e:
+                logger.error(f"角色热加载回调执行失败: {e}", extra={'save_to_file': True})
+        return new_index
+
+    def check_for_changes(self):
+        """检查roles目录是否有新增、修改或删除的角色文件，有则重新加载
+
+        Returns:
+            bool: 是否执行了重新加载
+        """
+        try:
+            if self._scan_signature() == self.signature:
+                return False
+            self.reload()
+            return True
+        except Exception as e:
+            # 加载失败时保留旧索引继续运行
+            logger.error(f"角色热加载失败，继续使用当前配置: {e}", extra={'save_to_file': True})
+            return False
+
+    def start_watching(self, interval):
+        """启动后台线程，按interval秒轮询roles目录的修改时间"""
+        if self.watch_thread is not None:
+            return
+
+        def watch():
+            while not self.stop_event.wait(interval):
+                self.check_for_changes()
+
+        self.watch_thread = threading.Thread(target=watch, name="RoleRegistryWatcher", daemon=True)
+        self.watch_thread.start()
+        logger.info(f"已启用角色热加载，每{interval}秒检查一次{self.roles_dir}", extra={'save_to_file': True})
+
+    def stop_watching(self):
+        self.stop_event.set()
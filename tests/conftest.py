@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+测试配置
+没有复制config_example为config时，以config_example作为config包导入（与 cp -r config_example config 效果相同），
+并在临时目录中运行，导入配置时创建的日志和对话历史目录不会写入仓库。
+"""
+
+import os
+import sys
+import tempfile
+import importlib
+import importlib.util
+from datetime import datetime, timedelta
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+os.environ.setdefault("DEEPSEEK_API_KEY", "test-key")
+os.chdir(tempfile.mkdtemp(prefix="wechatbot-tests-"))
+
+if importlib.util.find_spec("config") is None:
+    example_dir = os.path.join(ROOT, "config_example")
+    spec = importlib.util.spec_from_file_location(
+        "config", os.path.join(example_dir, "__init__.py"), submodule_search_locations=[example_dir])
+    config = importlib.util.module_from_spec(spec)
+    # settings.py通过config_example.logger导入日志模块，两个名称指向同一个模块，避免重复创建日志线程
+    sys.modules["config"] = sys.modules["config_example"] = config
+    sys.modules["config_example.logger"] = importlib.import_module("config.logger")
+    spec.loader.exec_module(config)
+
+
+from utils.history_store import create_history_store
+
+# 测试用的角色名称
+ROLE = "测试bot"
+HISTORY_START = datetime(2026, 1, 1)
+
+
+def make_records(questions, start=0, response=None):
+    """按问题生成对话记录，发送者在用户0-2之间轮换，第i条记录的时间为2026-01-01 00:00:00之后start+i秒"""
+    return [{'sender': f"用户{(start + i) % 3}", 'question': question,
+             'response': f"关于{question}的回复" if response is None else response,
+             'timestamp': (HISTORY_START + timedelta(seconds=start + i)).strftime('%Y-%m-%d %H:%M:%S'),
+             'role': ROLE} for i, question in enumerate(questions)]
+
+
+def numbered(count):
+    """问题0、问题1……"""
+    return [f"问题{i}" for i in range(count)]
+
+
+def line(text, y):
+    """纵坐标为y的一行OCR识别结果(文本, 置信度, 位置)"""
+    return (text, 0.99, [[10, y], [200, y], [200, y + 20], [10, y + 20]])
+
+
+@pytest.fixture(params=['jsonl', 'sqlite'])
+def store(request, tmp_path):
+    """两种历史存储后端各运行一次"""
+    store = create_history_store(request.param, str(tmp_path))
+    yield store
+    store.close()
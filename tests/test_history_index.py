@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""对话历史检索索引（utils/history_index.py）的测试"""
+
+import os
+import time
+import pytest
+from config import Config
+from utils.history_store import create_history_store
+from utils.history_index import HistoryIndex, RoleIndex, tokenize, record_key
+from .conftest import ROLE, make_records
+
+
+def wait_loaded(index, role=ROLE, timeout=5):
+    deadline = time.monotonic() + timeout
+    index.request_load(role)
+    while not index.is_loaded(role):
+        assert time.monotonic() < deadline, "索引没有在后台加载完成"
+        time.sleep(0.01)
+    return index.indexes[role]
+
+
+@pytest.fixture(autouse=True)
+def retrieval_config(monkeypatch):
+    # 测试用的历史很短，分数不会达到默认的分数下限
+    monkeypatch.setattr(Config, "HISTORY_RETRIEVAL_MIN_SCORE", 0.0)
+    monkeypatch.setattr(Config, "HISTORY_INDEX_NGRAM_SIZES", (1, 2))
+
+
+@pytest.fixture
+def index_dir(tmp_path):
+    return os.path.join(str(tmp_path), "index")
+
+
+def test_tokenize_splits_cjk_into_ngrams_and_keeps_words():
+    assert tokenize("天气Hello 42", (1, 2)) == ["天", "气", "天气", "hello", "42"]
+
+
+def test_search_returns_none_until_loaded_then_finds_old_turns(store, index_dir):
+    store.append_many(ROLE, make_records(["今天天气怎么样", "推荐一本小说", "火锅怎么做"]))
+    index = HistoryIndex(store, index_dir)
+    try:
+        assert index.search(ROLE, "小说", 3) is None
+        wait_loaded(index)
+        assert [record['question'] for record in index.search(ROLE, "有什么好看的小说", 3)] == ["推荐一本小说"]
+        # 最近几轮不参与检索
+        assert index.search(ROLE, "火锅", 3, exclude_recent=1) == []
+    finally:
+        index.close()
+
+
+def test_add_skips_positions_already_indexed(store, index_dir):
+    positions = store.append_many(ROLE, make_records(["第一个问题", "第二个问题"]))
+    index = HistoryIndex(store, index_dir)
+    try:
+        role_index = wait_loaded(index)
+        # 加载时已从存储补充过的记录，写入线程的回调再次加入时被忽略
+        index.add(ROLE, make_records(["第二个问题"], start=1), positions[1:])
+        assert len(role_index) == 2
+        new_records = make_records(["第三个问题"], start=2)
+        index.add(ROLE, new_records, store.append_many(ROLE, new_records))
+        assert len(role_index) == 3
+    finally:
+        index.close()
+
+
+def test_load_catches_up_records_written_after_save(store, index_dir):
+    store.append_many(ROLE, make_records(["问题甲", "问题乙"]))
+    index = HistoryIndex(store, index_dir)
+    wait_loaded(index)
+    index.close()
+    assert os.path.exists(index.get_index_path(ROLE))
+
+    store.append_many(ROLE, make_records(["问题丙", "问题丁", "问题戊"], start=2))
+    reloaded = HistoryIndex(store, index_dir)
+    try:
+        role_index = reloaded._load(ROLE)
+        assert len(role_index) == 5
+        assert reloaded.stats["loaded"] == 1
+        assert reloaded.stats["caught_up"] == 3
+        assert reloaded.stats["rebuilt"] == 0
+    finally:
+        reloaded.close()
+
+
+def test_records_after(store, index_dir):
+    records = make_records(["一", "二", "三", "四"])
+    positions = store.append_many(ROLE, records)
+    index = HistoryIndex(store, index_dir)
+    try:
+        missing = index._records_after(ROLE, positions[1], record_key(records[1]))
+        assert missing == list(zip(positions[2:], records[2:]))
+        assert index._records_after(ROLE, positions[3], record_key(records[3])) == []
+        # 该位置的记录与索引中保存的不同（历史被改写）
+        assert index._records_after(ROLE, positions[1], record_key(dict(records[1], question="别的问题"))) is None
+        # 空索引而存储中已有记录
+        assert index._records_after(ROLE, None, None) is None
+        assert index._records_after("没有历史的角色", None, None) == []
+    finally:
+        index.close()
+
+
+def test_load_rebuilds_when_history_was_rewritten(tmp_path, index_dir):
+    store = create_history_store('jsonl', str(tmp_path))
+    store.append_many(ROLE, make_records(["旧问题一", "旧问题二"]))
+    index = HistoryIndex(store, index_dir)
+    wait_loaded(index)
+    index.close()
+
+    store.rewrite(ROLE, make_records(["新问题一", "新问题二", "新问题三"], start=10))
+    reloaded = HistoryIndex(store, index_dir)
+    try:
+        role_index = wait_loaded(reloaded)
+        assert len(role_index) == 3
+        assert reloaded.stats["rebuilt"] == 1
+        assert [record['question'] for record in reloaded.search(ROLE, "新问题三", 1)] == ["新问题三"]
+    finally:
+        reloaded.close()
+
+
+def test_saved_state_round_trips_and_ignores_docs_added_after_snapshot():
+    role_index = RoleIndex()
+    records = make_records(["苹果", "香蕉", "苹果派"])
+    for i, record in enumerate(records):
+        role_index.add(i * 100, record)
+    snapshot = role_index.snapshot()
+    role_index.add(300, make_records(["苹果汁"], start=3)[0])
+
+    restored = RoleIndex.from_state(role_index.dump_state(snapshot))
+    assert list(restored.positions) == [0, 100, 200]
+    assert restored.last_key == record_key(records[2])
+    assert max(restored.postings["苹"][::2]) == 2
+    assert restored.total_length == sum(restored.lengths)
@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""对话历史存储（utils/history_store.py）的测试"""
+
+import os
+import json
+from utils import history_store
+from utils.history_store import JsonlHistoryStore, SqliteHistoryStore
+from .conftest import ROLE, make_records, numbered
+
+
+def test_tail_across_block_boundaries(tmp_path, monkeypatch):
+    # 每条记录都比读取块长，记录会被块边界截断
+    monkeypatch.setattr(history_store, "TAIL_BLOCK_SIZE", 64)
+    store = JsonlHistoryStore(str(tmp_path))
+    records = make_records(numbered(30), response="回" * 40)
+    store.append_many(ROLE, records)
+
+    assert list(store.iter_reverse(ROLE)) == records[::-1]
+    assert store.tail(ROLE, 7) == records[-7:]
+    assert store.tail(ROLE, 100) == records
+    assert store.tail(ROLE, 0) == []
+
+
+def test_tail_skips_partial_last_line(tmp_path, monkeypatch):
+    monkeypatch.setattr(history_store, "TAIL_BLOCK_SIZE", 64)
+    store = JsonlHistoryStore(str(tmp_path))
+    records = make_records(numbered(5))
+    store.append_many(ROLE, records)
+    # 写了一半就崩溃留下的行
+    with open(store.get_history_file_path(ROLE), 'a', encoding='utf-8') as f:
+        f.write('{"sender": "用户", "question": "写了一')
+
+    assert store.tail(ROLE, 3) == records[-3:]
+    assert [record for _, record in store.iter_positioned(ROLE)] == records
+
+
+def test_recent_filters_by_sender_and_time(store):
+    records = make_records(numbered(12))
+    store.append_many(ROLE, records)
+
+    assert store.recent(ROLE, 2, sender="用户1") == [records[7], records[10]]
+    assert store.recent(ROLE, 100, since="2026-01-01 00:00:09") == records[9:]
+
+
+def test_positions_round_trip(store):
+    records = make_records(numbered(6))
+    positions = store.append_many(ROLE, records)
+    assert positions == sorted(positions)
+    assert store.append(ROLE, records[0]) > positions[-1]
+
+    assert store.read_at(ROLE, [positions[4], positions[1]]) == [records[4], records[1]]
+    assert [record for _, record in store.iter_positioned(ROLE, after=positions[3])] == records[4:] + records[:1]
+    assert [position for position, _ in store.iter_positioned(ROLE)][:6] == positions
+
+
+def test_jsonl_read_at_rejects_offset_inside_a_record(tmp_path):
+    store = JsonlHistoryStore(str(tmp_path))
+    positions = store.append_many(ROLE, make_records(numbered(3)))
+    assert store.read_at(ROLE, [positions[1] + 5]) == [None]
+
+
+def test_jsonl_migrates_legacy_json_array(tmp_path):
+    store = JsonlHistoryStore(str(tmp_path))
+    records = make_records(numbered(4))
+    legacy_path = store.get_legacy_file_path(ROLE)
+    with open(legacy_path, 'w', encoding='utf-8') as f:
+        json.dump(records, f, ensure_ascii=False, indent=4)
+
+    assert store.migrate_legacy(ROLE) == 4
+    assert not os.path.exists(legacy_path)
+    assert os.path.exists(legacy_path + ".bak")
+    assert list(store.iter_records(ROLE)) == records
+    with open(legacy_path + ".bak", encoding='utf-8') as f:
+        assert json.load(f) == records
+
+    # 已迁移过（JSONL文件已存在）时不再迁移
+    assert store.migrate_legacy(ROLE) == 0
+
+
+def test_jsonl_keeps_existing_jsonl_over_legacy_file(tmp_path):
+    store = JsonlHistoryStore(str(tmp_path))
+    store.append(ROLE, make_records(numbered(1))[0])
+    with open(store.get_legacy_file_path(ROLE), 'w', encoding='utf-8') as f:
+        json.dump(make_records(numbered(3)), f)
+
+    assert store.migrate_legacy(ROLE) == 0
+    assert os.path.exists(store.get_legacy_file_path(ROLE))
+    assert len(list(store.iter_records(ROLE))) == 1
+
+
+def test_sqlite_imports_legacy_files_once(tmp_path):
+    legacy = JsonlHistoryStore(str(tmp_path))
+    records = make_records(numbered(5))
+    with open(legacy.get_legacy_file_path(ROLE), 'w', encoding='utf-8') as f:
+        json.dump(records[:2], f, ensure_ascii=False)
+    legacy.append_many(ROLE, records[2:])
+
+    store = SqliteHistoryStore(str(tmp_path))
+    try:
+        assert store.migrate_legacy(ROLE) == 5
+        assert store.migrate_legacy(ROLE) == 0
+        assert store.tail(ROLE, 10) == records
+    finally:
+        store.close()
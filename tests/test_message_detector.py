@@ -0,0 +1,43 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""消息检测（core/message_detector.py）的测试"""
+
+import pytest
+from config import Config
+from core.message_detector import MessageDetector
+from utils.ocr_handler import OCRHandler
+from .conftest import line
+
+
+class FakeHistory:
+    """只提供检测需要的接口，所有问题都视为未回答过"""
+
+    def __init__(self):
+        self.current_role = None
+
+    def switch_role(self, role):
+        self.current_role = role
+
+    def is_question_already_answered(self, question, sender):
+        return False
+
+    def is_similar_question(self, question1, question2):
+        return question1 == question2
+
+
+@pytest.fixture
+def detector(monkeypatch):
+    monkeypatch.setattr(Config, "USER_NAMES", [{"name": "张三", "aliases": []}, {"name": "李四", "aliases": ["李4"]}])
+    monkeypatch.setattr(Config, "SUPPRESSED_LOG_ENABLED", False)
+    return MessageDetector(OCRHandler(engine=object()), FakeHistory())
+
+
+def test_each_mention_uses_the_sender_above_its_own_trigger(detector):
+    role = Config.ROLE_REGISTRY.index.roles[0].name
+    texts = [line("张三", 0), line(f"@{role} 第一个问题", 30), line("李4", 60), line(f"@{role} 第二个问题", 90)]
+
+    assert detector.detect_triggers(texts) == [
+        ("张三", "第一个问题", role),
+        ("李四", "第二个问题", role),
+    ]
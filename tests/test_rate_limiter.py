@@ -0,0 +1,47 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""回复限流（utils/rate_limiter.py）的测试"""
+
+import pytest
+from config import Config
+from utils.rate_limiter import TokenBucket, RateLimiter
+
+
+def test_bucket_starts_full_and_refills_per_minute():
+    bucket = TokenBucket(burst=3, per_minute=6, now=100.0)
+    assert bucket.refill(100.0) == 3
+    bucket.tokens = 0
+    # 每分钟6个，即每10秒1个
+    assert bucket.refill(105.0) == pytest.approx(0.5)
+    assert bucket.refill(115.0) == pytest.approx(1.5)
+
+
+def test_bucket_never_exceeds_burst():
+    bucket = TokenBucket(burst=2, per_minute=60, now=0.0)
+    bucket.tokens = 1
+    assert bucket.refill(3600.0) == 2
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    monkeypatch.setattr(Config, "RATE_LIMIT_NOTICE", False)
+    monkeypatch.setattr(Config, "RATE_LIMIT_MEMORY", 0)
+    return [1000.0]
+
+
+def test_limiter_throttles_each_sender_separately(clock):
+    limiter = RateLimiter(lambda a, b: a == b, clock=lambda: clock[0])
+    limiter.limits = {"sender": (2, 6), "role": (0, 0), "group": (0, 0)}
+
+    assert limiter.allow("张三", "诗人bot", "问题1")
+    clock[0] += 1
+    assert limiter.allow("张三", "诗人bot", "问题2")
+    clock[0] += 1
+    assert not limiter.allow("张三", "诗人bot", "问题3")
+    # 其他发送者有自己的令牌桶
+    assert limiter.allow("李四", "诗人bot", "问题4")
+    # 10秒补充一个令牌
+    clock[0] += 10
+    assert limiter.allow("张三", "诗人bot", "问题5")
+    assert limiter.stats["throttled_sender"] == 1
@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""发送队列（core/send_queue.py）的测试"""
+
+import pytest
+from config import Config
+from core.fake_sender import FakeMessageSender
+from core.send_queue import SendQueue
+from core.reply_scheduler import PendingReply
+
+
+@pytest.fixture
+def send_queue(monkeypatch):
+    # 足够长的合并窗口，保证连续提交的回复合并为一条消息
+    monkeypatch.setattr(Config, "SEND_COALESCE_WINDOW", 0.5)
+    monkeypatch.setattr(Config, "SEND_COALESCE_MAX_REPLIES", 2)
+    sender = FakeMessageSender()
+    queue = SendQueue(sender)
+    yield queue, sender
+    queue.close()
+
+
+def send_together(queue, replies):
+    futures = [queue.submit(sender, text) for sender, text in replies]
+    for future in futures:
+        future.result(timeout=5)
+
+
+def test_merged_replies_mention_each_sender(send_queue):
+    queue, sender = send_queue
+    send_together(queue, [("张三", "回复一"), ("李四", "回复二")])
+    assert sender.messages == ["@张三 回复一\n\n@李四 回复二"]
+
+
+def test_merged_notices_are_not_mentioned_twice(send_queue):
+    queue, sender = send_queue
+    template = Config.RATE_LIMIT_NOTICE_MESSAGES["sender"]
+    send_together(queue, [(name, template.format(sender=name, role="诗人bot")) for name in ("张三", "李四")])
+
+    message, = sender.messages
+    assert message.count("@张三") == 1 and message.count("@李四") == 1
+    assert message == f"{template.format(sender='张三', role='诗人bot')}\n\n{template.format(sender='李四', role='诗人bot')}"
+
+
+def test_merged_expired_replies_are_not_mentioned_twice(send_queue):
+    queue, sender = send_queue
+    role = Config.ROLE_REGISTRY.index.roles[0].name
+    items = [PendingReply(name, "很久之前的问题", role, [], 0.0) for name in ("张三", "李四")]
+    send_together(queue, [(item.sender, item.short_reply) for item in items])
+
+    message, = sender.messages
+    assert message == f"{items[0].short_reply}\n\n{items[1].short_reply}"
+    assert message.count("@张三") == 1 and message.count("@李四") == 1
@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""OCR文本差异（utils/text_diff.py）的测试"""
+
+from utils.text_diff import TextDiffer
+from .conftest import line
+
+
+def frame(texts, top=0):
+    return [line(text, top + i * 30) for i, text in enumerate(texts)]
+
+
+def texts_of(lines):
+    return [text for text, _, _ in lines]
+
+
+def test_first_frame_and_reset_return_all_lines():
+    differ = TextDiffer(context_before=1, context_after=1)
+    first = frame(["群名", "张三", "你好"])
+    assert differ.new_lines(first) == first
+    assert differ.new_lines(first) == []
+    differ.reset()
+    assert differ.new_lines(first) == first
+
+
+def test_first_frame_is_sorted_like_later_frames():
+    # OCR结果不一定按从上到下的顺序，推断发送者依赖返回结果中触发词的上一行
+    differ = TextDiffer()
+    shuffled = [line("@诗人bot 写首诗", 60), line("张三", 30), line("群名", 0)]
+    assert texts_of(differ.new_lines(shuffled)) == ["群名", "张三", "@诗人bot 写首诗"]
+
+
+def test_inserted_lines_with_context():
+    differ = TextDiffer(context_before=1, context_after=0)
+    differ.new_lines(frame(["群名", "张三", "早上好", "李四", "在吗"]))
+    # 新消息把旧消息向上推：只返回新增的两行和它上面的一行
+    current = frame(["张三", "早上好", "李四", "在吗", "王五", "@诗人bot 写首诗"], top=-30)
+    assert texts_of(differ.new_lines(current)) == ["在吗", "王五", "@诗人bot 写首诗"]
+
+
+def test_replaced_line_is_selected_and_whitespace_changes_are_ignored():
+    differ = TextDiffer(context_before=0, context_after=0)
+    differ.new_lines(frame(["张三", "今天 天气 不错", "李四", "@诗人bot"]))
+    current = frame(["张三", "今天天气不错", "李四", "@诗人bot 写首诗"])
+    assert texts_of(differ.new_lines(current)) == ["@诗人bot 写首诗"]
+
+
+def test_lines_are_compared_in_screen_order():
+    differ = TextDiffer(context_before=0, context_after=0)
+    differ.new_lines(frame(["甲", "乙"]))
+    # OCR结果的顺序与屏幕上的纵向顺序不同
+    current = list(reversed(frame(["甲", "乙", "丙"])))
+    assert texts_of(differ.new_lines(current)) == ["丙"]
@@ -3,75 +3,399 @@
 
 """
 API客户端模块
-处理与DeepSeek API的交互
+处理与DeepSeek API（及其他OpenAI兼容接口）的交互
 """
 
 import json
+import time
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 import requests
+from requests.adapters import HTTPAdapter
 from config import logger, Config
 
+# 需要重试的HTTP状态码：限流和服务端错误
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+class RequestCancelled(Exception):
+    """请求已被取消（对冲请求中的落败方或超过回复截止时间）"""
+
+
+class AttemptHandle:
+    def __init__(self):
+        """一次请求（含重试）的取消句柄：记录正在读取的响应，取消时直接关闭连接，
+        而不是等工作线程读完下一块数据后才发现已被取消"""
+        self.cancel_event = threading.Event()
+        self.response = None
+        self.lock = threading.Lock()
+
+    def is_cancelled(self):
+        return self.cancel_event.is_set()
+
+    def wait(self, timeout):
+        """等待重试间隔，期间被取消时返回True"""
+        return self.cancel_event.wait(timeout)
+
+    def attach(self, response):
+        """登记当前响应；已被取消时立即关闭并抛出RequestCancelled"""
+        with self.lock:
+            self.response = response
+            cancelled = self.cancel_event.is_set()
+        if cancelled:
+            response.close()
+            raise RequestCancelled()
+
+    def detach(self):
+        with self.lock:
+            self.response = None
+
+    def cancel(self):
+        """取消请求并关闭正在读取的响应，使阻塞在读取中的工作线程立即返回"""
+        with self.lock:
+            self.cancel_event.set()
+            response = self.response
+        if response is not None:
+            try:
+                response.close()
+            except Exception:
+                pass
+
+
+class Endpoint:
+    def __init__(self, name, url, model, api_key, sample_size=200):
+        """OpenAI兼容接口端点，记录延迟和健康状态"""
+        self.name = name
+        self.url = url
+        self.model = model
+        self.api_key = api_key
+        # 延迟的指数加权移动平均（秒），None表示尚无样本
+        self.ewma = None
+        self.samples = deque(maxlen=sample_size)
+        self.consecutive_failures = 0
+        self.unhealthy_until = 0.0
+        self.lock = threading.Lock()
+
+    def record_success(self, latency):
+        """记录一次成功请求的延迟"""
+        with self.lock:
+            alpha = Config.API_LATENCY_EWMA_ALPHA
+            self.ewma = latency if self.ewma is None else alpha * latency + (1 - alpha) * self.ewma
+            self.samples.append(latency)
+            self.consecutive_failures = 0
+            self.unhealthy_until = 0.0
+
+    def record_failure(self):
+        """记录一次失败，连续失败达到阈值后进入冷却"""
+        with self.lock:
+            self.consecutive_failures += 1
+            if self.consecutive_failures >= Config.API_ENDPOINT_FAILURE_THRESHOLD:
+                self.unhealthy_until = time.monotonic() + Config.API_ENDPOINT_COOLDOWN
+                logger.warning(f"API端点 {self.name} 连续失败{self.consecutive_failures}次，暂停使用{Config.API_ENDPOINT_COOLDOWN}秒", extra={'save_to_file': True})
+
+    def is_healthy(self):
+        return time.monotonic() >= self.unhealthy_until
+
+    def hedge_delay(self):
+        """发送对冲请求前的等待时间：历史延迟的指定分位数"""
+        with self.lock:
+            if len(self.samples) < 10:
+                return Config.API_HEDGE_DEFAULT_DELAY
+            ordered = sorted(self.samples)
+        index = min(len(ordered) - 1, int(len(ordered) * Config.API_HEDGE_PERCENTILE / 100.0))
+        return ordered[index]
+
+
 class APIClient:
     def __init__(self):
         """初始化API客户端"""
         self.api_key = Config.DEEPSEEK_API_KEY
         self.api_url = Config.DEEPSEEK_API_URL
-        
+        self.timeout = (Config.API_CONNECT_TIMEOUT, Config.API_READ_TIMEOUT)
+        self.max_retries = Config.API_MAX_RETRIES
+        self.retry_backoff = Config.API_RETRY_BACKOFF
+        self.stream = Config.API_STREAM
+
+        # 端点列表，未配置时只使用DEEPSEEK_API_URL
+        endpoint_configs = Config.API_ENDPOINTS or [{"name": "deepseek", "url": self.api_url, "model": "deepseek-chat"}]
+        self.endpoints = [
+            Endpoint(
+                cfg.get("name", cfg["url"]),
+                cfg["url"],
+                cfg.get("model", "deepseek-chat"),
+                cfg.get("api_key") or self.api_key
+            )
+            for cfg in endpoint_configs
+        ]
+
+        # 使用Session复用连接，避免每次请求重新建立TCP/TLS连接
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=Config.API_POOL_SIZE, pool_maxsize=Config.API_POOL_SIZE)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        # 请求在线程池中执行，以便同时等待主请求和对冲请求
+        self.executor = ThreadPoolExecutor(max_workers=Config.API_MAX_CONCURRENCY, thread_name_prefix="APIRequest")
+
+        # 请求统计信息（压测工具会读取）
+        self.stats = {
+            "requests": 0, "retries": 0, "errors": 0,
+            "hedged": 0, "hedge_wins": 0, "failovers": 0, "deadline_fallbacks": 0
+        }
+        self._stats_lock = threading.Lock()
+
         # 检查API密钥
         if not self.api_key:
             logger.warning("未设置DeepSeek API密钥，请在Config类中设置DEEPSEEK_API_KEY", extra={'save_to_file': True})
-    
+
+    def _count(self, key, value=1):
+        """线程安全地累加统计计数"""
+        with self._stats_lock:
+            self.stats[key] += value
+
+    def _rank_endpoints(self):
+        """按延迟EWMA从低到高排列端点，健康端点优先，无样本的端点保持配置顺序"""
+        def key(item):
+            index, endpoint = item
+            return (not endpoint.is_healthy(), endpoint.ewma is None, endpoint.ewma or 0.0, index)
+        return [endpoint for _, endpoint in sorted(enumerate(self.endpoints), key=key)]
+
+    def _retry_delay(self, attempt, response=None):
+        """计算第attempt次重试前的等待时间，优先使用服务端返回的Retry-After"""
+        if response is not None:
+            retry_after = response.headers.get("Retry-After")
+            if retry_after:
+                try:
+                    return max(0.0, float(retry_after))
+                except ValueError:
+                    pass
+        return self.retry_backoff * (2 ** attempt)
+
+    def _read_stream(self, response, handle):
+        """读取SSE流式响应，拼接所有增量内容"""
+        parts = []
+        for raw_line in response.iter_lines(decode_unicode=False):
+            if handle.is_cancelled():
+                raise RequestCancelled()
+            if not raw_line or not raw_line.startswith(b"data:"):
+                continue
+            payload = raw_line[5:].strip()
+            if payload == b"[DONE]":
+                break
+            chunk = json.loads(payload.decode("utf-8"))
+            delta = chunk["choices"][0].get("delta", {})
+            if delta.get("content"):
+                parts.append(delta["content"])
+        return "".join(parts)
+
+    def _read_body(self, response, handle):
+        """分块读取普通响应，以便在读取过程中响应取消"""
+        chunks = []
+        for chunk in response.iter_content(chunk_size=8192):
+            if handle.is_cancelled():
+                raise RequestCancelled()
+            chunks.append(chunk)
+        result = json.loads(b"".join(chunks).decode("utf-8"))
+        return result["choices"][0]["message"]["content"]
+
+    def _request_timeout(self, deadline):
+        """本次尝试的(连接, 读取)超时：读取超时不超过距回复截止时间的剩余时间，
+        等待响应头的工作线程不会在截止时间之后仍占用线程池"""
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise RequestCancelled()
+        return (min(self.timeout[0], remaining), min(self.timeout[1], remaining))
+
+    def _post_with_retry(self, endpoint, data, handle, deadline):
+        """向指定端点发送请求，对429、5xx和网络错误按指数退避重试
+
+        Returns:
+            tuple: (回复内容, 错误描述)，成功时错误描述为None
+        """
+        headers = {
+            "Content-Type": "application/json",
+            "Authorization": f"Bearer {endpoint.api_key}"
+        }
+        last_error = None
+        for attempt in range(self.max_retries + 1):
+            if handle.is_cancelled():
+                raise RequestCancelled()
+            if attempt > 0:
+                self._count("retries")
+            self._count("requests")
+
+            try:
+                # 始终以stream方式接收，使落败的对冲请求可以中途关闭连接
+                response = self.session.post(
+                    endpoint.url,
+                    headers=headers,
+                    data=json.dumps(data),
+                    timeout=self._request_timeout(deadline),
+                    stream=True
+                )
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if handle.is_cancelled():
+                    raise RequestCancelled()
+                last_error = f"网络错误: {e}"
+                logger.warning(f"API端点 {endpoint.name} 网络错误（第{attempt + 1}次尝试）: {e}", extra={'save_to_file': True})
+                if attempt < self.max_retries and handle.wait(self._retry_delay(attempt)):
+                    raise RequestCancelled()
+                continue
+
+            handle.attach(response)
+            try:
+                if response.status_code == 200:
+                    if self.stream:
+                        return self._read_stream(response, handle), None
+                    return self._read_body(response, handle), None
+
+                last_error = f"API请求失败: {response.status_code}"
+                logger.error(f"API端点 {endpoint.name} 请求失败: {response.status_code} - {response.text}", extra={'save_to_file': True})
+                if response.status_code not in RETRYABLE_STATUS_CODES:
+                    break
+                if attempt < self.max_retries:
+                    delay = self._retry_delay(attempt, response)
+                    logger.info(f"{delay:.1f}秒后重试API端点 {endpoint.name}", extra={'save_to_file': True})
+                    if handle.wait(delay):
+                        raise RequestCancelled()
+            finally:
+                handle.detach()
+                response.close()
+
+        return None, last_error
+
+    def _attempt(self, endpoint, messages, handle, deadline):
+        """在工作线程中对单个端点完成一次（含重试的）请求，并更新端点统计"""
+        data = {
+            "model": endpoint.model,
+            "messages": messages,
+            "temperature": 0.7,
+            "max_tokens": 800,
+            "stream": self.stream
+        }
+        start = time.perf_counter()
+        try:
+            answer, error = self._post_with_retry(endpoint, data, handle, deadline)
+        except RequestCancelled:
+            return None, "请求已取消"
+        except Exception as e:
+            if handle.is_cancelled():
+                # 取消时关闭了正在读取的连接，读取中断引发的异常不计为端点故障
+                return None, "请求已取消"
+            answer, error = None, f"生成回复时出错: {e}"
+
+        if error is None:
+            endpoint.record_success(time.perf_counter() - start)
+        else:
+            endpoint.record_failure()
+        return answer, error
+
+    def _request(self, messages):
+        """按延迟选择端点发送请求，超过对冲时间后向第二个端点发送对冲请求，
+        全部失败时依次故障转移，直到成功或超过回复截止时间
+
+        Returns:
+            tuple: (回复内容, 错误描述)，超过截止时间时两者均为None
+        """
+        deadline = time.monotonic() + Config.API_REPLY_DEADLINE
+        candidates = self._rank_endpoints()
+        attempts = {}  # future -> (端点, 取消句柄)
+        state = {"next": 0, "hedge_future": None}
+
+        def launch():
+            endpoint = candidates[state["next"]]
+            state["next"] += 1
+            handle = AttemptHandle()
+            future = self.executor.submit(self._attempt, endpoint, messages, handle, deadline)
+            attempts[future] = (endpoint, handle)
+            return future
+
+        launch()
+        hedge_delay = candidates[0].hedge_delay()
+        hedge_at = time.monotonic() + hedge_delay
+        can_hedge = Config.API_HEDGE_ENABLED and len(candidates) > 1
+        last_error = None
+
+        try:
+            while attempts:
+                now = time.monotonic()
+                if now >= deadline:
+                    break
+                timeout = deadline - now
+                if can_hedge:
+                    timeout = min(timeout, max(0.0, hedge_at - now))
+
+                done, _ = wait(list(attempts), timeout=timeout, return_when=FIRST_COMPLETED)
+                for future in done:
+                    endpoint, _ = attempts.pop(future)
+                    answer, error = future.result()
+                    if error is None:
+                        if future is state["hedge_future"]:
+                            self._count("hedge_wins")
+                            logger.info(f"对冲请求胜出，使用端点 {endpoint.name} 的回复", extra={'save_to_file': True})
+                        return answer, None
+                    last_error = error
+
+                if can_hedge and time.monotonic() >= hedge_at and attempts and state["next"] < len(candidates):
+                    # 首个请求超过对冲时间仍未返回，向下一个端点发送对冲请求
+                    can_hedge = False
+                    self._count("hedged")
+                    logger.info(f"API请求超过{hedge_delay:.1f}秒未返回，向端点 {candidates[state['next']].name} 发送对冲请求", extra={'save_to_file': True})
+                    state["hedge_future"] = launch()
+                elif not attempts and state["next"] < len(candidates):
+                    # 所有进行中的请求都失败了，故障转移到下一个端点
+                    can_hedge = False
+                    self._count("failovers")
+                    logger.warning(f"API请求失败（{last_error}），故障转移到端点 {candidates[state['next']].name}", extra={'save_to_file': True})
+                    launch()
+
+            if not attempts:
+                self._count("errors")
+                return None, last_error
+
+            self._count("deadline_fallbacks")
+            logger.warning(f"API请求超过回复截止时间{Config.API_REPLY_DEADLINE}秒，使用兜底回复", extra={'save_to_file': True})
+            return None, None
+        finally:
+            # 取消所有仍在进行的请求（对冲落败方或超时请求），并关闭其正在读取的连接
+            for _, handle in attempts.values():
+                handle.cancel()
+
     def generate_response(self, sender, question, chat_history, current_role):
         """调用DeepSeek API生成回复"""
         if not self.api_key:
             logger.error("未设置DeepSeek API密钥，无法生成回复", extra={'save_to_file': True})
             return "抱歉，我的API密钥未设置，无法回答您的问题。"
-        
+
         try:
-            headers = {
-                "Content-Type": "application/json",
-                "Authorization": f"Bearer {self.api_key}"
-            }
-            
             # 获取当前角色的系统提示词
             system_prompt = Config.get_role_system_prompt(current_role)
-            
+
             # 构建消息列表，包含系统提示和聊天历史
             messages = [
                 {"role": "system", "content": system_prompt}
             ]
-            
+
             # 添加聊天历史作为上下文
             for chat in chat_history:
                 messages.append({"role": "user", "content": f"{chat['sender']}: {chat['question']}"})
                 messages.append({"role": "assistant", "content": chat['response']})
-                
+
             # 添加当前问题
             messages.append({"role": "user", "content": f"{sender}: {question}"})
-                
-            data = {
-                "model": "deepseek-chat",
-                "messages": messages,
-                "temperature": 0.7,
-                "max_tokens": 800
-            }
-            
+
             logger.info(f"发送API请求，包含{len(chat_history)}轮历史对话", extra={'save_to_file': True})
-            
-            response = requests.post(
-                self.api_url,
-                headers=headers,
-                data=json.dumps(data)
-            )
-            
-            if response.status_code == 200:
-                result = response.json()
-                answer = result["choices"][0]["message"]["content"]
+
+            answer, error = self._request(messages)
+            if answer is not None:
                 logger.info(f"成功生成回复: {answer[:50]}...", extra={'save_to_file': True})
                 return answer
-            else:
-                logger.error(f"API请求失败: {response.status_code} - {response.text}", extra={'save_to_file': True})
-                return f"抱歉，API请求失败: {response.status_code}"
-        
+            if error is None:
+                return Config.API_FALLBACK_REPLY
+            return f"抱歉，{error}"
+
         except Exception as e:
+            self._count("errors")
             logger.error(f"生成回复时出错: {e}", extra={'save_to_file': True})
             return f"抱歉，生成回复时出错: {str(e)}"
@@ -0,0 +1,180 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+界面位置校准模块
+在微信窗口截图中用OpenCV模板匹配定位聊天输入框和发送按钮，结果按窗口尺寸和DPI缓存。
+只有窗口尺寸或DPI变化时才重新匹配，每次发送的额外开销只是一次字典查找；
+未配置模板或匹配失败时使用配置文件中的相对位置。
+"""
+
+import os
+import json
+import cv2
+from config import logger, Config
+
+
+def match_template(frame_gray, template_gray, scales):
+    """在多个缩放比例下进行模板匹配，返回最佳结果
+
+    Returns:
+        tuple: (匹配得分, 中心x, 中心y, 模板宽, 模板高)，没有可用的比例时返回None
+    """
+    best = None
+    frame_h, frame_w = frame_gray.shape[:2]
+    for scale in scales:
+        template = template_gray
+        if abs(scale - 1.0) > 1e-3:
+            template = cv2.resize(template_gray, None, fx=scale, fy=scale,
+                                  interpolation=cv2.INTER_AREA if scale < 1 else cv2.INTER_LINEAR)
+        t_h, t_w = template.shape[:2]
+        if t_h < 4 or t_w < 4 or t_h > frame_h or t_w > frame_w:
+            continue
+        result = cv2.matchTemplate(frame_gray, template, cv2.TM_CCOEFF_NORMED)
+        _, score, _, (x, y) = cv2.minMaxLoc(result)
+        if best is None or score > best[0]:
+            best = (score, x + t_w / 2, y + t_h / 2, t_w, t_h)
+    return best
+
+
+class Calibrator:
+    def __init__(self, cache_file=None):
+        """初始化校准器
+
+        Args:
+            cache_file: 校准结果缓存文件，默认为Config.CALIBRATION_CACHE_FILE
+        """
+        self.enabled = Config.CALIBRATION_ENABLED
+        self.targets = Config.CALIBRATION_TARGETS
+        self.cache_file = cache_file or Config.CALIBRATION_CACHE_FILE
+        # 窗口几何（尺寸和DPI） -> {目标: [相对x, 相对y, 得分]}
+        self.cache = self._load_cache()
+        # 本次运行中匹配失败的窗口几何，不再重复匹配
+        self.failed = set()
+        self.templates = None
+        self.stats = {"hits": 0, "calibrations": 0, "failures": 0}
+
+    @staticmethod
+    def geometry_key(width, height, dpi):
+        return f"{width}x{height}@{dpi}"
+
+    def fallback_point(self, target):
+        """配置文件中手动设置的相对位置"""
+        if target == 'send_button':
+            return Config.SEND_BUTTON_RELATIVE_X, Config.SEND_BUTTON_RELATIVE_Y
+        return Config.CHAT_INPUT_BOX_RELATIVE_X, Config.CHAT_INPUT_BOX_RELATIVE_Y
+
+    def get_relative_point(self, target, width, height, dpi, capture):
+        """获取目标（'input_box'或'send_button'）在窗口中的相对位置
+
+        Args:
+            width, height: 窗口尺寸
+            dpi: 窗口DPI
+            capture: 无参函数，返回当前窗口截图（BGR），仅在需要重新匹配时调用
+
+        Returns:
+            tuple: (相对x, 相对y)
+        """
+        if not self.enabled:
+            return self.fallback_point(target)
+
+        key = self.geometry_key(width, height, dpi)
+        points = self.cache.get(key)
+        if points is not None and target in points:
+            self.stats["hits"] += 1
+            return tuple(points[target][:2])
+        if key in self.failed:
+            return self.fallback_point(target)
+
+        # 窗口尺寸或DPI发生变化（或首次使用），重新匹配
+        frame = capture()
+        points = self.calibrate(frame, dpi) if frame is not None else {}
+        if target not in points:
+            self.failed.add(key)
+            self.stats["failures"] += 1
+            logger.warning(f"未能在窗口（{key}）中定位{target}，使用配置文件中的相对位置", extra={'save_to_file': True})
+            return self.fallback_point(target)
+
+        self.cache[key] = points
+        self._save_cache()
+        return tuple(points[target][:2])
+
+    def calibrate(self, frame, dpi):
+        """在截图中匹配所有目标
+
+        Returns:
+            dict: 目标 -> [相对x, 相对y, 得分]，只包含匹配得分达到阈值的目标
+        """
+        self.stats["calibrations"] += 1
+        templates = self._load_templates()
+        if not templates:
+            return {}
+
+        frame_gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+        height, width = frame_gray.shape[:2]
+        # 模板按CALIBRATION_TEMPLATE_DPI截取，按当前DPI换算基准缩放比例，并在附近尝试几个比例
+        base = dpi / Config.CALIBRATION_TEMPLATE_DPI if dpi else 1.0
+        scales = [base * factor for factor in Config.CALIBRATION_SCALE_FACTORS]
+
+        points = {}
+        for target, template in templates.items():
+            match = match_template(frame_gray, template, scales)
+            if match is None or match[0] < Config.CALIBRATION_MATCH_THRESHOLD:
+                score = f"{match[0]:.2f}" if match else "无"
+                logger.info(f"校准{target}失败，最佳匹配得分{score}", extra={'save_to_file': True})
+                continue
+            score, center_x, center_y, t_w, t_h = match
+            # 点击位置 = 匹配中心 + 以模板尺寸为单位的偏移（如输入框位于工具栏下方）
+            offset_x, offset_y = self.targets[target].get("offset", (0, 0))
+            x = min(max(center_x + offset_x * t_w, 0), width - 1)
+            y = min(max(center_y + offset_y * t_h, 0), height - 1)
+            points[target] = [round(x / width, 4), round(y / height, 4), round(float(score), 3)]
+            logger.info(f"校准{target}成功: 相对位置({points[target][0]}, {points[target][1]})，得分{score:.2f}",
+                        extra={'save_to_file': True})
+        return points
+
+    def forget(self, width, height, dpi):
+        """清除某个窗口几何的校准结果（例如点击后粘贴失败），下次使用时重新匹配"""
+        key = self.geometry_key(width, height, dpi)
+        self.failed.discard(key)
+        if self.cache.pop(key, None) is not None:
+            self._save_cache()
+
+    def _load_templates(self):
+        """加载模板图片（灰度），只加载一次；缺少的模板会被跳过"""
+        if self.templates is not None:
+            return self.templates
+        self.templates = {}
+        for target, spec in self.targets.items():
+            path = spec.get("template")
+            if not path or not os.path.exists(path):
+                logger.warning(f"未找到{target}的校准模板 {path}，该目标将使用配置文件中的相对位置", extra={'save_to_file': True})
+                continue
+            template = cv2.imread(path, cv2.IMREAD_GRAYSCALE)
+            if template is None:
+                logger.warning(f"无法读取校准模板 {path}", extra={'save_to_file': True})
+                continue
+            self.templates[target] = template
+        return self.templates
+
+    def _load_cache(self):
+        try:
+            with open(self.cache_file, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except Exception as e:
+            logger.warning(f"读取校准缓存 {self.cache_file} 失败，将重新校准: {e}", extra={'save_to_file': True})
+            return {}
+
+    def _save_cache(self):
+        try:
+            directory = os.path.dirname(self.cache_file)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            tmp_path = self.cache_file + ".tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(self.cache, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_path, self.cache_file)
+        except OSError as e:
+            logger.warning(f"保存校准缓存失败: {e}", extra={'save_to_file': True})
@@ -7,10 +7,14 @@
 """
 
 import os
-import re
 import json
-from datetime import datetime
+from itertools import islice
+from datetime import datetime, timedelta
 from config import logger, Config
+from utils.history_store import create_history_store
+from utils.history_writer import HistoryWriter
+from utils.history_cache import RoleHistoryCache
+from utils.history_index import HistoryIndex
 
 class ChatHistoryManager:
     def __init__(self):
@@ -19,10 +23,28 @@ class ChatHistoryManager:
         self.chat_history = []
         self.max_api_history_length = Config.MAX_API_HISTORY_LENGTH  # 内存和API中保存的最大对话轮数
         
+        # 多角色历史缓存，默认可容纳所有已配置的角色（另加一个未知角色的位置）
+        max_roles = Config.HISTORY_CACHE_MAX_ROLES or len(Config.ROLES) + 1
+        self.history_cache = RoleHistoryCache(self.max_api_history_length, max_roles, Config.HISTORY_CACHE_MAX_BYTES)
+        
         # 创建对话历史文件目录
         self.chat_history_dir = Config.CHAT_HISTORY_DIR
         os.makedirs(self.chat_history_dir, exist_ok=True)
         
+        # 历史存储后端（JSONL或SQLite），每轮对话追加写入，不再整体重写文件
+        self.history_store = create_history_store(
+            Config.CHAT_HISTORY_BACKEND, self.chat_history_dir, Config.CHAT_HISTORY_DB_FILE)
+        
+        # 相关历史检索：每个角色全部历史的BM25索引，生成回复时找回与问题相关的早期对话
+        self.history_index = None
+        if Config.HISTORY_RETRIEVAL_ENABLED:
+            self.history_index = HistoryIndex(self.history_store, os.path.join(self.chat_history_dir, Config.HISTORY_INDEX_DIRNAME))
+        
+        # 后台写入线程，主循环只负责把记录放入队列；记录写入存储后再加入检索索引
+        self.history_writer = None
+        if Config.HISTORY_WRITE_BEHIND:
+            self.history_writer = HistoryWriter(self.history_store, self.history_index.add if self.history_index else None)
+        
         # 当前角色和对话历史文件路径
         self.current_role = Config.DEFAULT_ROLE
         self.chat_history_file = self.get_history_file_path(self.current_role)
@@ -35,31 +57,29 @@ class ChatHistoryManager:
     
     def get_history_file_path(self, role):
         """根据角色名称生成对话历史文件路径"""
-        # 将角色名称转换为有效的文件名
-        # 移除特殊字符，只保留字母、数字、下划线
-        valid_filename = re.sub(r'[^\w\s]', '', role)
-        valid_filename = valid_filename.replace(' ', '_')
-        
-        # 如果文件名为空，使用默认名称
-        if not valid_filename:
-            valid_filename = "default_role"
-        
-        return os.path.join(self.chat_history_dir, f"{valid_filename}_history.json")
+        return self.history_store.get_history_file_path(role)
     
     def switch_role(self, new_role):
-        """切换到新角色，保存当前对话历史并加载新角色的对话历史"""
+        """切换到新角色并加载新角色的对话历史"""
         if new_role == self.current_role:
             return  # 如果角色相同，不需要切换
         
         logger.info(f"检测到角色变更: {self.current_role} -> {new_role}", extra={'save_to_file': True})
         
-        # 保存当前角色的对话历史
-        self.save_chat_history()
+        # 每轮对话在add_chat时已追加到文件，切换前无需再保存当前角色的历史
         
         # 更新当前角色和对话历史文件路径
         self.current_role = new_role
         self.chat_history_file = self.get_history_file_path(self.current_role)
         
+        # 已缓存的角色直接切换到对应的内存队列，无需读取文件
+        cached = self.history_cache.get(new_role)
+        if cached is not None:
+            self.chat_history = cached
+            self._request_index()
+            logger.info(f"切换到新角色: {self.current_role}（使用内存缓存，{len(cached)}轮对话）", extra={'save_to_file': True})
+            return
+        
         logger.info(f"切换到新角色: {self.current_role}", extra={'save_to_file': True})
         logger.info(f"新对话历史文件: {self.chat_history_file}", extra={'save_to_file': True})
         
@@ -67,34 +87,55 @@ class ChatHistoryManager:
         self.load_chat_history()
     
     def load_chat_history(self):
-        """从本地文件加载历史对话记录"""
+        """从本地文件加载最近的历史对话记录（只读取文件末尾的若干轮）"""
         try:
-            if os.path.exists(self.chat_history_file):
-                with open(self.chat_history_file, 'r', encoding='utf-8') as f:
-                    self.chat_history = json.load(f)
-                logger.info(f"成功从{self.chat_history_file}加载了{len(self.chat_history)}轮历史对话", extra={'save_to_file': True})
+            # 旧版本的历史文件首次加载时自动迁移（JSONL后端）或导入（SQLite后端）
+            self.history_store.migrate_legacy(self.current_role)
+            
+            # 该角色如有尚未写入的记录，先等待后台写入完成再读取
+            self._wait_pending_writes()
+            
+            if self.history_store.has_history(self.current_role):
                 # 只在内存中保留最新的几轮对话
-                if len(self.chat_history) > self.max_api_history_length:
-                    self.chat_history = self.chat_history[-self.max_api_history_length:]
-                    logger.info(f"内存中只保留最新的{self.max_api_history_length}轮对话", extra={'save_to_file': True})
+                records = self.history_store.tail(self.current_role, self.max_api_history_length)
+                logger.info(f"成功从{self.chat_history_file}加载了最近{len(records)}轮历史对话", extra={'save_to_file': True})
             else:
                 logger.info(f"未找到角色'{self.current_role}'的历史对话文件，将创建新的对话历史", extra={'save_to_file': True})
-                self.chat_history = []
+                records = []
         except Exception as e:
             logger.error(f"加载历史对话失败: {e}", extra={'save_to_file': True})
-            self.chat_history = []
+            records = []
+        self.chat_history = self.history_cache.put(self.current_role, records)
+        self._request_index()
+    
+    def _request_index(self):
+        """在后台加载当前角色的检索索引（启动和切换角色时），不在生成回复时同步加载"""
+        if self.history_index:
+            self.history_index.request_load(self.current_role)
+    
+    def _wait_pending_writes(self):
+        """读取存储之前，确保当前角色已提交的记录都已写入"""
+        if self.history_writer:
+            self.history_writer.flush_role(self.current_role)
     
     def save_chat_history(self):
-        """将对话历史保存到本地文件"""
-        try:
-            # 确保目录存在
-            os.makedirs(os.path.dirname(self.chat_history_file), exist_ok=True)
-            
-            with open(self.chat_history_file, 'w', encoding='utf-8') as f:
-                json.dump(self.chat_history, f, ensure_ascii=False, indent=2)
-            logger.info(f"成功将{len(self.chat_history)}轮对话历史保存到{self.chat_history_file}", extra={'save_to_file': True})
-        except Exception as e:
-            logger.error(f"保存对话历史失败: {e}", extra={'save_to_file': True})
+        """保存对话历史
+
+        每轮对话在add_chat时已追加写入（或提交给后台写入线程），这里只等待后台队列写完，不整体重写文件。
+        """
+        if self.history_writer:
+            self.history_writer.flush()
+        logger.info(f"对话历史已追加保存在{self.chat_history_file}", extra={'save_to_file': True})
+    
+    def close(self):
+        """退出前调用：写入所有待写入的记录并关闭存储"""
+        if self.history_writer:
+            self.history_writer.close()
+        if self.history_index:
+            self.history_index.close()
+            logger.info(f"相关历史检索统计: {self.history_index.format_stats()}", extra={'save_to_file': True})
+        self.history_store.close()
+        logger.info(f"多角色历史缓存统计: {self.history_cache.format_stats()}", extra={'save_to_file': True})
     
     def add_chat(self, sender, question, response):
         """添加新的对话记录"""
@@ -107,21 +148,67 @@ class ChatHistoryManager:
             'role': self.current_role  # 记录当前角色
         }
         
-        # 将当前对话添加到历史记录
-        self.chat_history.append(new_chat)
-        
-        # 如果内存中的历史记录超过最大长度，删除最早的对话
-        if len(self.chat_history) > self.max_api_history_length:
-            removed = self.chat_history.pop(0)
+        # 将当前对话添加到历史记录（内存队列为固定长度，超过最大长度时自动删除最早的对话）
+        removed = self.history_cache.append(self.current_role, new_chat)
+        if removed:
             logger.info(f"内存中历史记录已达到最大长度，删除最早的对话: {removed['sender']}: {removed['question'][:20]}...", extra={'save_to_file': True})
         
-        # 保存对话历史到本地文件
-        self.save_chat_history()
+        # 追加写入本地文件，本地保存全部对话，不受内存轮数限制
+        if self.history_writer:
+            self.history_writer.submit(self.current_role, new_chat)
+            return
+        try:
+            position = self.history_store.append(self.current_role, new_chat)
+        except Exception as e:
+            logger.error(f"保存对话历史失败: {e}", extra={'save_to_file': True})
+            return
+        # 加入检索索引（索引只保存记录在存储中的位置）
+        if self.history_index:
+            self.history_index.add(self.current_role, [new_chat], [position])
+    
+    def record_suppressed(self, sender, question):
+        """记录一次被重复问题检查拦截的提问（追加到SUPPRESSED_LOG_FILE，供 roles/history.py 统计重复拦截率）"""
+        event = {
+            'sender': sender,
+            'question': question,
+            'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            'role': self.current_role
+        }
+        try:
+            with open(os.path.join(self.chat_history_dir, Config.SUPPRESSED_LOG_FILE), 'a', encoding='utf-8') as f:
+                f.write(json.dumps(event, ensure_ascii=False) + "\n")
+        except OSError as e:
+            logger.error(f"记录重复问题失败: {e}", extra={'save_to_file': True})
     
     def get_recent_history(self):
         """获取最近的对话历史（用于API请求）"""
         # 由于内存中已经只保留了最新的几轮对话，直接返回全部
-        return self.chat_history
+        return list(self.chat_history)
+    
+    def get_context_history(self, question):
+        """获取生成回复时发送给API的对话历史：与问题相关的早期对话加上最近几轮对话（按时间从旧到新）
+
+        未开启相关历史检索，或当前角色的索引尚未在后台加载完成时，与get_recent_history相同。
+        """
+        if not self.history_index:
+            return self.get_recent_history()
+        recent_rounds = Config.HISTORY_RETRIEVAL_RECENT_ROUNDS
+        recent = list(islice(reversed(self.chat_history), recent_rounds))[::-1] if recent_rounds > 0 else []
+        # 最近几轮中尚未写入存储的记录还不在索引中，只需排除已在索引中的那部分
+        pending = self.history_writer.pending_count(self.current_role) if self.history_writer else 0
+        retrieved = self.history_index.search(self.current_role, question, Config.HISTORY_RETRIEVAL_TOP_K,
+                                              max(0, len(recent) - pending))
+        if retrieved is None:
+            logger.info(f"角色'{self.current_role}'的检索索引尚未加载完成，使用最近{len(self.chat_history)}轮对话作为上下文", extra={'save_to_file': True})
+            return self.get_recent_history()
+        if retrieved:
+            logger.info(f"找回{len(retrieved)}轮与问题相关的早期对话，加上最近{len(recent)}轮对话作为上下文", extra={'save_to_file': True})
+        return retrieved + recent
+    
+    def get_sender_history(self, sender, count):
+        """获取当前角色下指定发送者最近的count轮对话"""
+        self._wait_pending_writes()
+        return self.history_store.recent(self.current_role, count, sender=sender)
     
     def is_similar_question(self, question1, question2):
         """判断两个问题是否相似（简单实现）"""
@@ -160,9 +247,16 @@ class ChatHistoryManager:
         if Config.DUPLICATE_CHECK_HISTORY_LENGTH <= 0:
             return False
             
-        # 只检查最近的几轮对话，数量由配置文件中的DUPLICATE_CHECK_HISTORY_LENGTH决定
-        check_length = min(Config.DUPLICATE_CHECK_HISTORY_LENGTH, len(self.chat_history))
-        recent_chats = self.chat_history[-check_length:]
+        if Config.DUPLICATE_CHECK_WINDOW_MINUTES > 0:
+            # 检查时间窗口内的对话，从存储中按时间索引查询
+            since = (datetime.now() - timedelta(minutes=Config.DUPLICATE_CHECK_WINDOW_MINUTES)).strftime('%Y-%m-%d %H:%M:%S')
+            self._wait_pending_writes()
+            recent_chats = self.history_store.recent(
+                self.current_role, Config.DUPLICATE_CHECK_WINDOW_MAX_RECORDS, since=since)
+        else:
+            # 只检查最近的几轮对话，数量由配置文件中的DUPLICATE_CHECK_HISTORY_LENGTH决定
+            check_length = min(Config.DUPLICATE_CHECK_HISTORY_LENGTH, len(self.chat_history))
+            recent_chats = list(islice(reversed(self.chat_history), check_length))[::-1]
         
         for chat in recent_chats:
             # 使用简单的相似度检查，如果问题相似度超过80%，则认为是相同问题
@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+多角色对话历史缓存模块
+在内存中以LRU方式保留多个角色最近几轮对话，切换角色时直接取用，无需读取文件
+"""
+
+import sys
+from collections import OrderedDict, deque
+from config import logger
+
+
+def estimate_record_size(record):
+    """粗略估算一条对话记录占用的内存字节数"""
+    return sys.getsizeof(record) + sum(sys.getsizeof(value) for value in record.values())
+
+
+class RoleHistoryCache:
+    def __init__(self, window, max_roles, max_bytes):
+        """初始化缓存
+
+        Args:
+            window: 每个角色保留的对话轮数
+            max_roles: 最多缓存的角色数
+            max_bytes: 所有缓存记录的内存预算（估算值）
+        """
+        self.window = window
+        self.max_roles = max(1, max_roles)
+        self.max_bytes = max_bytes
+        # 角色 -> 固定长度的对话队列，按最近使用顺序排列
+        self.buffers = OrderedDict()
+        self.sizes = {}
+        self.total_bytes = 0
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0, "evicted_by_count": 0, "evicted_by_memory": 0}
+
+    def get(self, role):
+        """获取角色的对话队列，未缓存时返回None"""
+        buffer = self.buffers.get(role)
+        if buffer is None:
+            self.stats["misses"] += 1
+            return None
+        self.stats["hits"] += 1
+        self.buffers.move_to_end(role)
+        return buffer
+
+    def put(self, role, records):
+        """缓存角色的最近对话并返回对应的队列"""
+        if role in self.buffers:
+            self.total_bytes -= self.sizes[role]
+        buffer = deque(records, maxlen=self.window)
+        self.buffers[role] = buffer
+        self.buffers.move_to_end(role)
+        self.sizes[role] = sum(estimate_record_size(record) for record in buffer)
+        self.total_bytes += self.sizes[role]
+        self._evict(keep=role)
+        return buffer
+
+    def append(self, role, record):
+        """向已缓存角色的队列追加一轮对话，超出窗口的最早记录自动移除
+
+        Returns:
+            dict: 被移出窗口的记录，没有则返回None
+        """
+        buffer = self.buffers[role]
+        removed = buffer[0] if len(buffer) == buffer.maxlen else None
+        buffer.append(record)
+
+        delta = estimate_record_size(record) - (estimate_record_size(removed) if removed else 0)
+        self.sizes[role] += delta
+        self.total_bytes += delta
+        self.buffers.move_to_end(role)
+        self._evict(keep=role)
+        return removed
+
+    def _evict(self, keep):
+        """按LRU顺序淘汰角色，直到满足角色数和内存预算；keep指定的角色（当前角色）不会被淘汰"""
+        while len(self.buffers) > 1:
+            over_count = len(self.buffers) > self.max_roles
+            over_memory = self.total_bytes > self.max_bytes
+            if not over_count and not over_memory:
+                break
+            role = next(iter(self.buffers))
+            if role == keep:
+                break
+            self.buffers.pop(role)
+            self.total_bytes -= self.sizes.pop(role)
+            self.stats["evictions"] += 1
+            self.stats["evicted_by_count" if over_count else "evicted_by_memory"] += 1
+            logger.info(f"历史缓存已淘汰角色{role}（{'角色数' if over_count else '内存'}超出限制），{self.format_stats()}", extra={'save_to_file': True})
+
+    def get_stats(self):
+        stats = dict(self.stats)
+        stats["cached_roles"] = len(self.buffers)
+        stats["cached_bytes"] = self.total_bytes
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        return stats
+
+    def format_stats(self):
+        stats = self.get_stats()
+        return (f"已缓存{stats['cached_roles']}/{self.max_roles}个角色，约{stats['cached_bytes'] / 1024:.1f}KB，"
+                f"命中率{stats['hit_rate']:.0%}，淘汰{stats['evictions']}次")
@@ -0,0 +1,411 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+对话历史检索模块
+为每个角色的全部对话历史建立本地倒排索引（BM25），中文按字的一元和二元组切分，英文和数字按整词切分，
+生成回复时只把与当前问题最相关的几轮早期对话和最近几轮对话发给API，
+而不是每次都发送最近MAX_API_HISTORY_LENGTH轮：提示词更短，很久以前的相关对话也能被找回。
+索引不保存对话内容，只保存每轮对话在存储中的位置（JSONL的字节偏移或SQLite的行ID），检索结果从存储中读取。
+每轮对话写入存储后增量加入索引，由后台线程定期把索引快照以pickle保存在对话历史目录的index子目录中。
+索引在启动和切换角色时由后台线程加载，只补充索引保存之后新写入的记录，历史被改写（与索引对不上）时从存储中重建；
+加载完成之前search返回None，调用方改为发送最近几轮对话，回复不会等待索引加载。
+"""
+
+import os
+import re
+import math
+import time
+import zlib
+import heapq
+import queue
+import pickle
+import threading
+from array import array
+from config import logger, Config
+from utils.history_store import role_file_stem
+from utils.metrics import metrics
+
+INDEX_VERSION = 2
+# BM25参数
+BM25_K1 = 1.2
+BM25_B = 0.75
+# 英文单词和数字整体作为一个词，其他文字（中文等）按字切分n元组，标点和空白作为分隔
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+|[^\W\d_a-z]+")
+
+
+def tokenize(text, ngram_sizes=None):
+    """把文本切分为检索用的词项列表"""
+    ngram_sizes = ngram_sizes or Config.HISTORY_INDEX_NGRAM_SIZES
+    terms = []
+    for run in TOKEN_PATTERN.findall(text.lower()):
+        if run.isascii():
+            terms.append(run)
+            continue
+        for size in ngram_sizes:
+            terms.extend(run[i:i + size] for i in range(len(run) - size + 1))
+    return terms
+
+
+def record_key(record):
+    """识别同一条记录的键（检查索引与存储是否一致）"""
+    return (record.get('timestamp', ''), record.get('sender', ''), record.get('question', ''))
+
+
+def question_hash(question):
+    """问题去除标点和空白后的哈希（检索时相同的问题只取一轮），不随进程变化，可以保存在索引文件中"""
+    return zlib.crc32("".join(TOKEN_PATTERN.findall(question.lower())).encode('utf-8'))
+
+
+class RoleIndex:
+    __slots__ = ('positions', 'question_hashes', 'lengths', 'postings', 'total_length', 'last_key', 'dirty', 'saving')
+
+    def __init__(self):
+        """一个角色的倒排索引，文档编号即记录在历史中的顺序"""
+        # 每轮对话在存储中的位置和问题的哈希
+        self.positions = array('q')
+        self.question_hashes = array('I')
+        self.lengths = array('I')
+        # 词项 -> [文档编号, 词频, 文档编号, 词频, ...]
+        self.postings = {}
+        self.total_length = 0
+        # 最后一条记录的键，加载时与存储中同一位置的记录比较
+        self.last_key = None
+        # 上次保存后新增的记录数，以及是否正在后台保存
+        self.dirty = 0
+        self.saving = False
+
+    def __len__(self):
+        return len(self.positions)
+
+    def last_position(self):
+        return self.positions[-1] if self.positions else None
+
+    def add(self, position, record):
+        doc_id = len(self.positions)
+        question = record.get('question', '')
+        terms = tokenize(f"{question}\n{record.get('response', '')}")
+        counts = {}
+        for term in terms:
+            counts[term] = counts.get(term, 0) + 1
+        for term, tf in counts.items():
+            posting = self.postings.get(term)
+            if posting is None:
+                posting = self.postings[term] = array('I')
+            posting.append(doc_id)
+            posting.append(tf)
+        self.positions.append(position)
+        self.question_hashes.append(question_hash(question))
+        self.lengths.append(len(terms))
+        self.total_length += len(terms)
+        self.last_key = record_key(record)
+        self.dirty += 1
+
+    def search(self, query, top_k, exclude_from=None, min_score=0.0, relative_score=0.0):
+        """按BM25分数返回最相关的top_k个文档编号（按分数从高到低）
+
+        Args:
+            exclude_from: 不返回编号不小于该值的文档（最近几轮已经单独放入提示词）
+            min_score: 分数下限
+            relative_score: 分数低于最高分的该比例时不返回（只因"怎么"、"什么"等常用词相同而匹配的对话）
+        """
+        total = len(self.positions)
+        count = total if exclude_from is None else min(exclude_from, total)
+        if count <= 0 or top_k <= 0:
+            return []
+        average_length = self.total_length / total or 1.0
+        scores = {}
+        for term in set(tokenize(query)):
+            posting = self.postings.get(term)
+            if posting is None:
+                continue
+            df = len(posting) // 2
+            # 出现在一半以上对话中的词项（如"的"、"吗"）区分度很低，跳过以免遍历整个倒排表
+            if total >= 100 and df * 2 > total:
+                continue
+            idf = math.log(1 + (total - df + 0.5) / (df + 0.5))
+            lengths = self.lengths
+            for i in range(0, len(posting), 2):
+                doc_id = posting[i]
+                if doc_id >= count:
+                    # 倒排表按文档编号递增，之后都是被排除的最近几轮
+                    break
+                tf = posting[i + 1]
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * lengths[doc_id] / average_length)
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (BM25_K1 + 1) / (tf + norm)
+        # 同一个问题可能被问过很多次，相同的问题只取分数最高（相同时为最早）的一轮
+        selected, questions = [], set()
+        best = heapq.nlargest(top_k * 4, scores.items(), key=lambda item: item[1])
+        if best:
+            min_score = max(min_score, best[0][1] * relative_score)
+        for doc_id, score in best:
+            if score < min_score or len(selected) >= top_k:
+                break
+            question = self.question_hashes[doc_id]
+            if question not in questions:
+                questions.add(question)
+                selected.append(doc_id)
+        return selected
+
+    def snapshot(self):
+        """保存用的快照（在锁内调用）：只记录文档数并浅复制词项表，不复制倒排表，开销与词项数成正比"""
+        return len(self.positions), dict(self.postings), self.last_key
+
+    def dump_state(self, snapshot):
+        """把快照转换为可保存的数据（在锁外调用）
+
+        倒排表只会在末尾追加，复制后截去快照之后加入的文档即与快照时一致。
+        """
+        count, postings, last_key = snapshot
+        # 倒排表拼接为一整块数据，逐个pickle几十万个小数组要慢得多
+        terms, sizes, chunks = [], array('I'), []
+        for term, posting in postings.items():
+            posting = posting[:]
+            end = len(posting)
+            while end and posting[end - 2] >= count:
+                end -= 2
+            if end:
+                terms.append(term)
+                sizes.append(end)
+                chunks.append(posting.tobytes() if end == len(posting) else posting[:end].tobytes())
+        lengths = self.lengths[:count]
+        return {"positions": self.positions[:count], "question_hashes": self.question_hashes[:count],
+                "lengths": lengths, "total_length": sum(lengths), "last_key": last_key,
+                "terms": "\n".join(terms), "posting_sizes": sizes, "postings": b"".join(chunks)}
+
+    @classmethod
+    def from_state(cls, state):
+        index = cls()
+        index.positions = state["positions"]
+        index.question_hashes = state["question_hashes"]
+        index.lengths = state["lengths"]
+        index.total_length = state["total_length"]
+        values = array('I')
+        values.frombytes(state["postings"])
+        postings, start = {}, 0
+        for term, size in zip(state["terms"].split("\n") if state["terms"] else (), state["posting_sizes"]):
+            postings[term] = values[start:start + size]
+            start += size
+        index.postings = postings
+        index.last_key = state["last_key"]
+        return index
+
+
+class HistoryIndex:
+    def __init__(self, history_store, index_dir):
+        """初始化对话历史检索
+
+        Args:
+            history_store: 对话历史存储（utils/history_store.py），检索结果从中读取，索引缺失或与存储不一致时从中重建
+            index_dir: 索引文件目录
+        """
+        self.history_store = history_store
+        self.index_dir = index_dir
+        os.makedirs(self.index_dir, exist_ok=True)
+        self.indexes = {}
+        self.lock = threading.Lock()
+        # 加载和保存索引的后台线程，加载和保存期间不阻塞add和search
+        self.tasks = queue.Queue()
+        self.loading = set()
+        self.closed = False
+        self.save_lock = threading.Lock()
+        self.stats = {"searches": 0, "retrieved": 0, "fallbacks": 0, "loaded": 0, "rebuilt": 0, "caught_up": 0, "saves": 0}
+        self.thread = threading.Thread(target=self._run, name="HistoryIndex", daemon=True)
+        self.thread.start()
+
+    def get_index_path(self, role):
+        return os.path.join(self.index_dir, f"{role_file_stem(role)}.idx")
+
+    def is_loaded(self, role):
+        return role in self.indexes
+
+    def request_load(self, role):
+        """在后台加载（或建立）角色的索引，已加载或正在加载时不做任何事"""
+        with self.lock:
+            if self.closed or role in self.indexes or role in self.loading:
+                return
+            self.loading.add(role)
+        self.tasks.put(('load', role, None))
+
+    def add(self, role, records, positions):
+        """加入已写入存储的对话（在存储写入之后调用，positions为存储返回的位置）
+
+        角色的索引尚未加载时忽略，加载时会从存储中补充；已在加载时补充过的记录不会重复加入。
+        """
+        with self.lock:
+            index = self.indexes.get(role)
+            if index is None:
+                return
+            last = index.last_position()
+            for record, position in zip(records, positions):
+                if last is None or position > last:
+                    index.add(position, record)
+            self._schedule_save(role, index)
+
+    def search(self, role, question, top_k, exclude_recent=0):
+        """检索与问题相关的早期对话
+
+        Args:
+            exclude_recent: 最近几轮对话不参与检索（已作为最近历史放入提示词）
+
+        Returns:
+            list: 对话记录，按时间从旧到新排列；索引尚未加载完成时返回None（并开始在后台加载）
+        """
+        start = time.perf_counter()
+        with self.lock:
+            index = self.indexes.get(role)
+        if index is None:
+            self.stats["fallbacks"] += 1
+            self.request_load(role)
+            return None
+        with self.lock:
+            doc_ids = sorted(index.search(question, top_k, len(index) - exclude_recent,
+                                          Config.HISTORY_RETRIEVAL_MIN_SCORE, Config.HISTORY_RETRIEVAL_RELATIVE_SCORE))
+            positions = [index.positions[doc_id] for doc_id in doc_ids]
+            hashes = [index.question_hashes[doc_id] for doc_id in doc_ids]
+        records = []
+        for record, expected in zip(self.history_store.read_at(role, positions), hashes):
+            if record is None or question_hash(record.get('question', '')) != expected:
+                # 历史在运行中被改写，位置已经失效：丢弃该角色的索引，在后台重新加载（或重建）
+                logger.warning(f"角色'{role}'的对话历史索引与历史记录不一致，将重新加载", extra={'save_to_file': True})
+                with self.lock:
+                    if self.indexes.get(role) is index:
+                        del self.indexes[role]
+                self.request_load(role)
+                return None
+            record.setdefault('role', role)
+            records.append(record)
+        self.stats["searches"] += 1
+        self.stats["retrieved"] += len(records)
+        metrics.observe_stage("history_retrieval", (time.perf_counter() - start) * 1000)
+        return records
+
+    def _install(self, role):
+        """后台线程：加载索引，补充加载期间写入存储的记录后开始使用"""
+        try:
+            index = self._load(role)
+            with self.lock:
+                # 在锁内补充，之后写入的记录由add加入，不会遗漏或重复
+                for position, record in self.history_store.iter_positioned(role, after=index.last_position()):
+                    index.add(position, record)
+                self.indexes[role] = index
+                self._schedule_save(role, index)
+        except Exception as e:
+            logger.error(f"加载角色'{role}'的对话历史索引失败: {e}", extra={'save_to_file': True})
+        finally:
+            with self.lock:
+                self.loading.discard(role)
+
+    def _load(self, role):
+        """加载索引文件，并补充索引保存之后写入存储的记录"""
+        start = time.perf_counter()
+        path = self.get_index_path(role)
+        index = None
+        if os.path.exists(path):
+            try:
+                with open(path, 'rb') as f:
+                    data = pickle.load(f)
+                if data.get("version") == INDEX_VERSION and data.get("ngram_sizes") == tuple(Config.HISTORY_INDEX_NGRAM_SIZES):
+                    index = RoleIndex.from_state(data)
+            except Exception as e:
+                logger.warning(f"读取对话历史索引{path}失败，将重新建立: {e}", extra={'save_to_file': True})
+
+        if index is not None:
+            missing = self._records_after(role, index.last_position(), index.last_key)
+            if missing is None:
+                logger.info(f"角色'{role}'的对话历史索引与历史记录不一致，将重新建立", extra={'save_to_file': True})
+                index = None
+            else:
+                for position, record in missing:
+                    index.add(position, record)
+                self.stats["loaded"] += 1
+                if missing:
+                    self.stats["caught_up"] += len(missing)
+                logger.info(f"已加载角色'{role}'的对话历史索引（{len(index)}轮，补充{len(missing)}轮），"
+                            f"耗时{(time.perf_counter() - start) * 1000:.1f}ms", extra={'save_to_file': True})
+
+        if index is None:
+            index = RoleIndex()
+            for position, record in self.history_store.iter_positioned(role):
+                index.add(position, record)
+            self.stats["rebuilt"] += 1
+            logger.info(f"已为角色'{role}'建立对话历史索引（{len(index)}轮），"
+                        f"耗时{(time.perf_counter() - start) * 1000:.1f}ms", extra={'save_to_file': True})
+        return index
+
+    def _records_after(self, role, last_position, last_key):
+        """存储中位于索引最后一条记录之后的记录[(位置, 记录)]
+
+        存储中该位置的记录与last_key不同（历史被改写或截断）时返回None。
+        """
+        if last_position is None:
+            # 空索引：存储中有记录时无法确认这些记录是在索引保存之后写入的，重建
+            return None if next(iter(self.history_store.iter_positioned(role)), None) else []
+        record = self.history_store.read_at(role, [last_position])[0]
+        if record is None or record_key(record) != last_key:
+            return None
+        return list(self.history_store.iter_positioned(role, after=last_position))
+
+    def _schedule_save(self, role, index):
+        """新增记录达到保存间隔时，交给后台线程保存（在锁内调用）"""
+        if index.dirty >= Config.HISTORY_INDEX_SAVE_INTERVAL and not index.saving:
+            index.saving = True
+            self.tasks.put(('save', role, index))
+
+    def _run(self):
+        """后台线程：按顺序加载和保存索引文件"""
+        while True:
+            kind, role, index = self.tasks.get()
+            if kind == 'stop':
+                return
+            if kind == 'load':
+                if self.closed:
+                    with self.lock:
+                        self.loading.discard(role)
+                    continue
+                self._install(role)
+            else:
+                self._save(role, index)
+
+    def _save(self, role, index):
+        """在锁内取快照，在锁外序列化并原子写入索引文件（先写临时文件再替换）"""
+        with self.save_lock:
+            with self.lock:
+                snapshot = index.snapshot()
+                saved = index.dirty
+            path = self.get_index_path(role)
+            tmp_path = path + ".tmp"
+            start = time.perf_counter()
+            try:
+                data = index.dump_state(snapshot)
+                data.update(version=INDEX_VERSION, ngram_sizes=tuple(Config.HISTORY_INDEX_NGRAM_SIZES))
+                with open(tmp_path, 'wb') as f:
+                    pickle.dump(data, f, protocol=pickle.HIGHEST_PROTOCOL)
+                os.replace(tmp_path, path)
+                with self.lock:
+                    index.dirty -= saved
+                self.stats["saves"] += 1
+                logger.debug(f"已保存角色'{role}'的对话历史索引（{snapshot[0]}轮），耗时{(time.perf_counter() - start) * 1000:.1f}ms")
+            except Exception as e:
+                logger.error(f"保存对话历史索引{path}失败: {e}", extra={'save_to_file': True})
+            finally:
+                with self.lock:
+                    index.saving = False
+
+    def close(self):
+        """退出前停止后台线程（不再加载尚未开始加载的索引），并保存有新增记录的索引"""
+        with self.lock:
+            self.closed = True
+        self.tasks.put(('stop', None, None))
+        self.thread.join()
+        with self.lock:
+            dirty = [(role, index) for role, index in self.indexes.items() if index.dirty]
+        for role, index in dirty:
+            self._save(role, index)
+
+    def format_stats(self):
+        stats = self.stats
+        average = stats["retrieved"] / stats["searches"] if stats["searches"] else 0.0
+        return (f"检索{stats['searches']}次，平均找回{average:.1f}轮早期对话，索引未就绪{stats['fallbacks']}次，"
+                f"加载索引{stats['loaded']}个（补充{stats['caught_up']}轮），重建索引{stats['rebuilt']}个，"
+                f"保存索引{stats['saves']}次")
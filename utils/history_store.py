@@ -0,0 +1,543 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+对话历史存储模块
+按角色保存对话历史，提供两种后端：
+- JsonlHistoryStore：追加式JSONL文件，每个角色一个文件，每轮对话占一行
+- SqliteHistoryStore：SQLite数据库（WAL模式），按角色、发送者和时间建立索引
+"""
+
+import os
+import re
+import json
+import sqlite3
+import threading
+from datetime import datetime
+from itertools import islice
+from config import logger
+
+# 从文件末尾向前读取时每次读取的字节数
+TAIL_BLOCK_SIZE = 8192
+
+# 对话记录的固定字段，其余字段在SQLite中以JSON形式保存
+RECORD_FIELDS = ('sender', 'question', 'response', 'timestamp', 'role')
+
+
+def role_file_stem(role):
+    """将角色名称转换为有效的文件名（不含扩展名）"""
+    # 移除特殊字符，只保留字母、数字、下划线
+    valid_filename = re.sub(r'[^\w\s]', '', role)
+    valid_filename = valid_filename.replace(' ', '_')
+
+    # 如果文件名为空，使用默认名称
+    if not valid_filename:
+        valid_filename = "default_role"
+    return f"{valid_filename}_history"
+
+
+def load_json_history_file(path):
+    """读取旧版JSON数组格式的历史文件"""
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def parse_jsonl_line(line, path):
+    """解析JSONL中的一行，空行或无法解析的行返回None"""
+    if not line.strip():
+        return None
+    try:
+        return json.loads(line)
+    except ValueError:
+        # 可能是异常退出时写了一半的行
+        logger.warning(f"跳过{path}中无法解析的历史记录行", extra={'save_to_file': True})
+        return None
+
+
+def iter_jsonl_file(path):
+    """逐行遍历JSONL历史文件中的记录，不一次性载入内存"""
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            record = parse_jsonl_line(line, path)
+            if record is not None:
+                yield record
+
+
+def iter_json_array_file(path, block_size=65536):
+    """逐条遍历旧版JSON数组格式历史文件中的记录，每次只读取一块，不一次性载入整个文件"""
+    decoder = json.JSONDecoder()
+    with open(path, 'r', encoding='utf-8') as f:
+        buffer = f.read(block_size).lstrip()
+        if not buffer.startswith("["):
+            raise ValueError(f"{path}不是JSON数组格式的历史文件")
+        buffer = buffer[1:]
+        eof = False
+        position = 0
+        while True:
+            # 跳过记录之间的空白和逗号
+            while position < len(buffer) and (buffer[position].isspace() or buffer[position] == ","):
+                position += 1
+            if position < len(buffer) and buffer[position] == "]":
+                return
+            try:
+                record, end = decoder.raw_decode(buffer, position)
+            except ValueError:
+                # 记录被块边界截断（或尚未读取），读取下一块后再解析
+                if eof:
+                    raise
+                chunk = f.read(block_size)
+                eof = not chunk
+                buffer = buffer[position:] + chunk
+                position = 0
+                continue
+            yield record
+            position = end
+
+
+def atomic_write_lines(path, lines):
+    """整体重写文件：先写临时文件并fsync，再原子重命名替换原文件
+
+    进程在任意时刻崩溃，原文件要么保持旧内容，要么是完整的新内容。
+    """
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        for line in lines:
+            f.write(line)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    # 同步目录项，确保重命名本身也已落盘（Windows不支持对目录fsync）
+    if hasattr(os, 'O_DIRECTORY'):
+        dir_fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+
+
+def create_history_store(backend, history_dir, db_filename="chat_history.db"):
+    """根据配置创建历史存储后端
+
+    Args:
+        backend: 'jsonl' 或 'sqlite'
+        history_dir: 对话历史目录
+        db_filename: SQLite数据库文件名（位于history_dir下）
+    """
+    if backend == 'sqlite':
+        return SqliteHistoryStore(history_dir, db_filename)
+    if backend == 'jsonl':
+        return JsonlHistoryStore(history_dir)
+    raise ValueError(f"不支持的对话历史存储后端: {backend}")
+
+
+class JsonlHistoryStore:
+    def __init__(self, history_dir):
+        """初始化JSONL历史存储
+
+        Args:
+            history_dir: 对话历史文件目录
+        """
+        self.history_dir = history_dir
+        os.makedirs(self.history_dir, exist_ok=True)
+
+    def get_history_file_path(self, role):
+        """根据角色名称生成JSONL对话历史文件路径"""
+        return os.path.join(self.history_dir, f"{role_file_stem(role)}.jsonl")
+
+    def get_legacy_file_path(self, role):
+        """旧版本使用的JSON数组格式历史文件路径"""
+        return os.path.join(self.history_dir, f"{role_file_stem(role)}.json")
+
+    def has_history(self, role):
+        return os.path.exists(self.get_history_file_path(role))
+
+    def migrate_legacy(self, role):
+        """将旧版JSON数组文件迁移为JSONL文件，原文件重命名为 .json.bak 保留
+
+        Returns:
+            int: 迁移的对话轮数，无需迁移时返回0
+        """
+        legacy_path = self.get_legacy_file_path(role)
+        target_path = self.get_history_file_path(role)
+        if not os.path.exists(legacy_path) or os.path.exists(target_path):
+            return 0
+
+        records = load_json_history_file(legacy_path)
+
+        # 原子写入，避免迁移中途崩溃留下半个文件
+        self.rewrite(role, records)
+        os.replace(legacy_path, legacy_path + ".bak")
+
+        logger.info(f"已将旧版历史文件{legacy_path}迁移为{target_path}，共{len(records)}轮对话", extra={'save_to_file': True})
+        return len(records)
+
+    def rewrite(self, role, records):
+        """用records整体替换角色的历史文件（原子重命名，崩溃安全）"""
+        atomic_write_lines(
+            self.get_history_file_path(role),
+            (json.dumps(record, ensure_ascii=False) + "\n" for record in records)
+        )
+
+    def sync(self, role):
+        """将角色历史文件已写入的内容fsync到磁盘"""
+        path = self.get_history_file_path(role)
+        if os.path.exists(path):
+            with open(path, 'ab') as f:
+                os.fsync(f.fileno())
+
+    def append(self, role, record):
+        """追加一轮对话到角色的历史文件末尾
+
+        Returns:
+            int: 该记录在文件中的起始字节偏移
+        """
+        return self.append_many(role, [record])[0]
+
+    def append_many(self, role, records):
+        """一次写入多轮对话
+
+        Returns:
+            list: 每条记录在文件中的起始字节偏移
+        """
+        path = self.get_history_file_path(role)
+        lines = [(json.dumps(record, ensure_ascii=False) + "\n").encode('utf-8') for record in records]
+        offsets = []
+        with open(path, 'ab') as f:
+            offset = f.tell()
+            for line in lines:
+                offsets.append(offset)
+                offset += len(line)
+            f.write(b"".join(lines))
+        return offsets
+
+    def iter_reverse(self, role):
+        """从文件末尾向前逐条读取记录（从新到旧），读取量只与实际消费的记录数有关"""
+        path = self.get_history_file_path(role)
+        if not os.path.exists(path):
+            return
+
+        with open(path, 'rb') as f:
+            f.seek(0, os.SEEK_END)
+            position = f.tell()
+            remainder = b""
+            while position > 0:
+                read_size = min(TAIL_BLOCK_SIZE, position)
+                position -= read_size
+                f.seek(position)
+                lines = (f.read(read_size) + remainder).split(b"\n")
+                # 第一段可能是被块边界截断的记录，留到下一次读取时拼接
+                remainder = lines[0]
+                for line in reversed(lines[1:]):
+                    record = parse_jsonl_line(line, path)
+                    if record is not None:
+                        yield record
+            record = parse_jsonl_line(remainder, path)
+            if record is not None:
+                yield record
+
+    def tail(self, role, count):
+        """从文件末尾向前读取，只解析最后count条记录（按时间从旧到新返回）"""
+        if count <= 0:
+            return []
+        records = list(islice(self.iter_reverse(role), count))
+        records.reverse()
+        return records
+
+    def recent(self, role, count, sender=None, since=None):
+        """获取最近的count条记录，可按发送者和起始时间过滤（按时间从旧到新返回）
+
+        Args:
+            since: 时间字符串（%Y-%m-%d %H:%M:%S），只返回不早于该时间的记录
+        """
+        records = []
+        if count <= 0:
+            return records
+        for record in self.iter_reverse(role):
+            if since is not None and record.get('timestamp', '') < since:
+                break
+            if sender is not None and record.get('sender') != sender:
+                continue
+            records.append(record)
+            if len(records) >= count:
+                break
+        records.reverse()
+        return records
+
+    def iter_records(self, role):
+        """逐行遍历角色的全部历史记录，不一次性载入内存"""
+        path = self.get_history_file_path(role)
+        if os.path.exists(path):
+            yield from iter_jsonl_file(path)
+
+    def iter_positioned(self, role, after=None):
+        """按时间顺序遍历记录及其起始字节偏移[(偏移, 记录)]，不一次性载入内存
+
+        Args:
+            after: 从该偏移处的记录之后开始（不含该记录），None表示从头开始
+        """
+        path = self.get_history_file_path(role)
+        if not os.path.exists(path):
+            return
+        with open(path, 'rb') as f:
+            if after is not None:
+                f.seek(after)
+                f.readline()
+            offset = f.tell()
+            for line in f:
+                if not line.endswith(b"\n"):
+                    # 正在写入的最后一行，等写完后再读取
+                    return
+                record = parse_jsonl_line(line, path)
+                if record is not None:
+                    yield offset, record
+                offset += len(line)
+
+    def read_at(self, role, positions):
+        """读取指定字节偏移处的记录（用于检索结果）；偏移处不是一条完整记录时对应项为None"""
+        path = self.get_history_file_path(role)
+        records = []
+        if not os.path.exists(path):
+            return [None] * len(positions)
+        with open(path, 'rb') as f:
+            for position in positions:
+                f.seek(position)
+                line = f.readline()
+                records.append(parse_jsonl_line(line, path) if line.endswith(b"\n") else None)
+        return records
+
+    def close(self):
+        pass
+
+
+class SqliteHistoryStore:
+    # 固定的SQL语句，sqlite3会缓存其预编译结果，重复执行时无需重新解析
+    SQL_INSERT = "INSERT INTO chat_history (role, sender, question, response, timestamp, extra) VALUES (?, ?, ?, ?, ?, ?)"
+    SQL_HAS_ROLE = "SELECT 1 FROM chat_history WHERE role = ? LIMIT 1"
+    SQL_RECENT = "SELECT id, role, sender, question, response, timestamp, extra FROM chat_history WHERE role = ? ORDER BY id DESC LIMIT ?"
+    SQL_RECENT_SINCE = "SELECT id, role, sender, question, response, timestamp, extra FROM chat_history WHERE role = ? AND timestamp >= ? ORDER BY id DESC LIMIT ?"
+    SQL_RECENT_SENDER = "SELECT id, role, sender, question, response, timestamp, extra FROM chat_history WHERE role = ? AND sender = ? ORDER BY id DESC LIMIT ?"
+    SQL_RECENT_SENDER_SINCE = "SELECT id, role, sender, question, response, timestamp, extra FROM chat_history WHERE role = ? AND sender = ? AND timestamp >= ? ORDER BY id DESC LIMIT ?"
+    COLUMNS = "id, role, sender, question, response, timestamp, extra"
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS chat_history (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            role TEXT NOT NULL,
+            sender TEXT NOT NULL,
+            question TEXT NOT NULL,
+            response TEXT NOT NULL,
+            timestamp TEXT NOT NULL,
+            extra TEXT
+        );
+        CREATE INDEX IF NOT EXISTS idx_history_role_id ON chat_history (role, id);
+        CREATE INDEX IF NOT EXISTS idx_history_role_time ON chat_history (role, timestamp);
+        CREATE INDEX IF NOT EXISTS idx_history_role_sender_time ON chat_history (role, sender, timestamp);
+        CREATE INDEX IF NOT EXISTS idx_history_time ON chat_history (timestamp);
+        CREATE TABLE IF NOT EXISTS imported_files (
+            path TEXT PRIMARY KEY,
+            record_count INTEGER NOT NULL,
+            imported_at TEXT NOT NULL
+        );
+    """
+
+    def __init__(self, history_dir, db_filename="chat_history.db"):
+        """初始化SQLite历史存储（WAL模式）
+
+        Args:
+            history_dir: 对话历史目录，旧版JSON/JSONL文件也从这里导入
+            db_filename: 数据库文件名
+        """
+        self.history_dir = history_dir
+        os.makedirs(self.history_dir, exist_ok=True)
+        self.db_path = os.path.join(history_dir, db_filename)
+        # 连接可能被后台写线程使用，统一由锁保护
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(self.db_path, check_same_thread=False, cached_statements=64)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(self.SCHEMA)
+        self.conn.commit()
+
+    def get_history_file_path(self, role):
+        return self.db_path
+
+    def has_history(self, role):
+        with self.lock:
+            return self.conn.execute(self.SQL_HAS_ROLE, (role,)).fetchone() is not None
+
+    def list_roles(self):
+        """数据库中有对话记录的全部角色"""
+        with self.lock:
+            return [row[0] for row in self.conn.execute("SELECT DISTINCT role FROM chat_history ORDER BY role")]
+
+    def _to_row(self, role, record):
+        extra = {k: v for k, v in record.items() if k not in RECORD_FIELDS}
+        return (
+            role,
+            record.get('sender', ''),
+            record.get('question', ''),
+            record.get('response', ''),
+            record.get('timestamp', ''),
+            json.dumps(extra, ensure_ascii=False) if extra else None
+        )
+
+    def _to_record(self, row):
+        _, role, sender, question, response, timestamp, extra = row
+        record = {
+            'sender': sender,
+            'question': question,
+            'response': response,
+            'timestamp': timestamp,
+            'role': role
+        }
+        if extra:
+            record.update(json.loads(extra))
+        return record
+
+    def sync(self, role):
+        """执行WAL检查点，将已提交的数据同步到数据库文件"""
+        with self.lock:
+            self.conn.execute("PRAGMA wal_checkpoint(PASSIVE)")
+
+    def append(self, role, record):
+        """写入一轮对话
+
+        Returns:
+            int: 记录的行ID
+        """
+        return self.append_many(role, [record])[-1]
+
+    def append_many(self, role, records):
+        """在一个事务中批量写入多轮对话
+
+        Returns:
+            list: 每条记录的行ID
+        """
+        rows = [self._to_row(role, record) for record in records]
+        with self.lock:
+            # 所有记录在同一个事务中提交，只产生一次WAL同步
+            with self.conn:
+                cursor = self.conn.cursor()
+                row_ids = []
+                for row in rows:
+                    cursor.execute(self.SQL_INSERT, row)
+                    row_ids.append(cursor.lastrowid)
+                return row_ids
+
+    def recent(self, role, count, sender=None, since=None):
+        """获取最近的count条记录，可按发送者和起始时间过滤（按时间从旧到新返回）"""
+        if count <= 0:
+            return []
+        if sender is None and since is None:
+            sql, params = self.SQL_RECENT, (role, count)
+        elif sender is None:
+            sql, params = self.SQL_RECENT_SINCE, (role, since, count)
+        elif since is None:
+            sql, params = self.SQL_RECENT_SENDER, (role, sender, count)
+        else:
+            sql, params = self.SQL_RECENT_SENDER_SINCE, (role, sender, since, count)
+        with self.lock:
+            rows = self.conn.execute(sql, params).fetchall()
+        rows.reverse()
+        return [self._to_record(row) for row in rows]
+
+    def tail(self, role, count):
+        """获取角色最近的count条记录（按时间从旧到新返回）"""
+        return self.recent(role, count)
+
+    def iter_records(self, role, batch_size=500):
+        """分批遍历角色的全部历史记录，不一次性载入内存"""
+        for _, record in self.iter_positioned(role, batch_size=batch_size):
+            yield record
+
+    def iter_positioned(self, role, after=None, batch_size=500):
+        """按时间顺序分批遍历记录及其行ID[(行ID, 记录)]
+
+        Args:
+            after: 从该行ID之后开始，None表示从头开始
+        """
+        last_id = after or 0
+        sql = "SELECT id, role, sender, question, response, timestamp, extra FROM chat_history WHERE role = ? AND id > ? ORDER BY id LIMIT ?"
+        while True:
+            with self.lock:
+                rows = self.conn.execute(sql, (role, last_id, batch_size)).fetchall()
+            if not rows:
+                return
+            for row in rows:
+                yield row[0], self._to_record(row)
+            last_id = rows[-1][0]
+
+    def read_at(self, role, positions):
+        """按行ID读取记录（用于检索结果）；行ID不存在或不属于该角色时对应项为None"""
+        if not positions:
+            return []
+        sql = (f"SELECT {self.COLUMNS} FROM chat_history WHERE role = ? AND id IN "
+               f"({','.join('?' * len(positions))})")
+        with self.lock:
+            rows = self.conn.execute(sql, (role, *positions)).fetchall()
+        by_id = {row[0]: self._to_record(row) for row in rows}
+        return [by_id.get(position) for position in positions]
+
+    def query(self, role=None, sender=None, since=None, until=None, limit=None):
+        """按角色、发送者和时间范围查询记录（用于分析），按时间从旧到新返回"""
+        conditions, params = [], []
+        for column, op, value in (('role', '=', role), ('sender', '=', sender),
+                                  ('timestamp', '>=', since), ('timestamp', '<', until)):
+            if value is not None:
+                conditions.append(f"{column} {op} ?")
+                params.append(value)
+        sql = f"SELECT {self.COLUMNS} FROM chat_history"
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        sql += " ORDER BY id"
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(limit)
+        with self.lock:
+            rows = self.conn.execute(sql, params).fetchall()
+        return [self._to_record(row) for row in rows]
+
+    def import_file(self, path, role=None):
+        """导入一个JSON数组或JSONL格式的历史文件，已导入过的文件会被跳过
+
+        Args:
+            path: 历史文件路径
+            role: 记录所属角色，为None时使用记录中的role字段
+
+        Returns:
+            int: 导入的对话轮数
+        """
+        key = os.path.abspath(path)
+        with self.lock:
+            if self.conn.execute("SELECT 1 FROM imported_files WHERE path = ?", (key,)).fetchone():
+                return 0
+
+        if path.endswith('.jsonl'):
+            records = list(iter_jsonl_file(path))
+        else:
+            records = load_json_history_file(path)
+
+        rows = [self._to_row(role or record.get('role', ''), record) for record in records]
+        with self.lock:
+            with self.conn:
+                self.conn.executemany(self.SQL_INSERT, rows)
+                self.conn.execute(
+                    "INSERT INTO imported_files (path, record_count, imported_at) VALUES (?, ?, ?)",
+                    (key, len(rows), datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+                )
+        logger.info(f"已将历史文件{path}导入SQLite数据库，共{len(rows)}轮对话", extra={'save_to_file': True})
+        return len(rows)
+
+    def migrate_legacy(self, role):
+        """导入该角色在历史目录中的JSON/JSONL文件（每个文件只导入一次）"""
+        imported = 0
+        stem = role_file_stem(role)
+        for extension in ('.json', '.jsonl'):
+            path = os.path.join(self.history_dir, stem + extension)
+            if os.path.exists(path):
+                imported += self.import_file(path, role)
+        return imported
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
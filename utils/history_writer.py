@@ -0,0 +1,230 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+对话历史后台写入模块
+add_chat只把记录放入有界队列，由后台线程合并后批量写入存储，主循环不再等待磁盘I/O
+"""
+
+import time
+import queue
+import threading
+from collections import deque
+from config import logger, Config
+
+FSYNC_POLICIES = ('always', 'interval', 'never')
+
+
+class HistoryWriter:
+    def __init__(self, store, on_written=None):
+        """初始化后台写入线程
+
+        Args:
+            store: 历史存储后端（JsonlHistoryStore或SqliteHistoryStore）
+            on_written: 每批记录写入后在后台线程中调用on_written(角色, 记录列表, 位置列表)，
+                位置为存储返回的字节偏移或行ID（用于更新检索索引）
+        """
+        if Config.HISTORY_WRITER_FSYNC not in FSYNC_POLICIES:
+            raise ValueError(f"不支持的fsync策略: {Config.HISTORY_WRITER_FSYNC}")
+
+        self.store = store
+        self.on_written = on_written
+        self.queue = queue.Queue(maxsize=Config.HISTORY_WRITER_QUEUE_SIZE)
+        self.flush_interval = Config.HISTORY_WRITER_FLUSH_INTERVAL
+        self.batch_size = Config.HISTORY_WRITER_BATCH_SIZE
+        self.fsync_policy = Config.HISTORY_WRITER_FSYNC
+        self.fsync_interval = Config.HISTORY_WRITER_FSYNC_INTERVAL
+        self.report_interval = Config.HISTORY_WRITER_REPORT_INTERVAL
+
+        # 每个角色已提交但尚未写入存储的记录数，读取前据此判断是否需要先刷新
+        self.pending = {}
+        self.pending_lock = threading.Lock()
+
+        # 统计信息
+        self.stats = {
+            "submitted": 0, "written": 0, "batches": 0, "fsyncs": 0,
+            "write_errors": 0, "dropped": 0, "queue_full_waits": 0, "max_queue_depth": 0
+        }
+        self.write_latencies = deque(maxlen=1000)
+
+        self.closed = False
+        self.thread = threading.Thread(target=self._run, name="HistoryWriter", daemon=True)
+        self.thread.start()
+
+    def submit(self, role, record):
+        """提交一轮对话，立即返回；队列已满时阻塞等待（反压），不丢弃历史"""
+        with self.pending_lock:
+            self.pending[role] = self.pending.get(role, 0) + 1
+            self.stats["submitted"] += 1
+        item = ('append', role, record)
+        try:
+            self.queue.put_nowait(item)
+        except queue.Full:
+            self.stats["queue_full_waits"] += 1
+            logger.warning(f"对话历史写入队列已满（{self.queue.maxsize}），等待后台写入", extra={'save_to_file': True})
+            self.queue.put(item)
+        depth = self.queue.qsize()
+        if depth > self.stats["max_queue_depth"]:
+            self.stats["max_queue_depth"] = depth
+
+    def has_pending(self, role):
+        with self.pending_lock:
+            return self.pending.get(role, 0) > 0
+
+    def pending_count(self, role):
+        """该角色已提交但尚未写入存储的记录数"""
+        with self.pending_lock:
+            return self.pending.get(role, 0)
+
+    def flush(self, timeout=None):
+        """等待队列中所有已提交的记录写入存储
+
+        Returns:
+            bool: 在超时前完成返回True
+        """
+        if self.closed:
+            return True
+        done = threading.Event()
+        self.queue.put(('flush', None, done))
+        return done.wait(timeout)
+
+    def flush_role(self, role, timeout=None):
+        """仅当该角色有未写入的记录时才刷新，用于读取存储之前"""
+        if self.has_pending(role):
+            return self.flush(timeout)
+        return True
+
+    def close(self, timeout=10):
+        """刷新剩余记录并停止后台线程"""
+        if self.closed:
+            return
+        done = threading.Event()
+        self.queue.put(('stop', None, done))
+        if not done.wait(timeout):
+            logger.error(f"对话历史后台写入线程在{timeout}秒内未完成，可能有记录未写入", extra={'save_to_file': True})
+        self.closed = True
+        logger.info(f"对话历史后台写入已停止，{self.format_stats()}", extra={'save_to_file': True})
+
+    def get_stats(self):
+        """返回写入统计：计数、当前队列深度和写入耗时分位数（毫秒）"""
+        stats = dict(self.stats)
+        stats["queue_depth"] = self.queue.qsize()
+        latencies = sorted(self.write_latencies)
+        if latencies:
+            stats["write_ms_avg"] = sum(latencies) / len(latencies) * 1000
+            stats["write_ms_p95"] = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] * 1000
+            stats["write_ms_max"] = latencies[-1] * 1000
+        return stats
+
+    def format_stats(self):
+        stats = self.get_stats()
+        text = (f"已写入{stats['written']}/{stats['submitted']}条，批次{stats['batches']}，"
+                f"队列深度{stats['queue_depth']}（峰值{stats['max_queue_depth']}），fsync {stats['fsyncs']}次，"
+                f"写入错误{stats['write_errors']}次")
+        if "write_ms_avg" in stats:
+            text += f"，写入耗时 平均{stats['write_ms_avg']:.1f}ms / p95 {stats['write_ms_p95']:.1f}ms / 最大{stats['write_ms_max']:.1f}ms"
+        return text
+
+    def _write_batch(self, batch, dirty_roles):
+        """将合并后的批次写入存储，每个角色一次写入；失败的记录留在batch中等待下次重试"""
+        for role in list(batch):
+            records = batch[role]
+            start = time.perf_counter()
+            try:
+                positions = self.store.append_many(role, records)
+                if self.fsync_policy == 'always':
+                    self.store.sync(role)
+                    self.stats["fsyncs"] += 1
+                elif self.fsync_policy == 'interval':
+                    dirty_roles.add(role)
+            except Exception as e:
+                self.stats["write_errors"] += 1
+                logger.error(f"后台写入角色{role}的对话历史失败: {e}", extra={'save_to_file': True})
+                # 失败的记录保留重试，但不超过队列容量，避免磁盘持续故障时无限增长
+                overflow = len(records) - self.queue.maxsize
+                if overflow > 0:
+                    del records[:overflow]
+                    self._mark_written(role, overflow)
+                    self.stats["dropped"] += overflow
+                    logger.error(f"丢弃角色{role}最早的{overflow}条未能写入的对话历史", extra={'save_to_file': True})
+                continue
+
+            self.write_latencies.append(time.perf_counter() - start)
+            self.stats["batches"] += 1
+            self.stats["written"] += len(records)
+            if self.on_written is not None:
+                try:
+                    self.on_written(role, records, positions)
+                except Exception as e:
+                    logger.error(f"处理角色{role}已写入的对话历史失败: {e}", extra={'save_to_file': True})
+            self._mark_written(role, len(records))
+            del batch[role]
+
+    def _mark_written(self, role, count):
+        with self.pending_lock:
+            self.pending[role] = max(0, self.pending.get(role, 0) - count)
+
+    def _sync_dirty(self, dirty_roles):
+        for role in list(dirty_roles):
+            try:
+                self.store.sync(role)
+                self.stats["fsyncs"] += 1
+            except Exception as e:
+                logger.error(f"同步角色{role}的对话历史到磁盘失败: {e}", extra={'save_to_file': True})
+        dirty_roles.clear()
+
+    def _run(self):
+        """后台线程：合并记录，达到批量大小、刷新间隔或收到刷新/停止请求时写入"""
+        batch = {}  # 角色 -> 待写入记录列表（保持提交顺序）
+        batch_count = 0
+        first_pending_at = None
+        dirty_roles = set()
+        last_fsync = time.monotonic()
+        last_report = time.monotonic()
+
+        while True:
+            now = time.monotonic()
+            timeouts = []
+            if first_pending_at is not None:
+                timeouts.append(first_pending_at + self.flush_interval - now)
+            if dirty_roles and self.fsync_policy == 'interval':
+                timeouts.append(last_fsync + self.fsync_interval - now)
+            if self.report_interval > 0:
+                timeouts.append(last_report + self.report_interval - now)
+            timeout = max(0.0, min(timeouts)) if timeouts else None
+
+            try:
+                kind, role, payload = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                kind, role, payload = None, None, None
+
+            if kind == 'append':
+                batch.setdefault(role, []).append(payload)
+                batch_count += 1
+                if first_pending_at is None:
+                    first_pending_at = time.monotonic()
+
+            now = time.monotonic()
+            should_write = batch and (
+                kind in ('flush', 'stop')
+                or batch_count >= self.batch_size
+                or now - first_pending_at >= self.flush_interval
+            )
+            if should_write:
+                self._write_batch(batch, dirty_roles)
+                batch_count = sum(len(records) for records in batch.values())
+                first_pending_at = time.monotonic() if batch else None
+
+            if dirty_roles and (kind in ('flush', 'stop') or
+                                (self.fsync_policy == 'interval' and now - last_fsync >= self.fsync_interval)):
+                self._sync_dirty(dirty_roles)
+                last_fsync = now
+
+            if self.report_interval > 0 and now - last_report >= self.report_interval:
+                logger.info(f"对话历史后台写入统计: {self.format_stats()}", extra={'save_to_file': True})
+                last_report = now
+
+            if kind in ('flush', 'stop'):
+                payload.set()
+                if kind == 'stop':
+                    return
@@ -0,0 +1,30 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+图像差异模块
+比较两次截图（灰度）是否有明显变化，用于发送确认和帧差异检测。
+不依赖win32，可在无桌面环境中使用。
+"""
+
+import cv2
+import numpy as np
+from config import Config
+
+
+def gray_thumbnail(image, step=4):
+    """将BGR截图转换为灰度并按step间隔降采样，用于快速比较"""
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+    return gray[::step, ::step]
+
+
+def regions_differ(before, after, threshold=None):
+    """比较两次区域截图（灰度）是否有明显变化
+
+    Returns:
+        bool: 平均像素差超过阈值（或尺寸不同）时返回True
+    """
+    threshold = Config.SEND_REGION_CHANGE_THRESHOLD if threshold is None else threshold
+    if before.shape != after.shape:
+        return True
+    return float(np.mean(cv2.absdiff(before, after))) > threshold
@@ -0,0 +1,253 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+运行指标模块
+记录各处理阶段的耗时直方图（截图、帧差异、OCR、窗口检查、触发词检测、发送者推断、重复检查、排队等待、API请求、发送）
+以及帧数、@消息数、回复数、错误数等计数器。
+指标以Prometheus文本格式通过本机HTTP端口提供，并定期输出一行汇总日志（各阶段平均值和p50/p95/p99）。
+"""
+
+import time
+import threading
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from config import logger, Config
+
+METRIC_PREFIX = "wechatbot"
+
+# 阶段耗时直方图的桶上限（秒），覆盖从毫秒级的检测到数十秒的API请求
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# 汇总日志中各阶段的顺序，未列出的阶段排在后面
+STAGE_ORDER = ("capture", "frame_diff", "ocr", "ocr_server_queue", "ocr_server_inference", "window_check", "text_diff", "detect", "sender_inference",
+               "duplicate_check", "queue_wait", "history_retrieval", "api", "send", "mention_to_reply")
+
+
+def percentile(sorted_values, fraction):
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in labels) + "}"
+
+
+class Counter:
+    def __init__(self, name, help_text):
+        """单调递增的计数器，可按标签区分（如按阶段统计错误数）"""
+        self.name = name
+        self.help = help_text
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, value=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + value
+
+    def total(self):
+        with self.lock:
+            return sum(self.values.values())
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self.lock:
+            items = sorted(self.values.items())
+        for labels, value in items:
+            lines.append(f"{self.name}{format_labels(labels)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help_text, buckets=DEFAULT_BUCKETS, sample_size=1000):
+        """耗时直方图（秒），按标签区分；同时保留最近sample_size个样本用于计算汇总日志中的分位数"""
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(buckets)
+        self.sample_size = sample_size
+        # 标签 -> [各桶计数, 总数, 总和, 最近样本]
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def observe(self, seconds, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            series = self.series.get(key)
+            if series is None:
+                series = self.series[key] = [[0] * len(self.buckets), 0, 0.0, deque(maxlen=self.sample_size)]
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    series[0][i] += 1
+                    break
+            series[1] += 1
+            series[2] += seconds
+            series[3].append(seconds)
+
+    def snapshot(self):
+        """返回 {标签: (总数, 总和, 排序后的最近样本)}"""
+        with self.lock:
+            return {key: (series[1], series[2], sorted(series[3])) for key, series in self.series.items()}
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            items = sorted((key, list(series[0]), series[1], series[2]) for key, series in self.series.items())
+        for labels, bucket_counts, count, total in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, bucket_counts):
+                cumulative += bucket_count
+                lines.append(f"{self.name}_bucket{format_labels(labels + (('le', bound),))} {cumulative}")
+            lines.append(f"{self.name}_bucket{format_labels(labels + (('le', '+Inf'),))} {count}")
+            lines.append(f"{self.name}_sum{format_labels(labels)} {total:.6f}")
+            lines.append(f"{self.name}_count{format_labels(labels)} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        """指标注册表，模块级单例为metrics"""
+        self.started_at = time.time()
+        self.stage_latency = Histogram(f"{METRIC_PREFIX}_stage_duration_seconds", "各处理阶段耗时（秒）")
+        self.counters = {}
+        # 采集回调：返回[(指标名, 类型, 说明, 值)]，用于导出各组件自己维护的统计（如缓存命中数）
+        self.collectors = []
+        self.reporter_thread = None
+        self.stop_event = threading.Event()
+
+    def counter(self, name, help_text=""):
+        """获取（不存在时创建）计数器，名称不含前缀和_total后缀"""
+        counter = self.counters.get(name)
+        if counter is None:
+            counter = self.counters.setdefault(name, Counter(f"{METRIC_PREFIX}_{name}_total", help_text or name))
+        return counter
+
+    def inc(self, name, value=1, **labels):
+        self.counter(name).inc(value, **labels)
+
+    def observe_stage(self, stage, ms):
+        """记录一个阶段的耗时（毫秒，与各模块timings一致）"""
+        self.stage_latency.observe(ms / 1000, stage=stage)
+
+    @contextmanager
+    def timer(self, stage):
+        """记录with代码块的耗时"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe_stage(stage, (time.perf_counter() - start) * 1000)
+
+    def add_collector(self, callback):
+        self.collectors.append(callback)
+
+    def render_prometheus(self):
+        """生成Prometheus文本格式（0.0.4）的全部指标"""
+        lines = [f"# HELP {METRIC_PREFIX}_uptime_seconds 运行时间（秒）",
+                 f"# TYPE {METRIC_PREFIX}_uptime_seconds gauge",
+                 f"{METRIC_PREFIX}_uptime_seconds {time.time() - self.started_at:.1f}"]
+        lines += self.stage_latency.render()
+        for name in sorted(self.counters):
+            lines += self.counters[name].render()
+        for callback in self.collectors:
+            try:
+                collected = callback()
+            except Exception as e:
+                logger.debug(f"采集指标失败: {e}")
+                continue
+            for name, kind, help_text, value in collected:
+                full_name = f"{METRIC_PREFIX}_{name}"
+                lines += [f"# HELP {full_name} {help_text}", f"# TYPE {full_name} {kind}", f"{full_name} {value}"]
+        return "\n".join(lines) + "\n"
+
+    def format_summary(self):
+        """汇总日志：计数器总数和各阶段耗时（毫秒）"""
+        parts = [f"{name}={self.counters[name].total()}" for name in sorted(self.counters)]
+        snapshot = {dict(labels).get("stage"): values for labels, values in self.stage_latency.snapshot().items()}
+        order = {stage: i for i, stage in enumerate(STAGE_ORDER)}
+        for stage in sorted(snapshot, key=lambda s: (order.get(s, len(order)), s)):
+            count, total, samples = snapshot[stage]
+            if not samples:
+                continue
+            parts.append(f"{stage} n={count} 平均{total / count * 1000:.1f}ms p50 {percentile(samples, 0.5) * 1000:.1f}ms "
+                         f"p95 {percentile(samples, 0.95) * 1000:.1f}ms p99 {percentile(samples, 0.99) * 1000:.1f}ms")
+        return "，".join(parts) if parts else "暂无数据"
+
+    def log_summary(self):
+        logger.info(f"运行指标: {self.format_summary()}", extra={'save_to_file': True})
+
+    def start_reporter(self, interval):
+        """启动后台线程，每interval秒输出一次汇总日志（同步主循环使用，异步运行时用定期任务代替）"""
+        if self.reporter_thread is not None or interval <= 0:
+            return
+
+        def report():
+            while not self.stop_event.wait(interval):
+                self.log_summary()
+
+        self.reporter_thread = threading.Thread(target=report, name="MetricsReporter", daemon=True)
+        self.reporter_thread.start()
+
+    def stop_reporter(self):
+        self.stop_event.set()
+
+
+# 全局指标注册表
+metrics = MetricsRegistry()
+
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+    registry = metrics
+
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/metrics', '/'):
+            self.send_error(404)
+            return
+        body = self.registry.render_prometheus().encode('utf-8')
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # 抓取请求很频繁，不写入日志
+        pass
+
+
+class MetricsServer:
+    def __init__(self, registry=None, host=None, port=None):
+        """Prometheus文本格式的指标HTTP服务，默认只监听本机"""
+        handler = type("BoundMetricsRequestHandler", (MetricsRequestHandler,), {"registry": registry or metrics})
+        self.server = ThreadingHTTPServer((host or Config.METRICS_HOST, Config.METRICS_PORT if port is None else port), handler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, name="MetricsServer", daemon=True)
+
+    @property
+    def address(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}/metrics"
+
+    def start(self):
+        self.thread.start()
+        logger.info(f"运行指标已发布在 {self.address}", extra={'save_to_file': True})
+        return self
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def start_metrics_server(registry=None):
+    """按配置启动指标服务，端口被占用等错误不影响机器人运行
+
+    Returns:
+        MetricsServer: 启动失败时返回None
+    """
+    try:
+        return MetricsServer(registry).start()
+    except OSError as e:
+        logger.error(f"启动运行指标服务失败（{Config.METRICS_HOST}:{Config.METRICS_PORT}）: {e}", extra={'save_to_file': True})
+        return None
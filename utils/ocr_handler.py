@@ -6,18 +6,53 @@ OCR处理模块
 处理图像文字识别相关功能
 """
 
+import time
 import logging
-from paddleocr import PaddleOCR
 from config import logger, Config
+from config.logger import ocr_logger, LOG_OCR_SAMPLE_FRAMES
+from utils.ocr_watchdog import OCRWatchdog, recycle_engine
+
+
+def create_ocr_engine():
+    """创建PaddleOCR引擎（本进程识别和OCR服务共用）"""
+    logger.info("正在初始化PaddleOCR引擎...", extra={'save_to_file': True})
+    # 延迟导入PaddleOCR，回放追踪等使用替代引擎的场景无需加载
+    from paddleocr import PaddleOCR
+    engine = PaddleOCR(use_angle_cls=True, lang="ch", use_gpu=False)
+    logger.info("PaddleOCR引擎初始化完成", extra={'save_to_file': True})
+    return engine
+
+
+def create_default_engine():
+    """创建机器人使用的OCR引擎：Config.OCR_SERVER_ENABLED为True时使用本机OCR服务，否则在本进程中创建PaddleOCR引擎"""
+    if Config.OCR_SERVER_ENABLED:
+        from utils.ocr_server import RemoteOCREngine
+        return RemoteOCREngine()
+    return create_ocr_engine()
+
 
 class OCRHandler:
-    def __init__(self):
-        """初始化OCR处理器"""
-        logger.info("正在初始化PaddleOCR引擎...", extra={'save_to_file': True})
-        self.ocr = PaddleOCR(use_angle_cls=True, lang="ch", use_gpu=False)
+    def __init__(self, engine=None, engine_factory=None):
+        """初始化OCR处理器
+
+        Args:
+            engine: OCR引擎，需提供与PaddleOCR相同的ocr(image, cls=True)接口；默认由engine_factory创建
+            engine_factory: 无参函数，返回OCR引擎，健康检查发现引擎异常时用它重新创建引擎；
+                默认为create_default_engine（本机OCR服务或PaddleOCR），只传入engine时不会重新创建
+        """
+        if engine is None:
+            engine_factory = engine_factory or create_default_engine
+            engine = engine_factory()
+        self.ocr = engine
+        self.engine_factory = engine_factory
+        # 引擎健康检查（utils/ocr_watchdog.py），识别连续失败、耗时或内存增长过多时重新创建引擎
+        self.watchdog = OCRWatchdog("OCR引擎") if Config.OCR_WATCHDOG_ENABLED and engine_factory else None
         # 存储最近识别的文本结果，用于推断消息发送者
         self.last_recognized_texts = []
-        logger.info("PaddleOCR引擎初始化完成", extra={'save_to_file': True})
+        # 最近一帧未经置信度过滤的原始识别结果，供追踪记录使用
+        self.last_raw_lines = []
+        # 已识别的帧数，用于按间隔输出OCR摘要
+        self.frame_count = 0
         
     def detect_wechat_window_name(self, texts):
         """检测OCR识别结果中是否包含微信窗口名称或其别名"""
@@ -38,34 +73,69 @@ class OCRHandler:
     
     def recognize_text(self, image):
         """使用PaddleOCR识别图像中的文字"""
+        self.last_raw_lines = []
         if image is None:
             return []
         
+        start = time.perf_counter()
         try:
             result = self.ocr.ocr(image, cls=True)
-            if result is None or len(result) == 0:
+        except Exception as e:
+            logger.error(f"OCR识别失败: {e}", extra={'save_to_file': True})
+            self._watch(start, e)
+            return []
+        self._watch(start, lines=len(result[0]) if result and result[0] else 0)
+
+        try:
+            if result is None or len(result) == 0 or not result[0]:
                 return []
+            self.last_raw_lines = result[0]
             
             # PaddleOCR返回格式: [[[x1,y1], [x2,y2], [x3,y3], [x4,y4]], [text, confidence]]
             texts = []
+            # 逐行日志只在开启OCR调试时输出，避免每帧在主循环中格式化和写入大量日志
+            debug_enabled = ocr_logger.isEnabledFor(logging.DEBUG)
             
             for line in result[0]:
                 text, confidence = line[1]
-                logger.info(f"OCR识别: '{text}', 置信度: {confidence:.4f}")
+                if debug_enabled:
+                    ocr_logger.debug(f"OCR识别: '{text}', 置信度: {confidence:.4f}")
 
                 if confidence >= Config.OCR_CONFIDENCE_THRESHOLD:
                     texts.append((text, confidence, line[0]))  # 文本、置信度、位置
 
+            self.frame_count += 1
+            if LOG_OCR_SAMPLE_FRAMES > 0 and self.frame_count % LOG_OCR_SAMPLE_FRAMES == 0:
+                ocr_logger.info(f"OCR第{self.frame_count}帧: 识别{len(result[0])}行，置信度达标{len(texts)}行，"
+                                f"末行: '{texts[-1][0] if texts else ''}'")
+
             # 保存当前识别结果，用于下次推断发送者
             self.last_recognized_texts = texts.copy()
 
             # 只返回处理后的文本列表
             return texts
         except Exception as e:
-            logger.error(f"OCR识别失败: {e}", extra={'save_to_file': True})
+            logger.error(f"OCR识别结果解析失败: {e}", extra={'save_to_file': True})
             # 返回空列表表示失败
             return []
     
+    def _watch(self, start, error=None, lines=None):
+        """记录本帧识别结果，健康检查发现异常时重新创建引擎（识别线程中进行，期间不识别新帧）"""
+        if self.watchdog is None:
+            return
+        self.watchdog.record((time.perf_counter() - start) * 1000, error, lines)
+        problem = self.watchdog.check()
+        if problem is not None:
+            self.ocr = recycle_engine(self.watchdog, self.ocr, self.engine_factory, *problem)
+    
+    def close(self):
+        """退出前调用：断开OCR服务连接并释放共享内存（引擎支持时）"""
+        if self.watchdog is not None:
+            logger.info(f"OCR引擎健康检查统计: {self.watchdog.format_stats()}", extra={'save_to_file': True})
+        close = getattr(self.ocr, "close", None)
+        if close is not None:
+            close()
+    
     def is_next_line(self, current_pos, next_pos):
         """判断next_pos是否是current_pos的下一行"""
         # 获取当前行的y坐标范围
@@ -78,30 +148,38 @@ class OCRHandler:
         # 如果下一行的y坐标大于当前行的最大y坐标，则认为是下一行
         return next_y_min > current_y_max
     
-    def infer_sender_name(self):
-        """根据上一次OCR识别结果推断可能的发送者名称"""
-        if not self.last_recognized_texts:
+    def infer_sender_name(self, role_index=None, texts=None, trigger_index=None):
+        """根据上一次OCR识别结果推断可能的发送者名称
+
+        Args:
+            role_index: 用于查找触发词的角色索引，默认使用当前的角色注册表
+            texts: 在这些文本行中推断（如文本差异比较后的新行及其上下文），默认为上一次OCR识别的全部结果
+            trigger_index: 触发词所在行在texts中的位置（一帧中有多条@消息时逐条推断），
+                为None时使用第一条包含触发词的行
+        """
+        recognized_texts = self.last_recognized_texts if texts is None else texts
+        if not recognized_texts:
             logger.info("没有上一次OCR识别结果，无法推断发送者名称", extra={'save_to_file': True})
             return None
         
+        role_index = role_index or Config.ROLE_REGISTRY.index
+        
         # 查找当前OCR结果中包含触发词的项
-        trigger_index = -1
-        for index, (text, _, _) in enumerate(self.last_recognized_texts):
-            # 检查是否包含任何角色的触发词
-            for role in Config.ROLES:
-                if role["name"] in text or any(alias in text for alias in role["aliases"]):
+        if trigger_index is None:
+            trigger_index = -1
+            for index, (text, _, _) in enumerate(recognized_texts):
+                # 检查是否包含任何角色的触发词
+                if role_index.find_trigger(text)[0]:
                     trigger_index = index
                     break
-            if trigger_index != -1:
-                break
         
         if trigger_index == -1 or trigger_index == 0:
             logger.info("无法在OCR结果中找到触发词或触发词位于第一项，使用默认推断方式", extra={'save_to_file': True})
             # 退回到原来的方法：使用第一项作为可能的发送者
-            possible_sender = self.last_recognized_texts[0][0]
+            possible_sender = recognized_texts[0][0]
         else:
             # 使用触发词上一条消息作为发送者名称
-            possible_sender = self.last_recognized_texts[trigger_index - 1][0]
+            possible_sender = recognized_texts[trigger_index - 1][0]
             
         logger.info(f"从上一次OCR识别结果推断可能的发送者名称: '{possible_sender}'", extra={'save_to_file': True})
         
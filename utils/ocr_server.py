@@ -0,0 +1,524 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+本机OCR服务模块
+同一台电脑上为多个群分别运行机器人进程时，每个进程各加载一份PaddleOCR会占用大量内存和CPU。
+OCR服务在本机的TCP端口或Unix套接字上只加载一组PaddleOCR引擎，各机器人进程通过RemoteOCREngine把截图发给它识别。
+截图可以以压缩图片（png/jpeg）或共享内存（shm，不需要编码和复制数据）的方式传输，
+返回与PaddleOCR相同格式的识别结果（置信度过滤仍在各机器人进程中按自己的配置进行）。
+服务端会把多个客户端同时提交的帧合并为一批交给空闲的引擎，并统计排队和识别耗时。
+
+启动服务：
+    python -m utils.ocr_server
+    python -m utils.ocr_server --address unix:/tmp/wechatbot-ocr.sock --workers 2
+机器人进程中设置 OCR_SERVER_ENABLED = True 即可使用；服务不可用时自动改为在本进程中识别。
+"""
+
+import os
+import sys
+import json
+import time
+import queue
+import socket
+import struct
+import argparse
+import threading
+from collections import deque
+
+import cv2
+import numpy as np
+
+from config import logger, Config
+from utils.metrics import metrics
+from utils.ocr_watchdog import OCRWatchdog, recycle_engine
+
+# 消息格式：头部长度和数据长度（各4字节，大端），JSON头部，数据
+FRAME_HEADER = struct.Struct(">II")
+TRANSPORTS = ("shm", "png", "jpeg", "raw")
+# 本进程创建的共享内存块名称（客户端与服务在同一进程中时，打开时不能取消登记）
+_created_blocks = set()
+
+
+def parse_address(address):
+    """解析服务地址："unix:/路径" 为Unix套接字，"主机:端口" 为TCP
+
+    Returns:
+        tuple: (地址族, 地址)
+    """
+    if address.startswith("unix:"):
+        if not hasattr(socket, "AF_UNIX"):
+            raise ValueError(f"当前系统不支持Unix套接字: {address}")
+        return socket.AF_UNIX, address[len("unix:"):]
+    host, _, port = address.rpartition(":")
+    return socket.AF_INET, (host or "127.0.0.1", int(port))
+
+
+def send_message(sock, header, payload=b""):
+    data = json.dumps(header, ensure_ascii=False).encode("utf-8")
+    sock.sendall(FRAME_HEADER.pack(len(data), len(payload)) + data + payload)
+
+
+def _recv_exactly(sock, size):
+    chunks = []
+    while size > 0:
+        chunk = sock.recv(min(size, 1 << 20))
+        if not chunk:
+            raise ConnectionError("连接已关闭")
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b"".join(chunks)
+
+
+def recv_message(sock):
+    """读取一条消息，返回(头部dict, 数据bytes)"""
+    header_size, payload_size = FRAME_HEADER.unpack(_recv_exactly(sock, FRAME_HEADER.size))
+    header = json.loads(_recv_exactly(sock, header_size).decode("utf-8"))
+    payload = _recv_exactly(sock, payload_size) if payload_size else b""
+    return header, payload
+
+
+def attach_shared_memory(name):
+    """打开客户端创建的共享内存块（由客户端负责释放）"""
+    from multiprocessing import shared_memory
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # Python 3.13之前打开已有的共享内存也会被登记，进程退出时会被误删，这里取消登记
+        block = shared_memory.SharedMemory(name=name)
+        if os.name == "posix" and block._name not in _created_blocks:
+            from multiprocessing import resource_tracker
+            resource_tracker.unregister(block._name, "shared_memory")
+        return block
+
+
+def decode_frame(header, payload):
+    """按请求头部还原截图（numpy数组）"""
+    kind = header.get("transport")
+    if kind in ("png", "jpeg"):
+        image = cv2.imdecode(np.frombuffer(payload, np.uint8), cv2.IMREAD_UNCHANGED)
+        if image is None:
+            raise ValueError("无法解码图片")
+        return image
+    shape, dtype = tuple(header["shape"]), np.dtype(header["dtype"])
+    if kind == "raw":
+        return np.frombuffer(payload, dtype).reshape(shape).copy()
+    if kind == "shm":
+        block = attach_shared_memory(header["shm_name"])
+        try:
+            return np.ndarray(shape, dtype, buffer=block.buf).copy()
+        finally:
+            block.close()
+    raise ValueError(f"不支持的传输方式: {kind}")
+
+
+def serialize_lines(result):
+    """将PaddleOCR的识别结果转为可JSON序列化的列表：[[位置, [文本, 置信度]], ...]"""
+    if not result or not result[0]:
+        return []
+    return [[[[float(x), float(y)] for x, y in box], [str(text), float(confidence)]]
+            for box, (text, confidence) in result[0]]
+
+
+class OCRRequest:
+    __slots__ = ('image', 'enqueued_at', 'done', 'lines', 'error', 'queue_ms', 'inference_ms', 'batch_size')
+
+    def __init__(self, image):
+        """服务端的一个待识别帧"""
+        self.image = image
+        self.enqueued_at = time.perf_counter()
+        self.done = threading.Event()
+        self.lines = None
+        self.error = None
+        self.queue_ms = 0.0
+        self.inference_ms = 0.0
+        self.batch_size = 1
+
+
+class OCRServer:
+    def __init__(self, engine_factory=None, address=None, workers=None, batch_size=None, batch_wait_ms=None):
+        """初始化OCR服务
+
+        Args:
+            engine_factory: 无参函数，返回OCR引擎（需提供ocr(image, cls=True)），默认创建PaddleOCR引擎；
+                每个工作线程使用一个引擎，引擎提供ocr_batch(images)时整批调用，否则批内逐帧识别
+            address: 监听地址，默认Config.OCR_SERVER_ADDRESS
+        """
+        from utils.ocr_handler import create_ocr_engine
+        self.engine_factory = engine_factory or create_ocr_engine
+        self.address = address or Config.OCR_SERVER_ADDRESS
+        self.workers = workers or Config.OCR_SERVER_WORKERS
+        self.batch_size = max(1, batch_size or Config.OCR_SERVER_BATCH_SIZE)
+        self.batch_wait = (Config.OCR_SERVER_BATCH_WAIT_MS if batch_wait_ms is None else batch_wait_ms) / 1000
+        self.requests = queue.Queue()
+        self.stop_event = threading.Event()
+        self.threads = []
+        self.listener = None
+
+        self.lock = threading.Lock()
+        self.stats = {"requests": 0, "errors": 0, "timeouts": 0, "batches": 0, "clients": 0, "active_clients": 0, "recycles": 0}
+        self.queue_times = deque(maxlen=1000)
+        self.inference_times = deque(maxlen=1000)
+        self.batch_sizes = deque(maxlen=1000)
+
+    def start(self):
+        """加载引擎、开始监听并启动工作线程"""
+        engines = [self.engine_factory() for _ in range(self.workers)]
+        family, address = parse_address(self.address)
+        if family == getattr(socket, "AF_UNIX", None) and os.path.exists(address):
+            # 上次运行遗留的套接字文件
+            os.unlink(address)
+        self.listener = socket.socket(family, socket.SOCK_STREAM)
+        if family == socket.AF_INET:
+            self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.listener.bind(address)
+        self.listener.listen()
+        self.listener.settimeout(0.5)
+        if family == socket.AF_INET:
+            self.address = "%s:%d" % self.listener.getsockname()[:2]
+
+        for i, engine in enumerate(engines):
+            self._start_thread(self._work, f"OCRWorker-{i}", engine, i)
+        self._start_thread(self._accept, "OCRServerAccept")
+        if Config.OCR_SERVER_STATS_INTERVAL > 0:
+            self._start_thread(self._report, "OCRServerStats")
+        logger.info(f"OCR服务已启动: {self.address}，{self.workers}个引擎，每批最多{self.batch_size}帧", extra={'save_to_file': True})
+        return self
+
+    def _start_thread(self, target, name, *args):
+        thread = threading.Thread(target=target, args=args, name=name, daemon=True)
+        thread.start()
+        self.threads.append(thread)
+
+    def serve_forever(self):
+        """运行直到Ctrl+C"""
+        try:
+            while not self.stop_event.wait(1):
+                pass
+        except KeyboardInterrupt:
+            logger.info("收到中断信号，OCR服务正在停止...", extra={'save_to_file': True})
+        finally:
+            self.close()
+
+    def close(self):
+        if self.stop_event.is_set():
+            return
+        self.stop_event.set()
+        # 仍在排队的请求不会再被识别，立即返回错误，客户端改为在本进程中识别
+        self._fail_queued("OCR服务已停止")
+        for _ in range(self.workers):
+            self.requests.put(None)
+        if self.listener:
+            self.listener.close()
+            family, address = parse_address(self.address)
+            if family == getattr(socket, "AF_UNIX", None) and os.path.exists(address):
+                os.unlink(address)
+        logger.info(f"OCR服务已停止，{self.format_stats()}", extra={'save_to_file': True})
+
+    def _fail_queued(self, error):
+        """取出队列中所有等待识别的请求并以error结束"""
+        while True:
+            try:
+                request = self.requests.get_nowait()
+            except queue.Empty:
+                return
+            if request is not None:
+                request.error = error
+                request.done.set()
+
+    def _accept(self):
+        while not self.stop_event.is_set():
+            try:
+                conn, _ = self.listener.accept()
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+            conn.settimeout(None)
+            with self.lock:
+                self.stats["clients"] += 1
+                self.stats["active_clients"] += 1
+            threading.Thread(target=self._serve_client, args=(conn,), name="OCRServerClient", daemon=True).start()
+
+    def _serve_client(self, conn):
+        """处理一个客户端的请求，每个客户端同一时间只有一个请求"""
+        try:
+            while not self.stop_event.is_set():
+                try:
+                    header, payload = recv_message(conn)
+                except (ConnectionError, OSError):
+                    break
+                kind = header.get("kind")
+                if kind == "ping":
+                    send_message(conn, {"ok": True})
+                elif kind == "stats":
+                    send_message(conn, {"ok": True, "stats": self.get_stats()})
+                elif kind == "ocr":
+                    send_message(conn, self._recognize(header, payload))
+                else:
+                    send_message(conn, {"ok": False, "error": f"未知请求: {kind}"})
+        except OSError as e:
+            logger.debug(f"OCR服务客户端连接出错: {e}")
+        finally:
+            conn.close()
+            with self.lock:
+                self.stats["active_clients"] -= 1
+
+    def _recognize(self, header, payload):
+        try:
+            request = OCRRequest(decode_frame(header, payload))
+        except Exception as e:
+            with self.lock:
+                self.stats["errors"] += 1
+            return {"ok": False, "error": f"无法读取截图: {e}"}
+        if self.stop_event.is_set():
+            return {"ok": False, "error": "OCR服务已停止"}
+        self.requests.put(request)
+        if not request.done.wait(Config.OCR_SERVER_TIMEOUT):
+            # 工作线程卡在识别中或已停止；标记为已结束，仍在队列中的请求不会再被识别
+            request.error = f"识别超时（{Config.OCR_SERVER_TIMEOUT}秒）"
+            request.done.set()
+            with self.lock:
+                self.stats["errors"] += 1
+                self.stats["timeouts"] += 1
+            return {"ok": False, "error": request.error}
+        if request.error:
+            return {"ok": False, "error": request.error}
+        return {"ok": True, "lines": request.lines, "queue_ms": request.queue_ms,
+                "inference_ms": request.inference_ms, "batch_size": request.batch_size}
+
+    def _collect_batch(self, first):
+        """取出与first同时等待的请求（最多batch_size个），最多额外等待batch_wait秒"""
+        batch = [first]
+        deadline = time.perf_counter() + self.batch_wait
+        while len(batch) < self.batch_size:
+            try:
+                remaining = deadline - time.perf_counter()
+                item = self.requests.get(timeout=remaining) if remaining > 0 else self.requests.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                # 停止信号留给其他工作线程（或本线程的下一轮）
+                self.requests.put(None)
+                break
+            batch.append(item)
+        return batch
+
+    def _work(self, engine, index):
+        ocr_batch = getattr(engine, "ocr_batch", None)
+        # 每个引擎各自做健康检查，异常时在本工作线程中重新创建，不需要重启服务，客户端的连接也不受影响
+        watchdog = OCRWatchdog(f"OCR服务引擎{index}") if Config.OCR_WATCHDOG_ENABLED else None
+        while True:
+            first = self.requests.get()
+            if first is None:
+                break
+            # 已超时的请求客户端不再等待，不做识别
+            batch = [request for request in self._collect_batch(first) if not request.done.is_set()]
+            if not batch:
+                continue
+            start = time.perf_counter()
+            for request in batch:
+                request.queue_ms = (start - request.enqueued_at) * 1000
+                request.batch_size = len(batch)
+            try:
+                if ocr_batch is not None:
+                    results = ocr_batch([request.image for request in batch])
+                    for request, result in zip(batch, results):
+                        request.lines = serialize_lines(result)
+                    elapsed = (time.perf_counter() - start) * 1000
+                    for request in batch:
+                        request.inference_ms = elapsed / len(batch)
+                else:
+                    for request in batch:
+                        item_start = time.perf_counter()
+                        try:
+                            request.lines = serialize_lines(engine.ocr(request.image, cls=True))
+                        except Exception as e:
+                            request.error = f"识别失败: {e}"
+                        request.inference_ms = (time.perf_counter() - item_start) * 1000
+            except Exception as e:
+                for request in batch:
+                    request.error = f"识别失败: {e}"
+            with self.lock:
+                self.stats["batches"] += 1
+                self.stats["requests"] += len(batch)
+                self.batch_sizes.append(len(batch))
+                for request in batch:
+                    if request.error:
+                        self.stats["errors"] += 1
+                    self.queue_times.append(request.queue_ms)
+                    self.inference_times.append(request.inference_ms)
+            for request in batch:
+                request.image = None
+                request.done.set()
+            if watchdog is not None:
+                for request in batch:
+                    watchdog.record(request.inference_ms, request.error, len(request.lines or ()))
+                problem = watchdog.check()
+                if problem is not None:
+                    new_engine = recycle_engine(watchdog, engine, self.engine_factory, *problem)
+                    if new_engine is not engine:
+                        engine = new_engine
+                        ocr_batch = getattr(engine, "ocr_batch", None)
+                        with self.lock:
+                            self.stats["recycles"] += 1
+
+    def _report(self):
+        while not self.stop_event.wait(Config.OCR_SERVER_STATS_INTERVAL):
+            logger.info(f"OCR服务统计: {self.format_stats()}", extra={'save_to_file': True})
+
+    def get_stats(self):
+        with self.lock:
+            stats = dict(self.stats)
+            stats["queue_depth"] = self.requests.qsize()
+            for name, samples in (("queue_ms", self.queue_times), ("inference_ms", self.inference_times)):
+                values = sorted(samples)
+                if values:
+                    stats[f"{name}_avg"] = round(sum(values) / len(values), 2)
+                    stats[f"{name}_p95"] = round(values[min(len(values) - 1, int(len(values) * 0.95))], 2)
+            if self.batch_sizes:
+                stats["batch_size_avg"] = round(sum(self.batch_sizes) / len(self.batch_sizes), 2)
+        return stats
+
+    def format_stats(self):
+        stats = self.get_stats()
+        text = (f"识别{stats['requests']}帧（{stats['batches']}批，平均每批{stats.get('batch_size_avg', 0)}帧），"
+                f"出错{stats['errors']}次（超时{stats['timeouts']}次），重新创建引擎{stats['recycles']}次，客户端{stats['active_clients']}个（累计{stats['clients']}个）")
+        if "queue_ms_avg" in stats:
+            text += (f"，排队平均{stats['queue_ms_avg']:.1f}ms / p95 {stats['queue_ms_p95']:.1f}ms"
+                     f"，识别平均{stats['inference_ms_avg']:.1f}ms / p95 {stats['inference_ms_p95']:.1f}ms")
+        return text
+
+
+class RemoteOCREngine:
+    def __init__(self, address=None, transport=None, fallback_factory=None):
+        """OCR服务的客户端，提供与PaddleOCR相同的ocr(image, cls=True)接口，可直接作为OCRHandler的引擎
+
+        服务不可用（未启动、连接断开、超时或返回错误）时改为在本进程中识别，
+        每隔OCR_SERVER_RETRY_INTERVAL秒重新尝试连接服务。本进程的引擎在第一次需要时才加载。
+
+        Args:
+            address: 服务地址，默认Config.OCR_SERVER_ADDRESS
+            transport: 截图传输方式（shm/png/jpeg/raw），默认Config.OCR_SERVER_TRANSPORT
+            fallback_factory: 无参函数，返回本进程使用的OCR引擎，默认创建PaddleOCR引擎
+        """
+        from utils.ocr_handler import create_ocr_engine
+        self.address = address or Config.OCR_SERVER_ADDRESS
+        self.transport = transport or Config.OCR_SERVER_TRANSPORT
+        if self.transport not in TRANSPORTS:
+            raise ValueError(f"不支持的传输方式: {self.transport}")
+        self.fallback_factory = fallback_factory or create_ocr_engine
+        self.fallback_engine = None
+        self.sock = None
+        self.shm = None
+        # 在此时间之前不再尝试连接服务（time.monotonic()）
+        self.retry_at = 0.0
+        self.lock = threading.Lock()
+        self.stats = {"remote": 0, "local": 0, "failures": 0}
+
+    def ocr(self, image, cls=True):
+        with self.lock:
+            if time.monotonic() >= self.retry_at:
+                try:
+                    lines = self._request(image)
+                    self.stats["remote"] += 1
+                    return [lines]
+                except (OSError, ValueError, RuntimeError) as e:
+                    self.stats["failures"] += 1
+                    metrics.inc("errors", stage="ocr_server")
+                    self._disconnect()
+                    self.retry_at = time.monotonic() + Config.OCR_SERVER_RETRY_INTERVAL
+                    logger.warning(f"OCR服务（{self.address}）不可用: {e}，{Config.OCR_SERVER_RETRY_INTERVAL}秒内改为在本进程中识别", extra={'save_to_file': True})
+            self.stats["local"] += 1
+            return self._local_engine().ocr(image, cls=cls)
+
+    def _local_engine(self):
+        if self.fallback_engine is None:
+            logger.info("正在本进程中加载OCR引擎...", extra={'save_to_file': True})
+            self.fallback_engine = self.fallback_factory()
+        return self.fallback_engine
+
+    def _connect(self):
+        family, address = parse_address(self.address)
+        sock = socket.socket(family, socket.SOCK_STREAM)
+        sock.settimeout(Config.OCR_SERVER_TIMEOUT)
+        try:
+            sock.connect(address)
+        except OSError:
+            sock.close()
+            raise
+        self.sock = sock
+        logger.info(f"已连接OCR服务: {self.address}（传输方式: {self.transport}）", extra={'save_to_file': True})
+
+    def _disconnect(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+    def _request(self, image):
+        if self.sock is None:
+            self._connect()
+        header, payload = self._encode(np.asarray(image))
+        send_message(self.sock, header, payload)
+        response, _ = recv_message(self.sock)
+        if not response.get("ok"):
+            raise RuntimeError(response.get("error", "未知错误"))
+        metrics.observe_stage("ocr_server_queue", response["queue_ms"])
+        metrics.observe_stage("ocr_server_inference", response["inference_ms"])
+        return response["lines"]
+
+    def _encode(self, image):
+        """按传输方式打包截图，返回(请求头部, 数据)"""
+        header = {"kind": "ocr", "transport": self.transport, "shape": list(image.shape), "dtype": image.dtype.str}
+        if self.transport in ("png", "jpeg"):
+            ok, encoded = cv2.imencode(".png" if self.transport == "png" else ".jpg", image)
+            if not ok:
+                raise ValueError("截图编码失败")
+            return header, encoded.tobytes()
+        if self.transport == "raw":
+            return header, np.ascontiguousarray(image).tobytes()
+        # 共享内存：复用同一块内存，截图变大时重新分配
+        if self.shm is None or self.shm.size < image.nbytes:
+            from multiprocessing import shared_memory
+            self._release_shm()
+            self.shm = shared_memory.SharedMemory(create=True, size=image.nbytes)
+            _created_blocks.add(self.shm._name)
+        np.ndarray(image.shape, image.dtype, buffer=self.shm.buf)[...] = image
+        header["shm_name"] = self.shm.name
+        return header, b""
+
+    def _release_shm(self):
+        if self.shm is not None:
+            _created_blocks.discard(self.shm._name)
+            self.shm.close()
+            self.shm.unlink()
+            self.shm = None
+
+    def close(self):
+        with self.lock:
+            self._disconnect()
+            self._release_shm()
+        logger.info(f"OCR客户端统计: 服务识别{self.stats['remote']}帧，本进程识别{self.stats['local']}帧，"
+                    f"服务不可用{self.stats['failures']}次", extra={'save_to_file': True})
+
+
+def main():
+    parser = argparse.ArgumentParser(description='本机OCR服务，供多个机器人进程共用一组PaddleOCR引擎')
+    parser.add_argument('--address', default=None, help='监听地址，"主机:端口" 或 "unix:/路径"，默认使用OCR_SERVER_ADDRESS')
+    parser.add_argument('--workers', type=int, default=None, help='引擎数量，默认使用OCR_SERVER_WORKERS')
+    parser.add_argument('--batch-size', type=int, default=None, help='每批最多识别的帧数')
+    parser.add_argument('--batch-wait-ms', type=float, default=None, help='收集一批时最多额外等待的毫秒数')
+    args = parser.parse_args()
+
+    server = OCRServer(address=args.address, workers=args.workers,
+                       batch_size=args.batch_size, batch_wait_ms=args.batch_wait_ms)
+    try:
+        server.start()
+    except OSError as e:
+        logger.error(f"启动OCR服务失败（{server.address}）: {e}", extra={'save_to_file': True})
+        sys.exit(1)
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,193 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+OCR引擎健康检查模块
+长时间运行后PaddleOCR的识别耗时和进程内存会逐渐增长，偶尔引擎会开始持续抛出异常，直到重启才恢复，
+而识别失败时recognize_text只返回空列表，机器人会在没有任何提示的情况下不再看到新消息。
+OCRWatchdog记录每帧的识别耗时、连续失败次数和进程常驻内存，超过阈值时返回原因，
+识别耗时随屏幕上的文本行数增长，判断耗时增长时使用每行的平均耗时，聊天变得活跃不会被当作引擎退化；
+由调用方（OCRHandler或OCR服务的工作线程）重新创建引擎，不需要重启机器人，也不影响对话历史等状态。
+"""
+
+import os
+import sys
+import time
+from collections import deque
+from config import logger, Config
+from utils.metrics import metrics
+
+# 回收原因（同时作为wechatbot_ocr_recycles_total的reason标签）
+REASON_NAMES = {"errors": "连续识别失败", "latency": "识别耗时过高", "latency_growth": "识别耗时增长",
+                "memory": "内存占用过高", "memory_growth": "内存增长"}
+
+
+def current_rss_mb():
+    """进程当前的常驻内存（MB），无法获取时返回None"""
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError, AttributeError, IndexError):
+        pass
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss / (1024 * 1024)
+    except ImportError:
+        pass
+    if sys.platform == 'darwin':
+        # 没有psutil时只能取得峰值内存
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (1024 * 1024)
+    return None
+
+
+def median(sorted_values):
+    return sorted_values[len(sorted_values) // 2]
+
+
+class OCRWatchdog:
+    def __init__(self, name="OCR引擎", watch_memory=True):
+        """初始化健康检查
+
+        Args:
+            name: 日志中的引擎名称
+            watch_memory: 是否检查进程内存（同一进程有多个引擎时只需由其中一个检查）
+        """
+        self.name = name
+        self.watch_memory = watch_memory
+        self.window = max(5, Config.OCR_WATCHDOG_WINDOW)
+        self.latencies = deque(maxlen=self.window)
+        # 按文本行数归一化的耗时（每行毫秒数），用于判断耗时增长
+        self.line_latencies = deque(maxlen=self.window)
+        # 引擎创建后第一个完整窗口的每行耗时中位数和当时的进程内存，用于判断增长
+        self.baseline_latency = None
+        self.baseline_rss = None
+        self.error_streak = 0
+        self.last_error = None
+        self.created_at = time.perf_counter()
+        self.last_memory_check = 0.0
+        self.stats = {"frames": 0, "errors": 0, "recycles": 0, "recycle_failures": 0}
+        self.recycle_reasons = {}
+
+    def record(self, latency_ms, error=None, lines=None):
+        """记录一帧的识别结果
+
+        Args:
+            latency_ms: 识别耗时（毫秒）
+            error: 识别失败时的异常，成功时为None
+            lines: 本帧识别出的文本行数，None表示未知（不归一化）
+        """
+        self.stats["frames"] += 1
+        if error is not None:
+            self.error_streak += 1
+            self.last_error = error
+            self.stats["errors"] += 1
+            metrics.inc("ocr_errors")
+            return
+        self.error_streak = 0
+        self.latencies.append(latency_ms)
+        self.line_latencies.append(latency_ms / max(1, lines) if lines is not None else latency_ms)
+        if self.baseline_latency is None and len(self.latencies) == self.window:
+            self.baseline_latency = median(sorted(self.line_latencies))
+            self.baseline_rss = current_rss_mb() if self.watch_memory else None
+            memory = f"，进程内存{self.baseline_rss:.0f}MB" if self.baseline_rss is not None else ""
+            logger.info(f"{self.name}识别耗时基准: 中位数{median(sorted(self.latencies)):.0f}ms"
+                        f"（每行{self.baseline_latency:.1f}ms）{memory}", extra={'save_to_file': True})
+
+    def check(self):
+        """检查是否需要重新创建引擎
+
+        连续失败立即回收；耗时和内存超过阈值时，距离引擎创建至少OCR_WATCHDOG_MIN_RECYCLE_INTERVAL秒才回收，
+        回收后内存没有下降（被分配器保留）时不会反复回收。
+
+        Returns:
+            tuple: (原因, 说明)；不需要回收时返回None
+        """
+        max_streak = Config.OCR_WATCHDOG_MAX_ERROR_STREAK
+        if max_streak > 0 and self.error_streak >= max_streak:
+            return "errors", f"连续{self.error_streak}帧识别失败，最近一次: {self.last_error}"
+
+        now = time.perf_counter()
+        if now - self.created_at < Config.OCR_WATCHDOG_MIN_RECYCLE_INTERVAL:
+            return None
+
+        if len(self.latencies) == self.window:
+            values = sorted(self.latencies)
+            p95 = values[min(len(values) - 1, int(len(values) * 0.95))]
+            if 0 < Config.OCR_WATCHDOG_LATENCY_P95_MS < p95:
+                return "latency", f"最近{len(values)}帧识别耗时p95 {p95:.0f}ms，超过{Config.OCR_WATCHDOG_LATENCY_P95_MS}ms"
+            growth = Config.OCR_WATCHDOG_LATENCY_GROWTH
+            if growth > 0 and self.baseline_latency:
+                per_line = median(sorted(self.line_latencies))
+                if per_line > self.baseline_latency * growth:
+                    return "latency_growth", (f"最近{len(values)}帧每行识别耗时中位数{per_line:.1f}ms，"
+                                              f"为引擎创建后的{per_line / self.baseline_latency:.1f}倍")
+
+        if self.watch_memory and now - self.last_memory_check >= Config.OCR_WATCHDOG_MEMORY_CHECK_INTERVAL:
+            self.last_memory_check = now
+            rss = current_rss_mb()
+            if rss is not None:
+                if 0 < Config.OCR_WATCHDOG_MAX_RSS_MB < rss:
+                    return "memory", f"进程内存{rss:.0f}MB，超过{Config.OCR_WATCHDOG_MAX_RSS_MB}MB"
+                if self.baseline_rss is not None and 0 < Config.OCR_WATCHDOG_RSS_GROWTH_MB < rss - self.baseline_rss:
+                    return "memory_growth", f"进程内存{rss:.0f}MB，比引擎创建后增长{rss - self.baseline_rss:.0f}MB"
+        return None
+
+    def recycled(self, reason, detail, elapsed_ms, success=True):
+        """记录一次引擎回收，并重新开始统计"""
+        name = REASON_NAMES.get(reason, reason)
+        if not success:
+            self.stats["recycle_failures"] += 1
+            # 继续使用旧引擎，稍后再试（连续失败时每积累一轮失败重试一次）
+            self.error_streak = 0
+            self.created_at = time.perf_counter()
+            logger.error(f"{self.name}因{name}重新创建失败，继续使用原引擎（{detail}）", extra={'save_to_file': True})
+            return
+        self.stats["recycles"] += 1
+        self.recycle_reasons[reason] = self.recycle_reasons.get(reason, 0) + 1
+        metrics.inc("ocr_recycles", reason=reason)
+        logger.warning(f"{self.name}因{name}已重新创建（{detail}），耗时{elapsed_ms / 1000:.1f}秒", extra={'save_to_file': True})
+        self.latencies.clear()
+        self.line_latencies.clear()
+        self.baseline_latency = None
+        self.error_streak = 0
+        self.last_error = None
+        self.created_at = time.perf_counter()
+        # 回收后重新测量内存基准：内存没有归还给系统时以新的值为准，不会反复回收
+        self.baseline_rss = None
+        self.last_memory_check = 0.0
+
+    def format_stats(self):
+        stats = self.stats
+        text = f"识别{stats['frames']}帧，失败{stats['errors']}次，重新创建引擎{stats['recycles']}次"
+        if self.recycle_reasons:
+            text += "（" + "，".join(f"{REASON_NAMES.get(reason, reason)}{count}次"
+                                    for reason, count in self.recycle_reasons.items()) + "）"
+        if stats["recycle_failures"]:
+            text += f"，创建失败{stats['recycle_failures']}次"
+        return text
+
+
+def recycle_engine(watchdog, engine, engine_factory, reason, detail):
+    """用engine_factory创建新引擎代替engine并记录回收
+
+    新引擎创建成功后才关闭旧引擎，创建失败时继续使用旧引擎。
+
+    Returns:
+        新引擎；创建失败时返回原来的engine
+    """
+    start = time.perf_counter()
+    try:
+        new_engine = engine_factory()
+    except Exception as e:
+        watchdog.recycled(reason, f"{detail}；创建新引擎出错: {e}", (time.perf_counter() - start) * 1000, success=False)
+        return engine
+    close = getattr(engine, "close", None)
+    if close is not None:
+        try:
+            close()
+        except Exception as e:
+            logger.debug(f"关闭旧OCR引擎出错: {e}")
+    watchdog.recycled(reason, detail, (time.perf_counter() - start) * 1000)
+    return new_engine
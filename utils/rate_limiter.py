@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+回复限流模块
+按发送者、角色和整个群分别维护令牌桶，在检测阶段（调用API之前）限制回复频率，
+避免个别用户连续@某个角色占满API额度和唯一的发送通道。
+每个令牌桶允许短时间内连续回复burst次，之后每分钟恢复per_minute次；被限流时可选地回复一次提示。
+"""
+
+import time
+import threading
+from config import logger, Config
+from utils.metrics import metrics
+
+# 限流维度，检查顺序即此顺序
+SCOPES = ("sender", "role", "group")
+SCOPE_NAMES = {"sender": "发送者", "role": "角色", "group": "群"}
+
+
+class TokenBucket:
+    __slots__ = ('rate', 'burst', 'tokens', 'updated')
+
+    def __init__(self, burst, per_minute, now):
+        """令牌桶：容量burst，每分钟补充per_minute个令牌"""
+        self.rate = per_minute / 60.0
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = now
+
+    def refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return self.tokens
+
+
+class RateLimiter:
+    def __init__(self, is_similar, clock=time.perf_counter):
+        """初始化限流器
+
+        Args:
+            is_similar: 判断两个问题是否相似的函数（ChatHistoryManager.is_similar_question），
+                同一条消息在之后的帧中再次被检测到时沿用第一次的结果，不重复消耗令牌
+            clock: 返回当前时间（秒）的函数，令牌补充和判定记忆都按它计时
+        """
+        self.is_similar = is_similar
+        self.clock = clock
+        # 维度 -> (容量, 每分钟补充数)，容量为0表示不限制该维度
+        self.limits = {
+            "sender": (Config.RATE_LIMIT_SENDER_BURST, Config.RATE_LIMIT_SENDER_PER_MINUTE),
+            "role": (Config.RATE_LIMIT_ROLE_BURST, Config.RATE_LIMIT_ROLE_PER_MINUTE),
+            "group": (Config.RATE_LIMIT_GROUP_BURST, Config.RATE_LIMIT_GROUP_PER_MINUTE),
+        }
+        self.buckets = {}
+        # 当前处于限流中且已发送过提示的(维度, 键)，恢复放行后清除，下次被限流时再提示一次
+        self.notified = set()
+        # 最近判定过的消息：[发送者, 角色, 问题, 是否放行, 最后一次看到的时间]
+        self.decisions = []
+        # 待发送的限流提示：[(发送者, 提示内容)]，由调用方取出后发送
+        self.notices = []
+        self.lock = threading.Lock()
+        self.stats = {"allowed": 0, "throttled": 0, "notices": 0,
+                      "throttled_sender": 0, "throttled_role": 0, "throttled_group": 0}
+
+    def allow(self, sender, role, question):
+        """判断是否允许回复这条消息，允许时消耗各维度的一个令牌
+
+        Returns:
+            bool: 是否允许回复
+        """
+        now = self.clock()
+        with self.lock:
+            decision = self._remembered(sender, role, question, now)
+            if decision is not None:
+                return decision
+
+            keys = {"sender": sender, "role": role, "group": Config.WECHAT_WINDOW_NAME}
+            buckets = []
+            for scope in SCOPES:
+                bucket = self._bucket(scope, keys[scope], now)
+                if bucket is None:
+                    continue
+                if bucket.refill(now) < 1:
+                    self._throttle(scope, keys[scope], sender, role, question, now)
+                    return False
+                buckets.append((scope, bucket))
+            # 所有维度都有令牌时才一起消耗，被某个维度拒绝的消息不占用其他维度的额度
+            for scope, bucket in buckets:
+                bucket.tokens -= 1
+                self.notified.discard((scope, keys[scope]))
+            self.decisions.append([sender, role, question, True, now])
+            self.stats["allowed"] += 1
+            return True
+
+    def take_notices(self):
+        """取出待发送的限流提示"""
+        with self.lock:
+            notices, self.notices = self.notices, []
+        return notices
+
+    def _bucket(self, scope, key, now):
+        burst, per_minute = self.limits[scope]
+        if burst <= 0:
+            return None
+        bucket = self.buckets.get((scope, key))
+        if bucket is None:
+            bucket = self.buckets[(scope, key)] = TokenBucket(burst, per_minute, now)
+        return bucket
+
+    def _throttle(self, scope, key, sender, role, question, now):
+        self.decisions.append([sender, role, question, False, now])
+        self.stats["throttled"] += 1
+        self.stats[f"throttled_{scope}"] += 1
+        metrics.inc("rate_limited", scope=scope)
+        logger.info(f"{SCOPE_NAMES[scope]}{key}回复过于频繁，不回复{sender}的问题: {question[:30]}", extra={'save_to_file': True})
+        if Config.RATE_LIMIT_NOTICE and (scope, key) not in self.notified:
+            self.notified.add((scope, key))
+            template = Config.RATE_LIMIT_NOTICE_MESSAGES.get(scope)
+            if template:
+                self.notices.append((sender, template.format(sender=sender, role=role)))
+                self.stats["notices"] += 1
+                metrics.inc("rate_limit_notices")
+
+    def _remembered(self, sender, role, question, now):
+        """同一条消息（同一发送者、同一角色的相似问题）之前的判定结果，没有则返回None"""
+        memory = Config.RATE_LIMIT_MEMORY
+        kept = [entry for entry in self.decisions if now - entry[4] <= memory]
+        if len(kept) < len(self.decisions):
+            self.decisions = kept
+            # 顺便清理已补满的令牌桶（与新建的桶等价），不活跃的发送者不占用内存
+            self.buckets = {key: bucket for key, bucket in self.buckets.items() if bucket.refill(now) < bucket.burst}
+        for entry in self.decisions:
+            if entry[0] == sender and entry[1] == role and self.is_similar(entry[2], question):
+                # 仍在屏幕上，刷新时间，直到消息滚出窗口后才会被遗忘
+                entry[4] = now
+                return entry[3]
+        return None
+
+    def format_stats(self):
+        stats = self.stats
+        return (f"放行{stats['allowed']}条，限流{stats['throttled']}条（发送者{stats['throttled_sender']}，"
+                f"角色{stats['throttled_role']}，群{stats['throttled_group']}），发送提示{stats['notices']}条")
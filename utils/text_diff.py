@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+OCR文本差异模块
+截图有变化时，大部分OCR文本行通常与上一帧相同（只是新消息把旧消息向上推）。
+这里将本帧的文本行按纵坐标排序后与上一次检测的帧做序列比对（difflib，比较规范化后的文本），
+只把新出现的行以及推断发送者、查找下一行问题所需的上下文行交给触发词检测，
+每帧的检测耗时随新消息数量增长，而不是随聊天窗口的高度增长。
+"""
+
+import time
+from difflib import SequenceMatcher
+from config import Config
+from utils.metrics import metrics
+
+
+def normalize_line(text):
+    """比对用的规范化文本：去除空白并转为小写，OCR结果中的空格变化不会被当作新行"""
+    return "".join(text.split()).lower()
+
+
+def line_top(position):
+    return min(point[1] for point in position)
+
+
+def line_left(position):
+    return min(point[0] for point in position)
+
+
+class TextDiffer:
+    def __init__(self, context_before=None, context_after=None):
+        """初始化文本差异比较器
+
+        Args:
+            context_before: 每个新行之前一并返回的行数（发送者名称通常在消息的上一行）
+            context_after: 每个新行之后一并返回的行数（@之后的问题可能在下一行）
+        """
+        self.context_before = Config.TEXT_DIFF_CONTEXT_BEFORE if context_before is None else context_before
+        self.context_after = Config.TEXT_DIFF_CONTEXT_AFTER if context_after is None else context_after
+        # 上一次检测的帧中规范化后的文本行（按纵坐标排序）
+        self.previous = None
+        self.stats = {"frames": 0, "lines": 0, "scanned": 0}
+
+    def new_lines(self, texts):
+        """返回本帧中需要检测的文本行（新行及其上下文，按纵坐标排序），并以本帧作为下一次比较的基准
+
+        Args:
+            texts: OCR识别结果[(文本, 置信度, 位置)]
+
+        Returns:
+            list: texts的子集（按纵坐标排序）；第一帧或调用reset()之后返回全部文本行
+        """
+        start = time.perf_counter()
+        ordered = sorted(texts, key=lambda item: (line_top(item[2]), line_left(item[2])))
+        keys = [normalize_line(text) for text, _, _ in ordered]
+        previous, self.previous = self.previous, keys
+
+        if previous is None:
+            selected = ordered
+        else:
+            keep = [False] * len(ordered)
+            matcher = SequenceMatcher(None, previous, keys, autojunk=False)
+            for tag, _, _, j1, j2 in matcher.get_opcodes():
+                # insert为新增的行，replace为内容有变化的行（如OCR结果不同或滚动后被截断的行）
+                if tag in ("insert", "replace"):
+                    for j in range(max(0, j1 - self.context_before), min(len(ordered), j2 + self.context_after)):
+                        keep[j] = True
+            selected = [item for item, kept in zip(ordered, keep) if kept]
+
+        self.stats["frames"] += 1
+        self.stats["lines"] += len(texts)
+        self.stats["scanned"] += len(selected)
+        metrics.inc("ocr_lines", len(texts))
+        metrics.inc("ocr_lines_scanned", len(selected))
+        metrics.observe_stage("text_diff", (time.perf_counter() - start) * 1000)
+        return selected
+
+    def reset(self):
+        """丢弃比较基准，下一帧检测全部文本行"""
+        self.previous = None
+
+    def format_stats(self):
+        stats = self.stats
+        ratio = stats["scanned"] / stats["lines"] if stats["lines"] else 0.0
+        return f"比较{stats['frames']}帧，共{stats['lines']}行，检测{stats['scanned']}行（{ratio:.0%}）"
@@ -0,0 +1,236 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+帧追踪记录模块
+为每一帧记录时间戳、截图哈希、OCR原始识别结果、检测结果和各阶段耗时，
+写入按记录数轮转的gzip压缩分段文件（JSONL或msgpack），可选附带缩小后的截图快照。
+记录由后台线程编码和写入，主循环只负责入队；读取函数用于离线回放（见benchmarks/trace_replay.py）。
+"""
+
+import os
+import io
+import glob
+import gzip
+import json
+import time
+import queue
+import base64
+import hashlib
+import threading
+from datetime import datetime
+from config import logger, Config
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+TRACE_FORMATS = ('jsonl', 'msgpack')
+TRACE_FORMAT_VERSION = 1
+
+
+def frame_hash(image):
+    """计算截图内容的短哈希，用于识别重复帧"""
+    if image is None:
+        return None
+    return hashlib.blake2b(image.tobytes(), digest_size=8).hexdigest()
+
+
+def encode_snapshot(image, scale):
+    """将截图缩小后编码为JPEG字节"""
+    import cv2  # 仅在开启快照时需要
+    height, width = image.shape[:2]
+    small = cv2.resize(image, (max(1, int(width * scale)), max(1, int(height * scale))), interpolation=cv2.INTER_AREA)
+    ok, buffer = cv2.imencode('.jpg', small, [cv2.IMWRITE_JPEG_QUALITY, 70])
+    return buffer.tobytes() if ok else None
+
+
+def normalize_ocr_lines(lines):
+    """将PaddleOCR的原始结果转换为可序列化的[文本, 置信度, 位置]列表"""
+    normalized = []
+    for box, (text, confidence) in lines:
+        normalized.append([text, round(float(confidence), 4), [[round(float(x), 1), round(float(y), 1)] for x, y in box]])
+    return normalized
+
+
+class TraceRecorder:
+    def __init__(self, trace_dir=None, fmt=None):
+        """初始化追踪记录器并启动后台写入线程
+
+        Args:
+            trace_dir: 追踪文件目录，默认为Config.TRACE_DIR
+            fmt: 分段格式，"jsonl"或"msgpack"，默认为Config.TRACE_FORMAT
+        """
+        fmt = fmt or Config.TRACE_FORMAT
+        if fmt not in TRACE_FORMATS:
+            raise ValueError(f"不支持的追踪格式: {fmt}")
+        if fmt == 'msgpack' and msgpack is None:
+            logger.warning("未安装msgpack，追踪记录改用JSONL格式", extra={'save_to_file': True})
+            fmt = 'jsonl'
+
+        self.trace_dir = trace_dir or Config.TRACE_DIR
+        os.makedirs(self.trace_dir, exist_ok=True)
+        self.format = fmt
+        self.segment_max_records = Config.TRACE_SEGMENT_MAX_RECORDS
+        self.max_segments = Config.TRACE_MAX_SEGMENTS
+        self.snapshot_every = Config.TRACE_SNAPSHOT_EVERY
+        self.snapshot_scale = Config.TRACE_SNAPSHOT_SCALE
+
+        self.queue = queue.Queue(maxsize=Config.TRACE_QUEUE_SIZE)
+        self.stats = {"recorded": 0, "written": 0, "dropped": 0, "segments": 0, "write_errors": 0}
+
+        self.segment = None
+        self.segment_path = None
+        self.segment_records = 0
+
+        self.closed = False
+        self.thread = threading.Thread(target=self._run, name="TraceRecorder", daemon=True)
+        self.thread.start()
+        logger.info(f"已启用帧追踪记录，格式{self.format}，目录{self.trace_dir}", extra={'save_to_file': True})
+
+    def record(self, frame_no, image, ocr_lines, window_detected, decision, timings):
+        """提交一帧的追踪记录，立即返回；队列已满时丢弃该帧（追踪记录不应拖慢主循环）
+
+        Args:
+            frame_no: 帧序号
+            image: 截图（numpy数组），用于计算哈希和可选快照
+            ocr_lines: PaddleOCR原始识别结果（未经置信度过滤）
+            window_detected: 是否识别到微信窗口名称
+            decision: 检测结果dict（sender、question、role），未检测到消息时为None
+            timings: 各阶段耗时（毫秒），如{"capture": 12.0, "ocr": 350.2, "detect": 0.4}
+        """
+        item = (time.time(), frame_no, image, ocr_lines, window_detected, decision, timings)
+        try:
+            self.queue.put_nowait(item)
+            self.stats["recorded"] += 1
+        except queue.Full:
+            self.stats["dropped"] += 1
+
+    def close(self, timeout=10):
+        """写入剩余记录并关闭当前分段"""
+        if self.closed:
+            return
+        self.queue.put(None)
+        self.thread.join(timeout)
+        self.closed = True
+        logger.info(f"帧追踪记录已停止，{self.format_stats()}", extra={'save_to_file': True})
+
+    def format_stats(self):
+        stats = self.stats
+        return (f"已写入{stats['written']}/{stats['recorded']}帧，丢弃{stats['dropped']}帧，"
+                f"分段{stats['segments']}个，写入错误{stats['write_errors']}次")
+
+    def _build_record(self, item):
+        timestamp, frame_no, image, ocr_lines, window_detected, decision, timings = item
+        record = {
+            "v": TRACE_FORMAT_VERSION,
+            "ts": timestamp,
+            "frame": frame_no,
+            "frame_hash": frame_hash(image),
+            "shape": list(image.shape[:2]) if image is not None else None,
+            "ocr": normalize_ocr_lines(ocr_lines or []),
+            "window_detected": window_detected,
+            "decision": decision,
+            "timings": {stage: round(ms, 3) for stage, ms in timings.items()},
+        }
+        if image is not None and self.snapshot_every > 0 and frame_no % self.snapshot_every == 0:
+            try:
+                snapshot = encode_snapshot(image, self.snapshot_scale)
+            except Exception as e:
+                # 快照是可选内容，失败时停用快照，继续记录其余字段
+                logger.error(f"生成追踪快照失败，已停用快照: {e}", extra={'save_to_file': True})
+                self.snapshot_every = 0
+                snapshot = None
+            if snapshot is not None:
+                record["snapshot"] = snapshot if self.format == 'msgpack' else base64.b64encode(snapshot).decode('ascii')
+        return record
+
+    def _encode(self, record):
+        if self.format == 'msgpack':
+            return msgpack.packb(record, use_bin_type=True)
+        return (json.dumps(record, ensure_ascii=False, separators=(',', ':')) + "\n").encode('utf-8')
+
+    def _open_segment(self):
+        """打开新的分段文件，并删除超出保留数量的旧分段"""
+        started = datetime.now().strftime('%Y%m%d-%H%M%S')
+        sequence = self.stats['segments']
+        while True:
+            # 同一秒内重新启动时避免覆盖已有分段
+            self.segment_path = os.path.join(self.trace_dir, f"trace-{started}-{sequence:04d}.{self.format}.gz")
+            if not os.path.exists(self.segment_path):
+                break
+            sequence += 1
+        self.segment = gzip.open(self.segment_path, 'wb', compresslevel=6)
+        self.segment_records = 0
+        self.stats["segments"] += 1
+
+        if self.max_segments > 0:
+            segments = list_segments(self.trace_dir)
+            for old_path in segments[:max(0, len(segments) - self.max_segments)]:
+                try:
+                    os.remove(old_path)
+                except OSError as e:
+                    logger.warning(f"删除旧追踪分段 {old_path} 失败: {e}", extra={'save_to_file': True})
+
+    def _close_segment(self):
+        if self.segment is not None:
+            self.segment.close()
+            self.segment = None
+
+    def _run(self):
+        """后台线程：编码记录并写入当前分段，达到记录数上限时轮转"""
+        while True:
+            item = self.queue.get()
+            if item is None:
+                self._close_segment()
+                return
+            try:
+                data = self._encode(self._build_record(item))
+                if self.segment is None or self.segment_records >= self.segment_max_records:
+                    self._close_segment()
+                    self._open_segment()
+                self.segment.write(data)
+                self.segment_records += 1
+                self.stats["written"] += 1
+            except Exception as e:
+                self.stats["write_errors"] += 1
+                logger.error(f"写入帧追踪记录失败: {e}", extra={'save_to_file': True})
+
+
+def list_segments(path):
+    """列出目录下的追踪分段（按文件名即时间顺序）；path为单个文件时直接返回"""
+    if os.path.isfile(path):
+        return [path]
+    return sorted(glob.glob(os.path.join(path, "trace-*.jsonl.gz")) + glob.glob(os.path.join(path, "trace-*.msgpack.gz")),
+                  key=os.path.basename)
+
+
+def iter_segment(segment_path):
+    """逐条读取一个追踪分段，最后一条不完整的记录（如进程被强制结束）会被忽略"""
+    with gzip.open(segment_path, 'rb') as f:
+        try:
+            if segment_path.endswith('.msgpack.gz'):
+                if msgpack is None:
+                    raise RuntimeError("读取msgpack格式的追踪分段需要安装msgpack")
+                yield from msgpack.Unpacker(f, raw=False)
+            else:
+                for line in io.TextIOWrapper(f, encoding='utf-8'):
+                    if line.strip():
+                        yield json.loads(line)
+        except (EOFError, ValueError) as e:
+            logger.warning(f"追踪分段 {segment_path} 末尾不完整，已忽略: {e}", extra={'save_to_file': True})
+
+
+def iter_trace(path):
+    """按时间顺序读取目录（或单个分段文件）中的全部追踪记录"""
+    for segment_path in list_segments(path):
+        yield from iter_segment(segment_path)
+
+
+def decode_snapshot(record):
+    """取出记录中的快照JPEG字节，没有快照时返回None"""
+    snapshot = record.get("snapshot")
+    if isinstance(snapshot, str):
+        return base64.b64decode(snapshot)
+    return snapshot
@@ -7,6 +7,7 @@
 """
 
 import time
+import ctypes
 import logging
 import numpy as np
 import pyautogui
@@ -14,11 +15,37 @@ import win32gui
 import win32con
 import cv2
 from config import logger, Config
+from utils.calibration import Calibrator
+from utils.image_diff import regions_differ
+
+
+def wait_until(predicate, timeout, interval=None):
+    """轮询等待条件成立，代替固定时长的sleep
+
+    Args:
+        predicate: 无参函数，返回True表示条件成立
+        timeout: 最长等待时间（秒）
+        interval: 轮询间隔（秒），默认为Config.SEND_POLL_INTERVAL
+
+    Returns:
+        bool: 超时前条件成立返回True
+    """
+    interval = Config.SEND_POLL_INTERVAL if interval is None else interval
+    deadline = time.perf_counter() + timeout
+    while True:
+        if predicate():
+            return True
+        if time.perf_counter() >= deadline:
+            return False
+        time.sleep(interval)
+
 
 class WindowManager:
     def __init__(self):
         """初始化窗口管理器"""
         self.wechat_hwnd = None
+        # 输入框和发送按钮的位置校准，按窗口尺寸和DPI缓存
+        self.calibrator = Calibrator()
     
     def find_wechat_window(self):
         """查找微信窗口句柄"""
@@ -64,7 +91,9 @@ class WindowManager:
                 logger.info("检测到微信窗口已最小化，正在恢复...", extra={'save_to_file': True}) # 添加标记
                 # 恢复窗口
                 win32gui.ShowWindow(hwnd, win32con.SW_RESTORE)
-                time.sleep(0.5)  # 等待窗口恢复
+                # 等待窗口恢复
+                if not wait_until(lambda: not win32gui.IsIconic(hwnd), Config.SEND_FOREGROUND_TIMEOUT):
+                    logger.warning("等待微信窗口恢复超时", extra={'save_to_file': True})
     
     def minimize_window(self, hwnd=None):
         """最小化窗口"""
@@ -84,6 +113,59 @@ class WindowManager:
             return win32gui.IsIconic(hwnd)
         return False
     
+    def is_foreground(self, hwnd=None):
+        """检查窗口是否为前台窗口"""
+        if hwnd is None:
+            hwnd = self.wechat_hwnd
+        return bool(hwnd) and win32gui.GetForegroundWindow() == hwnd
+    
+    def activate_window(self):
+        """恢复并激活微信窗口，轮询确认其成为前台窗口
+
+        Returns:
+            bool: 在Config.SEND_FOREGROUND_TIMEOUT内成为前台窗口返回True
+        """
+        if not self.wechat_hwnd:
+            logger.error("未找到微信窗口，无法激活", extra={'save_to_file': True})
+            return False
+        try:
+            self.restore_window()
+            if self.is_foreground():
+                return True
+            win32gui.SetForegroundWindow(self.wechat_hwnd)
+            if wait_until(self.is_foreground, Config.SEND_FOREGROUND_TIMEOUT):
+                return True
+            logger.error(f"微信窗口在{Config.SEND_FOREGROUND_TIMEOUT}秒内未成为前台窗口", extra={'save_to_file': True})
+            return False
+        except Exception as e:
+            logger.error(f"激活微信窗口失败: {e}", extra={'save_to_file': True})
+            return False
+    
+    def capture_region(self, relative_box):
+        """截取窗口内的相对区域，返回缩小后的灰度图，用于判断区域内容是否变化
+
+        Args:
+            relative_box: (左, 上, 右, 下)，均为窗口宽高的比例（0-1）
+
+        Returns:
+            numpy.ndarray: 灰度图，失败时返回None
+        """
+        rect = self.get_window_rect()
+        if not rect:
+            return None
+        left, top, right, bottom = rect
+        width, height = right - left, bottom - top
+        rel_left, rel_top, rel_right, rel_bottom = relative_box
+        x, y = left + int(width * rel_left), top + int(height * rel_top)
+        w, h = max(1, int(width * (rel_right - rel_left))), max(1, int(height * (rel_bottom - rel_top)))
+        try:
+            image = np.array(pyautogui.screenshot(region=(x, y, w, h)))
+            # 隔行隔列采样，足以判断是否变化，比较耗时更少
+            return cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)[::2, ::2]
+        except Exception as e:
+            logger.debug(f"截取窗口区域失败: {e}")
+            return None
+    
     def capture_wechat_screen(self):
         """截取微信窗口的屏幕截图"""
         # 查找微信窗口
@@ -121,8 +203,44 @@ class WindowManager:
             logger.error(f"截图失败: {e}", extra={'save_to_file': True})
             return None
     
-    def click_chat_input(self):
-        """点击聊天输入框"""
+    def get_window_dpi(self, hwnd=None):
+        """获取窗口所在显示器的DPI，系统不支持时返回96"""
+        if hwnd is None:
+            hwnd = self.wechat_hwnd
+        try:
+            return int(ctypes.windll.user32.GetDpiForWindow(hwnd)) or 96
+        except Exception:
+            return 96
+    
+    def get_relative_point(self, target, width, height):
+        """获取输入框（'input_box'）或发送按钮（'send_button'）的相对位置，窗口尺寸或DPI变化时重新校准"""
+        return self.calibrator.get_relative_point(
+            target, width, height, self.get_window_dpi(), self.capture_wechat_screen)
+    
+    def recalibrate(self):
+        """丢弃当前窗口几何的校准结果，下次点击前重新匹配"""
+        rect = self.get_window_rect()
+        if rect:
+            left, top, right, bottom = rect
+            self.calibrator.forget(right - left, bottom - top, self.get_window_dpi())
+    
+    def click_send_button(self):
+        """点击发送按钮"""
+        rect = self.get_window_rect()
+        if not rect:
+            return False
+        left, top, right, bottom = rect
+        width, height = right - left, bottom - top
+        rel_x, rel_y = self.get_relative_point('send_button', width, height)
+        pyautogui.click(left + int(width * rel_x), top + int(height * rel_y))
+        return True
+    
+    def click_chat_input(self, activate=True):
+        """点击聊天输入框
+
+        Args:
+            activate: 是否先激活窗口（调用方已通过activate_window激活时可传False）
+        """
         if not self.wechat_hwnd:
             logger.error("未找到微信窗口，无法点击聊天输入框", extra={'save_to_file': True})
             return False
@@ -137,21 +255,19 @@ class WindowManager:
             left, top, right, bottom = rect
             width, height = right - left, bottom - top
             
-            # 恢复窗口（如果最小化）
-            self.restore_window()
-            
-            # 激活窗口
-            win32gui.SetForegroundWindow(self.wechat_hwnd)
-            time.sleep(1.0)  # 等待窗口激活
+            # 恢复并激活窗口，轮询确认成为前台窗口，不再固定等待
+            if activate and not self.activate_window():
+                return False
             
-            # 计算聊天输入框的位置
-            chat_x = left + int(width * Config.CHAT_INPUT_BOX_RELATIVE_X)
-            chat_y = top + int(height * Config.CHAT_INPUT_BOX_RELATIVE_Y)
+            # 计算聊天输入框的位置（校准结果按窗口尺寸和DPI缓存，未校准时使用配置的相对位置）
+            rel_x, rel_y = self.get_relative_point('input_box', width, height)
+            chat_x = left + int(width * rel_x)
+            chat_y = top + int(height * rel_y)
             
             # 点击聊天输入框
             logger.info(f"点击聊天输入框位置: ({chat_x}, {chat_y})", extra={'save_to_file': True})
             pyautogui.click(chat_x, chat_y)
-            time.sleep(1.0)  # 确保输入框被激活
+            time.sleep(Config.SEND_CLICK_SETTLE)  # 等待输入框获得焦点
             
             return True
         except Exception as e: